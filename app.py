@@ -1,20 +1,162 @@
 from flask import Flask, render_template, request, jsonify, send_file
 from flask import send_from_directory
 from werkzeug.utils import secure_filename
+import atexit
+import hashlib
+import json
+import logging
 import os
-from datetime import datetime, timedelta
-from main import NetworkAnomalyDetector
-import pandas as pd
-from generate_sample_data import generate_sample_data
-from capture_to_csv import capture_to_csv
+import threading
+from functools import lru_cache
+from datetime import datetime, timezone
+from main import NetworkAnomalyDetector, init_runtime, retrain_model
+from capture_to_csv import capture_to_csv, check_number, CaptureStats
+from utils.metrics import registry as metrics
+from utils.profiling import ProfileSession, profiling_requested
+
+# Heavy modules (pandas, scikit-learn, matplotlib) load on first use inside
+# the detector and the routes, so importing this module is fast.
 
 app = Flask(__name__)
 app.config['UPLOAD_FOLDER'] = 'uploads'
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
+# Longest blocking capture /capture_and_analyze accepts; use /captures for longer ones
+MAX_CAPTURE_SECONDS = 3600
+
+# Set by init_app()
+app_config = {}
+_initialized = False
+_init_lock = threading.Lock()
+
+# Health counters of the most recent (or currently running) capture
+last_capture_stats = None
+
+# Multi-resolution rollups of every scored window, for dashboard range queries (see get_rollups)
+rollups = None
+
+# Concurrent long-lived capture sessions (see get_capture_manager)
+capture_manager = None
+
+# Background retraining triggered by feature drift or /drift/retrain (see get_retrain_scheduler)
+retrain_scheduler = None
+
+def init_app(config_file='config.json'):
+    """Explicit startup: directories, logging and metrics configuration."""
+    global app_config, _initialized
+    with _init_lock:
+        if _initialized:
+            return app
+        init_runtime()
+        # Ensure required directories exist
+        os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
+        app_config = NetworkAnomalyDetector.load_config(config_file)
+        # Stage timers/counters are switched by the `metrics` section of config.json
+        metrics.configure(**app_config.get('metrics', {}))
+        _initialized = True
+    return app
+
+@app.before_request
+def ensure_initialized():
+    # WSGI servers (e.g. gunicorn app:app) import the module without calling init_app()
+    if not _initialized:
+        init_app()
+
+def get_rollups():
+    """Return the rollup store, loading it from disk on first use."""
+    global rollups
+    with _init_lock:
+        if rollups is None:
+            from utils.rollups import RollupStore
+            rollups = RollupStore.load(app_config.get('rollups', {}).get('path', os.path.join('outputs', 'rollups.json')))
+            # Saves are throttled in record_rollups; write what is left on shutdown
+            atexit.register(rollups.save)
+    return rollups
+
+def get_capture_manager():
+    """Return the capture session manager, creating it on first use."""
+    global capture_manager
+    with _init_lock:
+        if capture_manager is None:
+            from utils.capture_manager import CaptureManager
+            capture_manager = CaptureManager(app_config, on_scored=record_rollups, on_drift=on_capture_drift)
+    return capture_manager
+
+def get_retrain_scheduler():
+    """Return the retrain scheduler, creating it on first use."""
+    global retrain_scheduler
+    with _init_lock:
+        if retrain_scheduler is None:
+            from utils.drift import RetrainScheduler
+            retrain_scheduler = RetrainScheduler(
+                retrain_model,
+                cooldown_seconds=app_config.get('drift', {}).get('cooldown_seconds', 3600),
+                on_complete=on_model_retrained,
+            )
+    return retrain_scheduler
+
+def on_model_retrained(result):
+    # Capture sessions keep scoring; their shared detector picks up the new model
+    if capture_manager is not None and capture_manager.scoring is not None:
+        capture_manager.scoring.reload()
+
+def request_drift_retrain(report):
+    """Schedule a retrain on `drift.training_data` when drift monitoring allows automatic retraining.
 
-# Ensure required directories exist
-os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
-os.makedirs('outputs', exist_ok=True)
+    The batch that drifted is never used: it may be the attack or outage
+    being detected. Without a curated training set, retraining waits for
+    a POST to /drift/retrain.
+    """
+    if not report or not report.get('retrain_recommended'):
+        return False
+    options = app_config.get('drift', {})
+    if not options.get('auto_retrain', False):
+        return False
+    if not options.get('training_data'):
+        logging.warning("Retraining recommended but drift.training_data is not set; confirm with POST /drift/retrain")
+        return False
+    return get_retrain_scheduler().request(options['training_data'], reason=f"drift in {', '.join(report['drifted'])}")
+
+def on_capture_drift(report, session):
+    request_drift_retrain(report)
+
+def record_rollups(detector, df, source_id=None, refit=False):
+    """Fold a scored frame into the rollup store, saving it at most every `rollups.save_interval_seconds`.
+
+    `source_id` identifies the analyzed file, so analyzing it again does not add its traffic twice.
+    With `refit`, `df` was scored by a forest fitted on it; such scores are not comparable with
+    the saved model's, so only traffic and anomaly counts are recorded, not score quantiles.
+    """
+    try:
+        store = get_rollups()
+        store.add_windows(
+            df['timestamp'],
+            detector.raw_feature(df, 'bytes_transferred'),
+            detector.raw_feature(df, 'packet_count'),
+            scores=None if refit else df['anomaly_score'].to_numpy(),
+            is_anomaly=(df['anomaly'] == 'Anomaly').to_numpy(),
+            source_id=source_id,
+        )
+        store.maybe_save(app_config.get('rollups', {}).get('save_interval_seconds', 30))
+    except Exception as e:
+        app.logger.error(f"Error updating rollups: {str(e)}")
+
+def file_digest(path):
+    """SHA-1 of a file's contents, read in 1MB chunks."""
+    digest = hashlib.sha1()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def profile_session(name, config):
+    """Profile this request if enabled in config or asked for via the X-Profile header."""
+    profiling_config = config.get('profiling', {})
+    return ProfileSession(
+        name,
+        enabled=profiling_requested(config, request.headers.get('X-Profile')),
+        top_n=profiling_config.get('top_n', 20),
+        output_dir=profiling_config.get('output_dir', 'outputs'),
+    )
 
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in {'csv'}
@@ -28,62 +170,133 @@ def capture_and_analyze():
     try:
         data = request.json or {}
         interface = data.get('interface', '')
-        duration = int(data.get('duration', 30))  # 秒
         bpf = data.get('bpf', 'tcp or udp')
-        max_packets = int(data.get('max_packets', 0))
         tshark_path = data.get('tshark_path') or None
+        sketches = bool(data.get('sketches', False))
 
         if not interface:
             return jsonify({'error': 'Interface is required'}), 400
+        try:
+            # 请求阻塞到抓包结束，因此时长必须为正且有上限
+            duration = check_number('duration', data.get('duration', 30), minimum=1, maximum=MAX_CAPTURE_SECONDS)  # 秒
+            max_packets = check_number('max_packets', data.get('max_packets', 0))
+            workers = check_number('workers', data.get('workers', 1), minimum=1)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
 
         # 生成抓包输出文件（在 uploads 下）
         timestamp_capture = datetime.now().strftime('%Y%m%d_%H%M%S')
         capture_filename = f'network_traffic_capture_{timestamp_capture}.csv'
         capture_path = os.path.join(app.config['UPLOAD_FOLDER'], capture_filename)
 
-        # 抓包（阻塞 duration 秒或直到 max_packets）
-        capture_to_csv(
-            interface=interface,
-            duration=duration,
-            bpf_filter=bpf,
-            output_file=capture_path,
-            max_packets=max_packets,
-            tshark_path=tshark_path,
-        )
-
-        # 复用原有检测流程
+        global last_capture_stats
         detector = NetworkAnomalyDetector()
-        df = detector.load_and_preprocess_data(capture_path)
-        df = detector.detect_anomalies(df)
+        from utils.host_features import HostContext
+        host_context = HostContext.from_config(detector.config)
+        with profile_session('capture_and_analyze', detector.config) as profile:
+            # 抓包（阻塞 duration 秒或直到 max_packets）
+            last_capture_stats = CaptureStats()
+            capture_summary = capture_to_csv(
+                interface=interface,
+                duration=duration,
+                bpf_filter=bpf,
+                output_file=capture_path,
+                max_packets=max_packets,
+                tshark_path=tshark_path,
+                stats=last_capture_stats,
+                sketches=sketches,
+                workers=workers,
+                host_context=host_context,
+            )
 
-        # 生成可视化
-        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-        detector.visualize_results(df)
+            # 复用原有检测流程
+            df = detector.load_and_preprocess_data(capture_path)
+            df = detector.detect_anomalies(df)
 
-        anomaly_count = df['anomaly'].value_counts().get('Anomaly', 0)
-        total_records = len(df)
+            # 生成可视化
+            # Unique per analysis: names the stored results, exports and plots
+            from utils.results_store import new_analysis_id
+            timestamp = new_analysis_id()
+            detector.visualize_results(df, timestamp)
 
-        if anomaly_count > 0:
-            anomalies_df = df[df['anomaly'] == 'Anomaly'].sort_values('anomaly_score')
-            anomaly_file = os.path.join('outputs', f'anomalies_{timestamp}.csv')
-            anomalies_df.to_csv(anomaly_file, index=False)
+            anomaly_count = df['anomaly'].value_counts().get('Anomaly', 0)
+            total_records = len(df)
 
-        recommendations = detector.get_mitigation_recommendations(df)
+            if anomaly_count > 0:
+                detector.export_anomalies(df, timestamp)
+            detector.store_results(df, timestamp)
+
+            recommendations = detector.get_mitigation_recommendations(df)
+            record_rollups(detector, df, refit=True)
+            metrics.incr('requests_capture_and_analyze')
 
         return jsonify({
             'success': True,
             'timestamp': timestamp,
+            'results_url': f'/results/{timestamp}/rows',
             'capture_filename': capture_filename,
             'statistics': {
                 'total_records': total_records,
                 'anomaly_count': int(anomaly_count),
                 'anomaly_percentage': round((anomaly_count / total_records) * 100, 2) if total_records else 0,
             },
-            'recommendations': recommendations
+            'recommendations': recommendations,
+            'capture_stats': {k: v for k, v in capture_summary.items() if k != 'timings'},
+            'timings': {**capture_summary['timings'], **detector.stage_timings},
+            'profile': profile.result
         })
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/capture/stats')
+def capture_stats():
+    """Return health counters of the running or most recent capture."""
+    if last_capture_stats is None:
+        return jsonify({'error': 'No capture has been started'}), 404
+    return jsonify(last_capture_stats.snapshot())
+
+@app.route('/captures', methods=['POST'])
+def start_capture_session():
+    """Start a background capture session on one interface; windows are scored as they are flushed."""
+    try:
+        data = request.json or {}
+        session = get_capture_manager().start(
+            data.get('interface', ''),
+            bpf_filter=data.get('bpf', 'tcp or udp'),
+            tshark_path=data.get('tshark_path') or None,
+            sketches=bool(data.get('sketches', False)),
+            workers=data.get('workers', 1),
+            host_features=data.get('host_features'),
+            limits=data.get('limits'),
+        )
+        return jsonify(session.snapshot()), 201
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/captures')
+def list_capture_sessions():
+    """Status of every capture session and of the shared scoring service."""
+    return jsonify(get_capture_manager().status())
+
+@app.route('/captures/<session_id>')
+def capture_session_status(session_id):
+    try:
+        return jsonify(get_capture_manager().get(session_id).snapshot())
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+
+@app.route('/captures/<session_id>/stop', methods=['POST'])
+def stop_capture_session(session_id):
+    """Stop a session and return its final status once the remaining windows are flushed."""
+    try:
+        return jsonify(get_capture_manager().stop(session_id))
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/analyze', methods=['POST'])
 def analyze():
     if 'file' not in request.files:
@@ -102,36 +315,46 @@ def analyze():
             # Initialize detector
             detector = NetworkAnomalyDetector()
             
-            # Process data
-            df = detector.load_and_preprocess_data(filepath)
-            df = detector.detect_anomalies(df)
+            with profile_session('analyze', detector.config) as profile:
+                # Process data
+                df = detector.load_and_preprocess_data(filepath)
+                df = detector.detect_anomalies(df)
             
-            # Generate visualizations
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            detector.visualize_results(df)
+                # Generate visualizations
+                # Unique per analysis: names the stored results, exports and plots
+                from utils.results_store import new_analysis_id
+                timestamp = new_analysis_id()
+                detector.visualize_results(df, timestamp)
             
-            # Get statistics
-            anomaly_count = df['anomaly'].value_counts().get('Anomaly', 0)
-            total_records = len(df)
+                # Get statistics
+                anomaly_count = df['anomaly'].value_counts().get('Anomaly', 0)
+                total_records = len(df)
             
-            # Save anomalies to CSV
-            if anomaly_count > 0:
-                anomalies_df = df[df['anomaly'] == 'Anomaly'].sort_values('anomaly_score')
-                anomaly_file = os.path.join('outputs', f'anomalies_{timestamp}.csv')
-                anomalies_df.to_csv(anomaly_file, index=False)
+                # Save anomalies to CSV
+                if anomaly_count > 0:
+                    detector.export_anomalies(df, timestamp)
+                # Keep every scored row for /results/<timestamp>/rows
+                detector.store_results(df, timestamp)
             
-            # Get mitigation recommendations
-            recommendations = detector.get_mitigation_recommendations(df)
+                # Get mitigation recommendations
+                recommendations = detector.get_mitigation_recommendations(df)
+                record_rollups(detector, df, source_id=file_digest(filepath), refit=True)
+                request_drift_retrain(detector.drift_report)
+                metrics.incr('requests_analyze')
             
             return jsonify({
                 'success': True,
                 'timestamp': timestamp,
+                'results_url': f'/results/{timestamp}/rows',
                 'statistics': {
                     'total_records': total_records,
                     'anomaly_count': int(anomaly_count),
                     'anomaly_percentage': round((anomaly_count/total_records) * 100, 2)
                 },
-                'recommendations': recommendations
+                'recommendations': recommendations,
+                'drift': detector.drift_report,
+                'timings': detector.stage_timings,
+                'profile': profile.result
             })
             
         except Exception as e:
@@ -139,6 +362,303 @@ def analyze():
         
     return jsonify({'error': 'Invalid file type'}), 400
 
+@app.route('/analyze/batch', methods=['POST'])
+def analyze_batch():
+    """Score many files with the saved model, streaming progress as NDJSON events.
+
+    Inputs are uploaded `files` (CSVs or zip/tar archives) and/or
+    `filenames` of files already in the upload folder (glob patterns such
+    as `network_traffic_capture_*.csv` allowed). One line is written per
+    finished file; the last line holds the merged report.
+    """
+    try:
+        from utils import batch_analysis
+        batch_config = app_config.get('batch', {})
+        from utils.results_store import new_analysis_id
+        batch_id = new_analysis_id('batch_')
+        inputs = []
+        for file in request.files.getlist('files'):
+            filename = secure_filename(file.filename or '')
+            if not filename:
+                continue
+            if not (allowed_file(filename) or batch_analysis.is_archive(filename)):
+                raise ValueError(f"Invalid file type: {filename}")
+            filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+            file.save(filepath)
+            inputs.append(filepath)
+        data = request.get_json(silent=True) or {}
+        filenames = data.get('filenames') or request.form.getlist('filenames')
+        if isinstance(filenames, str):
+            filenames = filenames.split(',')
+        for name in filenames:
+            name = name.strip()
+            if not name or os.path.basename(name) != name or name.startswith('.'):
+                raise ValueError(f"Invalid filename: {name}")
+            inputs.append(os.path.join(app.config['UPLOAD_FOLDER'], name))
+        if not inputs:
+            return jsonify({'error': 'No files given; upload files or pass filenames'}), 400
+
+        extract_dir = os.path.join(batch_config.get('extract_dir', os.path.join('uploads', 'batches')), batch_id)
+        # Limits are enforced while archives are unpacked, not afterwards
+        files = batch_analysis.expand_inputs(
+            inputs, extract_dir,
+            max_files=batch_config.get('max_files', 500),
+            max_bytes=batch_config.get('max_extract_mb', 1024) * 1024 * 1024,
+        )
+        if not files:
+            raise ValueError("No CSV files found in the given inputs")
+        events = batch_analysis.run_batch(
+            files,
+            workers=batch_config.get('workers', 0),
+            batch_id=batch_id,
+            output_dir=batch_config.get('output_dir', 'outputs'),
+        )
+        # Loads (or fits) the model before the response starts, so failures still get a status code
+        first = next(events)
+
+        def stream():
+            yield json.dumps(first, default=str) + '\n'
+            for event in events:
+                yield json.dumps(event, default=str) + '\n'
+            metrics.incr('requests_analyze_batch')
+
+        return app.response_class(stream(), mimetype='application/x-ndjson')
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/drift')
+def drift_status():
+    """Drift of live features and scores against the saved model's training snapshot."""
+    try:
+        from utils.drift import DriftMonitor
+        # The detector's config includes host features when they are enabled
+        monitor = DriftMonitor.shared(NetworkAnomalyDetector().config)
+        if monitor is None:
+            return jsonify({'error': 'Drift monitoring is disabled'}), 400
+        with monitor.lock:
+            report = monitor.report()
+        return jsonify({'report': report, 'retrain': get_retrain_scheduler().status()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/drift/retrain', methods=['POST'])
+def drift_retrain():
+    """Retrain in the background on `drift.training_data` or a chosen upload (CSV or rotated-capture manifest)."""
+    try:
+        data = request.get_json(silent=True) or {}
+        filename = secure_filename(data.get('filename', ''))
+        if filename:
+            path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
+        else:
+            path = app_config.get('drift', {}).get('training_data')
+            if not path:
+                return jsonify({'error': 'filename is required when drift.training_data is not set'}), 400
+        if not os.path.exists(path):
+            return jsonify({'error': f'File not found: {filename or path}'}), 404
+        if not get_retrain_scheduler().request(path, reason='manual', force=True):
+            return jsonify({'error': 'A retrain is already running'}), 409
+        return jsonify(get_retrain_scheduler().status()), 202
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/rollups')
+def rollup_series():
+    """Traffic/anomaly series for a time range, served from the coarsest sufficient rollup level."""
+    try:
+        end = parse_time_arg(request.args.get('end'), default=datetime.now().timestamp())
+        start = parse_time_arg(request.args.get('start'), default=end - 24 * 3600)
+        max_points = int(request.args.get('max_points', 500))
+        level = request.args.get('level')
+        return jsonify(get_rollups().query(start, end, max_points=max_points, level=level))
+    except Exception as e:
+        return jsonify({'error': str(e)}), 400
+
+def parse_time_arg(value, default):
+    """Parse an epoch-seconds or ISO-8601 query argument into epoch seconds (naive = UTC)."""
+    if not value:
+        return int(default)
+    try:
+        return int(float(value))
+    except ValueError:
+        ts = datetime.fromisoformat(value.replace('Z', '+00:00'))
+        if ts.tzinfo is None:
+            ts = ts.replace(tzinfo=timezone.utc)
+        return int(ts.timestamp())
+
+@app.route('/anomalies')
+def query_anomalies():
+    """Search stored anomalies with filters and pagination, or aggregate them with group_by."""
+    try:
+        from utils.anomaly_store import AnomalyStore
+        store_config = app_config.get('anomaly_store', {})
+        store = AnomalyStore(store_config.get('path', os.path.join('outputs', 'anomalies.db')))
+        filters = {
+            'protocol': request.args.get('protocol'),
+            'source_ip': request.args.get('source_ip'),
+            'source_port': request.args.get('source_port', type=int),
+            'destination_port': request.args.get('destination_port', type=int),
+            'analysis_id': request.args.get('analysis_id'),
+            'min_score': request.args.get('min_score', type=float),
+            'max_score': request.args.get('max_score', type=float),
+        }
+        if request.args.get('start'):
+            filters['start'] = parse_time_arg(request.args['start'], default=0)
+        if request.args.get('end'):
+            filters['end'] = parse_time_arg(request.args['end'], default=0)
+
+        group_by = request.args.get('group_by')
+        if group_by:
+            return jsonify(store.aggregate(group_by, filters, limit=request.args.get('limit', 100, type=int)))
+
+        limit = min(request.args.get('limit', 100, type=int), 1000)
+        offset = request.args.get('offset', 0, type=int)
+        order = request.args.get('order', 'time')
+        return jsonify(store.query(filters, limit=limit, offset=offset, order=order))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+def get_results_store():
+    from utils.results_store import ResultsStore
+    results_config = app_config.get('results_store', {})
+    return ResultsStore(
+        results_config.get('path', os.path.join('outputs', 'results.db')),
+        max_analyses=results_config.get('max_analyses', 20),
+    )
+
+@app.route('/results')
+def list_results():
+    """Analyses whose scored rows are kept in the results store."""
+    try:
+        return jsonify({'analyses': get_results_store().analyses()})
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/results/<analysis_id>/rows')
+def stream_results(analysis_id):
+    """Stream an analysis' scored rows as NDJSON or CSV, filtered server-side and paged by cursor.
+
+    The rows are read from the results store batch by batch while the
+    response is written. With `limit`, the cursor of the next page is
+    returned in the X-Next-Cursor header (absent on the last page).
+    """
+    try:
+        from utils import results_store
+        store = get_results_store()
+        store.get(analysis_id)
+        fmt = request.args.get('format', 'ndjson')
+        if fmt not in ('ndjson', 'csv'):
+            raise ValueError(f"Unsupported format '{fmt}'. Use ndjson or csv")
+        filters = {
+            'protocol': request.args.get('protocol'),
+            'source_ip': request.args.get('source_ip'),
+            'destination_ip': request.args.get('destination_ip'),
+            'source_port': request.args.get('source_port', type=int),
+            'destination_port': request.args.get('destination_port', type=int),
+            'min_score': request.args.get('min_score', type=float),
+            'max_score': request.args.get('max_score', type=float),
+        }
+        if request.args.get('anomalies_only', '').lower() in ('1', 'true', 'yes'):
+            filters['anomalies_only'] = 1
+        if request.args.get('start'):
+            filters['start'] = parse_time_arg(request.args['start'], default=0)
+        if request.args.get('end'):
+            filters['end'] = parse_time_arg(request.args['end'], default=0)
+        order = request.args.get('order', 'time')
+        limit = request.args.get('limit', 0, type=int)
+        cursor = request.args.get('cursor')
+
+        batches = store.iter_batches(analysis_id, filters, order=order, cursor=cursor, limit=limit)
+        next_cursor = store.next_cursor(analysis_id, filters, order=order, cursor=cursor, limit=limit) if limit > 0 else None
+        if fmt == 'csv':
+            response = app.response_class(results_store.csv_chunks(batches), mimetype='text/csv')
+            response.headers['Content-Disposition'] = f'attachment; filename=results_{analysis_id}.csv'
+        else:
+            response = app.response_class(results_store.ndjson_chunks(batches), mimetype='application/x-ndjson')
+        if next_cursor:
+            response.headers['X-Next-Cursor'] = next_cursor
+        metrics.incr('requests_results_stream')
+        return response
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@lru_cache(maxsize=128)
+def _results_series(analysis_id, created_at, names, points, method, start, end):
+    """Downsampled series of one stored analysis; `created_at` keys the cache to that version of it."""
+    import numpy as np
+    from utils.downsample import downsample
+    timestamps, columns = get_results_store().series(analysis_id, names, start, end)
+    series = {}
+    for name, values in columns.items():
+        valid = ~np.isnan(values)
+        x, y = timestamps[valid], values[valid]
+        kept = downsample(x, y, points, method)
+        series[name] = [[int(t), round(float(v), 6)] for t, v in zip(x[kept], y[kept])]
+    anomalies = []
+    if 'anomaly_count' in columns and 'anomaly_score' in columns:
+        # Every anomalous timestamp up to `points`, most anomalous first, so markers survive downsampling
+        flagged = np.nonzero(columns['anomaly_count'] > 0)[0]
+        flagged = flagged[np.argsort(columns['anomaly_score'][flagged], kind='stable')[:points]]
+        anomalies = [[int(timestamps[i]), round(float(columns['anomaly_score'][i]), 6), int(columns['anomaly_count'][i])] for i in np.sort(flagged)]
+    return {
+        'analysis_id': analysis_id,
+        'method': method,
+        'points': points,
+        'timestamps': len(timestamps),
+        'start': int(timestamps[0]) if len(timestamps) else None,
+        'end': int(timestamps[-1]) if len(timestamps) else None,
+        'series': series,
+        'anomalies': anomalies,
+    }
+
+@app.route('/results/<analysis_id>/series')
+def results_series(analysis_id):
+    """Traffic and anomaly-score time series of an analysis, downsampled server-side for charts.
+
+    Rows sharing a timestamp are aggregated first (sums for traffic, the
+    minimum score), then each series is reduced to about `points` points
+    with LTTB or min/max bucketing. Responses are cached per analysis and
+    arguments, and carry an ETag so unchanged charts revalidate with 304.
+    """
+    try:
+        from utils.downsample import METHODS
+        record = get_results_store().get(analysis_id)
+        names = tuple(request.args.get('series', 'bytes_transferred,packet_count,anomaly_score,anomaly_count').split(','))
+        points = min(max(request.args.get('points', 500, type=int), 3), 10000)
+        method = request.args.get('method', 'lttb')
+        if method not in METHODS:
+            raise ValueError(f"Unsupported method '{method}'. Use one of: {list(METHODS)}")
+        start = parse_time_arg(request.args['start'], default=0) if request.args.get('start') else None
+        end = parse_time_arg(request.args['end'], default=0) if request.args.get('end') else None
+        key = (analysis_id, record['created_at'], names, points, method, start, end)
+        etag = hashlib.sha1(repr(key).encode('utf-8')).hexdigest()
+        if request.if_none_match.contains(etag):
+            response = app.response_class(status=304)
+        else:
+            response = jsonify(_results_series(*key))
+        response.set_etag(etag)
+        response.cache_control.private = True
+        response.cache_control.max_age = 60
+        return response
+    except KeyError as e:
+        return jsonify({'error': str(e)}), 404
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/metrics')
+def prometheus_metrics():
+    """Expose stage timers and counters in Prometheus text format."""
+    return app.response_class(metrics.to_prometheus(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/download/<timestamp>')
 def download(timestamp):
     try:
@@ -177,6 +697,7 @@ def generate_data():
         filename = f'network_traffic_{timestamp}.csv'
         
         # Generate sample data
+        from generate_sample_data import generate_sample_data
         df = generate_sample_data(
             start_date=start_date,
             duration_hours=duration,
@@ -215,4 +736,5 @@ def flutter_static(filename):
     return send_from_directory(FLUTTER_WEB_DIR, filename)
 
 if __name__ == '__main__':
+    init_app()
     app.run(host='0.0.0.0', port=5000, debug=True)
\ No newline at end of file
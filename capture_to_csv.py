@@ -1,11 +1,18 @@
 # capture_to_csv.py
 import csv
 import argparse
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
 from collections import defaultdict
 import asyncio
 import shutil
+import logging
+import math
+import threading
+import time
+from utils.metrics import registry as metrics
+from utils.sketches import SpaceSaving, WindowSketch
+from utils.timestamps import NS_PER_SECOND, iso_utc, to_epoch_ns
 
 UPLOAD_DIR = os.path.join(os.path.dirname(__file__), 'uploads')
 
@@ -32,12 +39,34 @@ def safe_length(packet):
         except Exception:
             return ''
 
-def aggregate_rows(rows, window_seconds=30):
-    """将抓到的原始报文按 (src_ip, src_port, dst_ip, dst_port, protocol, 时间窗口) 聚合，
-    计算 bytes_transferred、packet_count、connection_duration 等特征。
-    rows: [ts, src_ip, src_port, dst_ip, dst_port, proto, length, info]
+# TCP 标志位
+TCP_FIN = 0x01
+TCP_SYN = 0x02
+TCP_RST = 0x04
+SEQ_MASK = 0xFFFFFFFF
+
+
+def safe_get_tcp_fields(packet):
+    """读取 TCP 头部的 (flags, seq, payload_len)；非 TCP 或字段缺失时返回 None。
+
+    只访问已解析的头部字段，不触发对载荷的进一步解析。
     """
-    agg = defaultdict(lambda: {
+    if not hasattr(packet, 'tcp'):
+        return None
+    try:
+        tcp = packet.tcp
+        flags = int(str(getattr(tcp, 'flags', '0')), 0)
+        seq = getattr(tcp, 'seq_raw', None)
+        if seq is None:
+            seq = getattr(tcp, 'seq', 0)
+        payload_len = int(getattr(tcp, 'len', 0) or 0)
+        return flags, int(seq), payload_len
+    except Exception:
+        return None
+
+
+def _new_flow_state():
+    return {
         'first_ts': None,
         'last_ts': None,
         'bytes_sum': 0,
@@ -45,39 +74,159 @@ def aggregate_rows(rows, window_seconds=30):
         'src_port': None,
         'dst_port': None,
         'protocol': None,
-    })
+        # TCP 计数（每个流窗口只保留常数大小的状态；序号状态在连接表中）
+        'tcp_packets': 0,
+        'syn': 0,
+        'fin': 0,
+        'rst': 0,
+        'retransmissions': 0,
+        'out_of_order': 0,
+    }
+
+
+def _update_tcp_state(d, conn, flags, seq, payload_len):
+    """按序号跟踪单向连接：已确认过的序号段再次出现视为重传，跳过期望序号视为乱序。
+
+    d 为流窗口的计数，conn 为连接表中该方向的序号状态（跨窗口、与 highest_layer 无关）。
+    """
+    d['tcp_packets'] += 1
+    if flags & TCP_SYN:
+        d['syn'] += 1
+    if flags & TCP_FIN:
+        d['fin'] += 1
+    if flags & TCP_RST:
+        d['rst'] += 1
+
+    # SYN/FIN 各占一个序号；纯 ACK 不占序号，不参与判断
+    seg_len = payload_len + (1 if flags & TCP_SYN else 0) + (1 if flags & TCP_FIN else 0)
+    if seg_len <= 0:
+        return
+    seq_end = (seq + seg_len) & SEQ_MASK
+    expected = conn['next_seq']
+    if expected is None:
+        conn['next_seq'] = seq_end
+        return
+    # 32 位序号回绕下的比较：delta 为 seq 相对 expected 的有符号偏移
+    delta = (seq - expected) & SEQ_MASK
+    if delta >= 0x80000000:
+        # seq 落在已发送范围内：重传（全部或部分重叠）
+        d['retransmissions'] += 1
+        end_delta = (seq_end - expected) & SEQ_MASK
+        if 0 < end_delta < 0x80000000:
+            conn['next_seq'] = seq_end
+    elif delta > 0:
+        # 出现序号空洞：之前的报文丢失或乱序到达
+        d['out_of_order'] += 1
+        conn['next_seq'] = seq_end
+    else:
+        conn['next_seq'] = seq_end
+
+
+def _finalize_flow(timestamp, src_ip, src_port, dst_ip, dst_port, proto, d):
+    """把单个流窗口的累计状态转换为输出行。timestamp 为已格式化的窗口起点（UTC ISO 字符串）。"""
+    first_ts = d['first_ts']
+    last_ts = d['last_ts']
+    if first_ts is not None and last_ts is not None:
+        duration = (last_ts - first_ts) / NS_PER_SECOND
+    else:
+        duration = 1.0
+    if duration <= 0:
+        duration = 1.0
+
+    bytes_transferred = d['bytes_sum']
+    packet_count = d['packet_count']
+    bytes_per_packet = bytes_transferred / packet_count if packet_count > 0 else 0.0
+    packets_per_second = packet_count / duration if duration > 0 else 0.0
+
+    # 重传率与标志位比例基于 TCP 头部字段；非 TCP 流为 0.0
+    tcp_packets = d['tcp_packets']
+    retransmission_rate = d['retransmissions'] / tcp_packets if tcp_packets else 0.0
+
+    return {
+        'timestamp': timestamp,
+        'bytes_transferred': bytes_transferred,
+        'packet_count': packet_count,
+        'connection_duration': duration,
+        'source_port': src_port,
+        'destination_port': dst_port,
+        'retransmission_rate': retransmission_rate,
+        'protocol': proto,
+        'bytes_per_packet': bytes_per_packet,
+        'packets_per_second': packets_per_second,
+        'syn_ratio': d['syn'] / tcp_packets if tcp_packets else 0.0,
+        'fin_ratio': d['fin'] / tcp_packets if tcp_packets else 0.0,
+        'rst_ratio': d['rst'] / tcp_packets if tcp_packets else 0.0,
+        'out_of_order_rate': d['out_of_order'] / tcp_packets if tcp_packets else 0.0,
+        'source_ip': src_ip,
+        'destination_ip': dst_ip,
+    }
+
+
+def aggregate_rows(rows, window_seconds=30):
+    """将抓到的原始报文按 (src_ip, src_port, dst_ip, dst_port, protocol, 时间窗口) 聚合，
+    计算 bytes_transferred、packet_count、connection_duration 等特征。
+    rows: [ts, src_ip, src_port, dst_ip, dst_port, proto, length, info]
+    ts 可以是 ISO 字符串、epoch 秒或纳秒整数；无时区的时间按 UTC 处理。
+    """
+    aggregator = RollingAggregator(window_seconds=window_seconds)
 
     for ts, src_ip, src_port, dst_ip, dst_port, proto, length, info in rows:
         if not ts:
             continue
         try:
-            ts_dt = datetime.fromisoformat(str(ts))
+            ts_ns = to_epoch_ns(ts)
         except Exception:
             # 时间解析失败，跳过该报文
             continue
+        aggregator.add_packet(ts_ns, src_ip, src_port, dst_ip, dst_port, proto, length)
 
-        # 以 window_seconds 为粒度做时间窗口，例如 30 秒
-        try:
-            ts_epoch = ts_dt.timestamp()
-            window_start_epoch = (ts_epoch // window_seconds) * window_seconds
-            window_start = datetime.fromtimestamp(window_start_epoch)
-        except Exception:
-            # timestamp 异常时退化为按分钟窗口
-            window_start = ts_dt.replace(second=0, microsecond=0)
+    return aggregator.flush_all()
 
-        key = (src_ip, src_port, dst_ip, dst_port, proto, window_start)
-        d = agg[key]
 
-        d['src_port'] = src_port
-        d['dst_port'] = dst_port
-        d['protocol'] = proto
+# 新增：实时滚动聚合器，用于逐包聚合并在完成的时间窗口时刷写到磁盘
+class RollingAggregator:
+    """逐包聚合器。时间统一为 UTC 纳秒整数，流状态按窗口起点分桶，
+    刷新时只需检查窗口键，不必遍历所有流；只在输出时把窗口起点转换为 ISO 字符串。
+    """
 
-        if d['first_ts'] is None or ts_dt < d['first_ts']:
-            d['first_ts'] = ts_dt
-        if d['last_ts'] is None or ts_dt > d['last_ts']:
-            d['last_ts'] = ts_dt
+    def __init__(self, window_seconds=30, sketches=False, tcp_idle_seconds=300):
+        self.window_seconds = window_seconds
+        self.window_ns = int(window_seconds * NS_PER_SECOND)
+        # TCP 连接表：(src_ip, src_port, dst_ip, dst_port) -> {'next_seq', 'last_ts'}。
+        # 只记录带 TCP 头部的报文，因此键中的传输层协议固定为 TCP；与窗口和 highest_layer 无关，
+        # 同一连接的 TCP/TLS 报文共用序号状态。与上一报文间隔超过 tcp_idle_seconds 的连接视为新连接，
+        # 刷新窗口时只清除此后不会再被使用的空闲连接以释放内存。
+        self.tcp_connections = {}
+        self.tcp_idle_ns = int(tcp_idle_seconds * NS_PER_SECOND)
+        # 可选的固定内存流式草图：每个窗口的去重源 IP / 目的端口（HyperLogLog）与 Top talker（Space-Saving）
+        self.sketches = sketches
+        self.window_sketches = {}
+        self.top_talkers = SpaceSaving(k=32) if sketches else None
+        # window_start_ns -> {(src_ip, src_port, dst_ip, dst_port, proto): 流状态}
+        self.windows = {}
+        self._active = 0
+
+    def add_packet(self, ts, src_ip, src_port, dst_ip, dst_port, proto, length, tcp=None):
+        """ts: UTC 纳秒整数（其他格式经 to_epoch_ns 转换）；tcp: 可选的 (flags, seq, payload_len)，由 safe_get_tcp_fields 提供。"""
+        ts_ns = ts if type(ts) is int else to_epoch_ns(ts)
+        window_start = ts_ns - ts_ns % self.window_ns
+        flows = self.windows.get(window_start)
+        if flows is None:
+            flows = self.windows[window_start] = {}
+        key = (src_ip, src_port, dst_ip, dst_port, proto)
+        d = flows.get(key)
+        if d is None:
+            d = flows[key] = _new_flow_state()
+            d['src_port'] = src_port
+            d['dst_port'] = dst_port
+            d['protocol'] = proto
+            self._active += 1
+
+        if d['first_ts'] is None or ts_ns < d['first_ts']:
+            d['first_ts'] = ts_ns
+        if d['last_ts'] is None or ts_ns > d['last_ts']:
+            d['last_ts'] = ts_ns
 
-        # 累加字节和包数
         try:
             l = int(length)
         except Exception:
@@ -88,155 +237,233 @@ def aggregate_rows(rows, window_seconds=30):
         d['bytes_sum'] += l
         d['packet_count'] += 1
 
-    aggregated = []
-    for (src_ip, src_port, dst_ip, dst_port, proto, window_start), d in agg.items():
-        first_ts = d['first_ts']
-        last_ts = d['last_ts']
-        if first_ts and last_ts:
-            duration = (last_ts - first_ts).total_seconds()
-        else:
-            duration = 1.0
-        if duration <= 0:
-            duration = 1.0
-
-        bytes_transferred = d['bytes_sum']
-        packet_count = d['packet_count']
-        bytes_per_packet = bytes_transferred / packet_count if packet_count > 0 else 0.0
-        packets_per_second = packet_count / duration if duration > 0 else 0.0
-
-        # 目前不从 TCP 底层字段计算重传率，先设为 0.0
-        retransmission_rate = 0.0
-
-        aggregated.append({
-            'timestamp': window_start.isoformat(),
-            'bytes_transferred': bytes_transferred,
-            'packet_count': packet_count,
-            'connection_duration': duration,
-            'source_port': src_port,
-            'destination_port': dst_port,
-            'retransmission_rate': retransmission_rate,
-            'protocol': proto,
-            'bytes_per_packet': bytes_per_packet,
-            'packets_per_second': packets_per_second,
-        })
-
-    return aggregated
-
+        if tcp is not None:
+            conn_key = (src_ip, src_port, dst_ip, dst_port)
+            conn = self.tcp_connections.get(conn_key)
+            if conn is None or ts_ns - conn['last_ts'] > self.tcp_idle_ns:
+                # 空闲超时按报文间隔判断，结果与何时清除连接表无关（分片模式下各工作进程刷新时机不同）
+                conn = self.tcp_connections[conn_key] = {'next_seq': None, 'last_ts': ts_ns}
+            elif ts_ns > conn['last_ts']:
+                conn['last_ts'] = ts_ns
+            _update_tcp_state(d, conn, *tcp)
+
+        if self.sketches:
+            sketch = self.window_sketches.get(window_start)
+            if sketch is None:
+                sketch = self.window_sketches[window_start] = WindowSketch()
+            sketch.add(src_ip, dst_port, l)
+            self.top_talkers.add(src_ip, l)
+
+    def active_flows(self):
+        return self._active
+
+    def flush_older_than(self, cutoff):
+        """刷新所有 window_start < cutoff 的窗口（cutoff 为 UTC 纳秒整数），按窗口时间顺序输出。"""
+        cutoff_ns = cutoff if type(cutoff) is int else to_epoch_ns(cutoff)
+        ready = sorted(start for start in self.windows if start < cutoff_ns)
+        if not ready:
+            return []
+        to_flush = []
+        for window_start, timestamp in zip(ready, iso_utc(ready)):
+            flows = self.windows.pop(window_start)
+            self._active -= len(flows)
+            # 每个窗口只估算一次草图特征，附加到该窗口的所有流上
+            features = {}
+            if self.sketches:
+                sketch = self.window_sketches.pop(window_start, None)
+                features = sketch.features() if sketch else {}
+            for (src_ip, src_port, dst_ip, dst_port, proto), d in flows.items():
+                row = _finalize_flow(timestamp, src_ip, src_port, dst_ip, dst_port, proto, d)
+                row['window_start_ns'] = window_start
+                row.update(features)
+                to_flush.append(row)
+        self._evict_idle_connections(cutoff_ns - self.tcp_idle_ns)
+        return to_flush
 
-# 新增：实时滚动聚合器，用于逐包聚合并在完成的时间窗口时刷写到磁盘
-class RollingAggregator:
-    def __init__(self, window_seconds=30):
-        self.window_seconds = window_seconds
-        self.agg = defaultdict(lambda: {
-            'first_ts': None,
-            'last_ts': None,
-            'bytes_sum': 0,
-            'packet_count': 0,
-            'src_port': None,
-            'dst_port': None,
-            'protocol': None,
-        })
-
-    def _window_start(self, ts_dt: datetime):
-        try:
-            ts_epoch = ts_dt.timestamp()
-            window_start_epoch = (ts_epoch // self.window_seconds) * self.window_seconds
-            # If the incoming datetime is timezone-aware, preserve tzinfo when creating window start
-            if getattr(ts_dt, 'tzinfo', None):
-                return datetime.fromtimestamp(window_start_epoch, tz=ts_dt.tzinfo)
-            return datetime.fromtimestamp(window_start_epoch)
-        except Exception:
-            return ts_dt.replace(second=0, microsecond=0)
+    def _evict_idle_connections(self, before_ns):
+        idle = [key for key, conn in self.tcp_connections.items() if conn['last_ts'] < before_ns]
+        for key in idle:
+            del self.tcp_connections[key]
 
-    def add_packet(self, ts_dt: datetime, src_ip, src_port, dst_ip, dst_port, proto, length):
-        key = (src_ip, src_port, dst_ip, dst_port, proto, self._window_start(ts_dt))
-        d = self.agg[key]
-        d['src_port'] = src_port
-        d['dst_port'] = dst_port
-        d['protocol'] = proto
+    def flush_all(self):
+        # 刷新剩下的所有窗口
+        if not self.windows:
+            return []
+        return self.flush_older_than(max(self.windows) + 1)
 
-        if d['first_ts'] is None or ts_dt < d['first_ts']:
-            d['first_ts'] = ts_dt
-        if d['last_ts'] is None or ts_dt > d['last_ts']:
-            d['last_ts'] = ts_dt
 
-        try:
-            l = int(length)
-        except Exception:
-            l = 0
-        if l < 0:
-            l = 0
+class CaptureStats:
+    """抓包链路健康计数器：收到/解析/跳过（按原因）的报文数、活跃流、输出窗口、写入延迟与写入失败次数。
 
-        d['bytes_sum'] += l
-        d['packet_count'] += 1
+    计数在抓包线程中更新，按 report_interval 秒周期性写日志并同步到 metrics 注册表，
+    snapshot() 可在其他线程（如 Flask 请求）中读取。
+    """
 
-    def flush_older_than(self, cutoff_dt: datetime):
-        # 刷新所有 window_start < cutoff_dt
-        to_flush = []
-        for (src_ip, src_port, dst_ip, dst_port, proto, window_start), d in list(self.agg.items()):
-            should_flush = False
-            try:
-                # normal comparison for naive/aware datetimes with matching tzinfo
-                if window_start < cutoff_dt:
-                    should_flush = True
-            except TypeError:
-                # fallback: compare by epoch timestamps to handle naive vs aware datetimes
+    def __init__(self, report_interval=10.0):
+        self.report_interval = report_interval
+        self.started_at = time.time()
+        self.finished_at = None
+        self.packets_seen = 0
+        self.packets_parsed = 0
+        self.packets_skipped = defaultdict(int)
+        self.flows_active = 0
+        self.windows_emitted = 0
+        self.rows_written = 0
+        self.write_seconds = 0.0
+        self.write_max_seconds = 0.0
+        self.write_batches = 0
+        # 刷出/写入失败次数（不是报文跳过原因）；失败的窗口保留到下次写入时重试
+        self.write_errors = 0
+        self.rows_pending = 0
+        self._last_report = time.monotonic()
+        self._published = {}
+        # 抓包结束原因：completed / stopped / 触发的资源限制
+        self.stop_reason = None
+
+    def skip(self, reason):
+        self.packets_skipped[reason] += 1
+
+    def record_write(self, rows, seconds):
+        self.rows_written += rows
+        self.write_batches += 1
+        self.write_seconds += seconds
+        if seconds > self.write_max_seconds:
+            self.write_max_seconds = seconds
+
+    def maybe_report(self):
+        now = time.monotonic()
+        if now - self._last_report >= self.report_interval:
+            self._last_report = now
+            self.report()
+
+    def report(self, final=False):
+        snap = self.snapshot()
+        label = 'Capture summary' if final else 'Capture progress'
+        logging.info(
+            f"{label}: seen={snap['packets_seen']} parsed={snap['packets_parsed']} "
+            f"skipped={snap['packets_skipped']} flows_active={snap['flows_active']} "
+            f"windows={snap['windows_emitted']} rows={snap['rows_written']} "
+            f"write_errors={snap['write_errors']} "
+            f"rate={snap['packet_rate']}/s write_avg_ms={snap['write_avg_ms']}"
+        )
+        self._publish(snap)
+
+    def _publish(self, snap):
+        # 以增量方式同步计数器，避免重复累计
+        counters = {
+            'capture_packets_seen': snap['packets_seen'],
+            'capture_packets_parsed': snap['packets_parsed'],
+            'capture_rows_written': snap['rows_written'],
+            'capture_write_errors': snap['write_errors'],
+        }
+        for reason, count in snap['packets_skipped'].items():
+            counters[f'capture_packets_skipped_{reason}'] = count
+        for name, value in counters.items():
+            delta = value - self._published.get(name, 0)
+            if delta:
+                metrics.incr(name, delta)
+            self._published[name] = value
+        metrics.set_gauge('capture_flows_active', snap['flows_active'])
+        metrics.set_gauge('capture_packet_rate', snap['packet_rate'])
+
+    def finish(self):
+        self.finished_at = time.time()
+        self.report(final=True)
+
+    def snapshot(self):
+        end = self.finished_at or time.time()
+        elapsed = max(end - self.started_at, 1e-9)
+        return {
+            'running': self.finished_at is None,
+            'elapsed_seconds': round(elapsed, 3),
+            'packets_seen': self.packets_seen,
+            'packets_parsed': self.packets_parsed,
+            'packets_skipped': dict(self.packets_skipped),
+            'flows_active': self.flows_active,
+            'windows_emitted': self.windows_emitted,
+            'rows_written': self.rows_written,
+            'write_errors': self.write_errors,
+            'rows_pending': self.rows_pending,
+            'packet_rate': round(self.packets_seen / elapsed, 2),
+            'write_avg_ms': round(self.write_seconds / self.write_batches * 1000, 3) if self.write_batches else 0.0,
+            'write_max_ms': round(self.write_max_seconds * 1000, 3),
+            'stop_reason': self.stop_reason,
+        }
+
+
+CSV_HEADER = [
+    'timestamp',
+    'bytes_transferred',
+    'packet_count',
+    'connection_duration',
+    'source_port',
+    'destination_port',
+    'retransmission_rate',
+    'protocol',
+    'bytes_per_packet',
+    'packets_per_second',
+    'syn_ratio',
+    'fin_ratio',
+    'rst_ratio',
+    'out_of_order_rate',
+    'source_ip',
+    'destination_ip',
+]
+
+
+def _write_row(writer, item, header=CSV_HEADER):
+    """将一个聚合后的窗口行按表头顺序写入 CSV。"""
+    writer.writerow([item.get(column, '') for column in header])
+
+
+def _close_on_stop(capture, stop_event, done):
+    """等待 stop_event；被设置时从其他线程安全地关闭 pyshark 的事件循环，使持续捕获在空闲网卡上也能退出。"""
+    while not done.is_set():
+        if stop_event.wait(0.5):
+            loop = getattr(capture, 'eventloop', None)
+            close_async = getattr(capture, 'close_async', None)
+            if loop is not None and close_async is not None and loop.is_running():
                 try:
-                    if window_start.timestamp() < cutoff_dt.timestamp():
-                        should_flush = True
+                    asyncio.run_coroutine_threadsafe(close_async(), loop)
                 except Exception:
-                    # if timestamp also fails, skip this window
-                    should_flush = False
-
-            if should_flush:
-                 # 生成聚合结果
-                 first_ts = d['first_ts']
-                 last_ts = d['last_ts']
-                 if first_ts and last_ts:
-                     duration = (last_ts - first_ts).total_seconds()
-                 else:
-                     duration = 1.0
-                 if duration <= 0:
-                     duration = 1.0
-
-                 bytes_transferred = d['bytes_sum']
-                 packet_count = d['packet_count']
-                 bytes_per_packet = bytes_transferred / packet_count if packet_count > 0 else 0.0
-                 packets_per_second = packet_count / duration if duration > 0 else 0.0
-                 retransmission_rate = 0.0
-
-                 to_flush.append({
-                     'timestamp': window_start.isoformat(),
-                     'bytes_transferred': bytes_transferred,
-                     'packet_count': packet_count,
-                     'connection_duration': duration,
-                     'source_port': src_port,
-                     'destination_port': dst_port,
-                     'retransmission_rate': retransmission_rate,
-                     'protocol': proto,
-                     'bytes_per_packet': bytes_per_packet,
-                     'packets_per_second': packets_per_second,
-                 })
-                 # 从内存中移除
-                 del self.agg[(src_ip, src_port, dst_ip, dst_port, proto, window_start)]
-        return to_flush
+                    pass
+            return
 
-    def flush_all(self):
-        # 刷新剩下的所有窗口
-        # use a very large cutoff that matches tzinfo if possible; try to pick a tz-aware max if any keys have tzinfo
-        tzinfo = None
-        for (_, _, _, _, _, window_start) in self.agg.keys():
-            if getattr(window_start, 'tzinfo', None):
-                tzinfo = window_start.tzinfo
-                break
-        if tzinfo:
-            cutoff = datetime.max.replace(tzinfo=tzinfo)
-        else:
-            cutoff = datetime.max
-        return self.flush_older_than(cutoff)
 
-
-def capture_to_csv(interface, duration, bpf_filter, output_file, max_packets, tshark_path=None):
+def check_number(name, value, minimum=0, maximum=None, integer=True):
+    """校验请求中的数值参数（时长、包数、限制等），返回转换后的数值；类型或范围不合法时抛出 ValueError。"""
+    if isinstance(value, bool):
+        raise ValueError(f"{name} must be a number, got {value!r}")
+    try:
+        number = float(value)
+    except (TypeError, ValueError):
+        raise ValueError(f"{name} must be a number, got {value!r}") from None
+    if not math.isfinite(number):
+        raise ValueError(f"{name} must be a finite number, got {value!r}")
+    if integer:
+        if not number.is_integer():
+            raise ValueError(f"{name} must be a whole number, got {value!r}")
+        number = int(number)
+    if number < minimum or (maximum is not None and number > maximum):
+        bound = f"between {minimum} and {maximum}" if maximum is not None else f"at least {minimum}"
+        raise ValueError(f"{name} must be {bound}, got {value!r}")
+    return number
+
+
+def capture_to_csv(interface, duration, bpf_filter, output_file, max_packets, tshark_path=None, stats=None, sketches=False, workers=1, host_context=None,
+                   stop_event=None, max_flows=0, max_output_bytes=0, on_rows=None, rotate_bytes=0, rotate_seconds=0, compress=True):
+    """host_context: 可选的 HostContext，在写出前为每个窗口行附加按主机的滚动特征。
+
+    长期运行的会话（见 utils/capture_manager.py）使用以下参数：
+    stop_event: threading.Event，被设置后持续捕获尽快结束并刷新剩余窗口；
+    max_flows: 活跃流数上限，达到上限时丢弃报文并计入跳过原因 flow_limit；
+    max_output_bytes: 输出文件大小上限，超过后结束抓包；
+    on_rows: 每批写出的窗口行的回调（例如提交给共享的评分服务）。
+
+    输出轮转（见 utils/rotation.py）：rotate_bytes / rotate_seconds 任一非 0 时，输出按大小或窗口时间
+    切分为 <output>.00001.csv 等分段，已关闭的分段在后台线程中 gzip 压缩（compress），
+    并在 <output>.manifest.json 中记录每个分段的时间范围。
+    """
     # 确保当前线程有 asyncio 事件循环（pyshark 在某些环境下需要）
     try:
         asyncio.get_event_loop()
@@ -252,17 +479,14 @@ def capture_to_csv(interface, duration, bpf_filter, output_file, max_packets, ts
         timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
         output_file = os.path.join(UPLOAD_DIR, f'network_traffic_{timestamp}.csv')
 
-    # Try to ensure pyshark can find tshark. Priority:
+    # Find tshark for pyshark. Priority:
     # 1) explicit --tshark-path argument, 2) existing TSHARK_PATH env, 3) shutil.which('tshark') / 'tshark.exe'
+    # The path is only passed to LiveCapture: TSHARK_PATH is process-wide and concurrent sessions would race on it
     if tshark_path:
-        os.environ['TSHARK_PATH'] = str(tshark_path)
         tshark_exec = str(tshark_path)
     else:
         tshark_exec = os.environ.get('TSHARK_PATH') or shutil.which('tshark') or shutil.which('tshark.exe')
-        if tshark_exec:
-            os.environ['TSHARK_PATH'] = str(tshark_exec)
 
-    # import pyshark after setting environment so it can detect TShark path
     try:
         import pyshark
         from pyshark.tshark.tshark import TSharkNotFoundException
@@ -271,8 +495,8 @@ def capture_to_csv(interface, duration, bpf_filter, output_file, max_packets, ts
         raise
 
     try:
-        # Pass explicit tshark path if we found one; pyshark will also check TSHARK_PATH
-        capture = pyshark.LiveCapture(interface=interface, bpf_filter=bpf_filter, tshark_path=(tshark_exec if 'tshark_exec' in locals() else None))
+        # Without a path found here pyshark falls back to its own lookup
+        capture = pyshark.LiveCapture(interface=interface, bpf_filter=bpf_filter, tshark_path=tshark_exec)
     except TSharkNotFoundException as e:
         print("TShark not found by pyshark. Ensure tshark is installed and on PATH, or provide --tshark-path.")
         print("Error details:", e)
@@ -282,41 +506,171 @@ def capture_to_csv(interface, duration, bpf_filter, output_file, max_packets, ts
     output_dir = os.path.dirname(output_file)
     if output_dir:
         os.makedirs(output_dir, exist_ok=True)
-    # 明确确保输出文件存在（以便后续检查文件大小/写表头）
-    try:
-        open(output_file, 'a', encoding='utf-8').close()
-    except Exception:
-        # 如果无法在指定位置创建文件，抛出更明确的异常
-        raise
-    header = [
-        'timestamp',
-        'bytes_transferred',
-        'packet_count',
-        'connection_duration',
-        'source_port',
-        'destination_port',
-        'retransmission_rate',
-        'protocol',
-        'bytes_per_packet',
-        'packets_per_second',
-    ]
-    # 使用追加模式，如果文件为空则写入表头
-    write_header = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
-    out_f = open(output_file, 'a', newline='', encoding='utf-8')
-    writer = csv.writer(out_f)
-    if write_header:
-        writer.writerow(header)
-        out_f.flush()
+    header = CSV_HEADER + (WindowSketch.FEATURES if sketches else []) + (host_context.FEATURES if host_context else [])
+    segments = None
+    out_f = None
+    if rotate_bytes or rotate_seconds:
+        # 轮转模式：分段文件与清单由 RotatingCsvWriter 管理
+        from utils.rotation import RotatingCsvWriter
+        segments = RotatingCsvWriter(output_file, header, max_bytes=rotate_bytes, max_seconds=rotate_seconds, compress=compress)
+    else:
+        # 明确确保输出文件存在（以便后续检查文件大小/写表头）
+        try:
+            open(output_file, 'a', encoding='utf-8').close()
+        except Exception:
+            # 如果无法在指定位置创建文件，抛出更明确的异常
+            raise
+        # 使用追加模式，如果文件为空则写入表头
+        write_header = not os.path.exists(output_file) or os.path.getsize(output_file) == 0
+        if not write_header:
+            # 追加时表头必须一致：否则新增的列（如 --sketches、--host-features）会错位写到旧表头下
+            with open(output_file, 'r', newline='', encoding='utf-8') as f:
+                existing = next(csv.reader(f), [])
+            if existing != header:
+                raise ValueError(f"Existing file {output_file} has a different header; choose a new output file")
+        out_f = open(output_file, 'a', newline='', encoding='utf-8')
+        writer = csv.writer(out_f)
+        if write_header:
+            writer.writerow(header)
+            out_f.flush()
 
     # 使用滚动聚合器，window_seconds 与 aggregate_rows 保持一致
     window_seconds = 30
-    aggregator = RollingAggregator(window_seconds=window_seconds)
+    window_ns = window_seconds * NS_PER_SECOND
+    if workers and workers > 1:
+        if sketches:
+            raise ValueError("sketches are not supported with sharded aggregation (workers > 1)")
+        # 多进程分片：按五元组哈希把流分配给各个工作进程，由合并器按时间顺序输出窗口
+        from utils.sharded_aggregator import ShardedAggregator
+        aggregator = ShardedAggregator(window_seconds=window_seconds, workers=workers)
+    else:
+        aggregator = RollingAggregator(window_seconds=window_seconds, sketches=sketches)
+    # 本次抓包各阶段耗时（秒），在启用 metrics 时填充
+    timings = {}
+    if stats is None:
+        stats = CaptureStats()
+
+    if stop_event is None:
+        stop_event = threading.Event()
+
+    def stop(reason):
+        if stats.stop_reason is None:
+            stats.stop_reason = reason
+        stop_event.set()
+
+    # 已刷出但尚未写入成功的窗口：写入失败时保留，下次写入时按原顺序重试
+    pending_rows = []
+
+    def write_flushed(rows):
+        # 一次刷出包含若干完整窗口，按窗口起始时间计数（而不是行数）
+        stats.windows_emitted += len({row.get('window_start_ns') for row in rows})
+        if host_context is not None:
+            # 窗口按时间顺序刷出，主机上下文状态逐窗口增量更新
+            host_context.update(rows)
+        pending_rows.extend(rows)
+        stats.rows_pending = len(pending_rows)
+        rows = list(pending_rows)
+        start = time.perf_counter()
+        done = 0
+        try:
+            with metrics.timer('capture_write', sink=timings):
+                if segments is not None:
+                    before = segments.rows_written
+                    try:
+                        segments.write_rows(rows)
+                    finally:
+                        done = segments.rows_written - before
+                else:
+                    for item in rows:
+                        _write_row(writer, item, header)
+                        done += 1
+                    out_f.flush()
+        finally:
+            # 只移除已交给写入器的行；中途失败时下次只重试剩余的行，避免重复
+            del pending_rows[:done]
+            stats.rows_pending = len(pending_rows)
+            if done:
+                stats.record_write(done, time.perf_counter() - start)
+                if on_rows is not None:
+                    on_rows(rows[:done])
+        written = segments.bytes_written if segments is not None else out_f.tell()
+        if max_output_bytes and written >= max_output_bytes:
+            stop('output_limit')
+
+    def flush_and_write(cutoff_ns):
+        """刷出 cutoff 之前的窗口并写入；失败计入 write_errors，不算作报文跳过。"""
+        try:
+            flushed = aggregator.flush_older_than(cutoff_ns)
+            if flushed:
+                write_flushed(flushed)
+        except Exception as e:
+            stats.write_errors += 1
+            logging.error(f"Error writing flushed windows: {str(e)}")
+            if getattr(aggregator, 'error', None):
+                # 分片工作进程已退出或卡住：停止抓包，而不是对每个报文都等待超时
+                stop('aggregator_failed')
+
+    def handle_packet(pkt):
+        stats.packets_seen += 1
+        try:
+            # 优先使用 epoch 秒字符串 sniff_timestamp，直接转换为纳秒整数，不创建 datetime
+            ts_ns = None
+            ts_str = getattr(pkt, 'sniff_timestamp', '')
+            if ts_str:
+                try:
+                    ts_ns = to_epoch_ns(ts_str)
+                except ValueError:
+                    ts_ns = None
+            if ts_ns is None:
+                ts_dt = getattr(pkt, 'sniff_time', None)
+                if not ts_dt:
+                    stats.skip('bad_timestamp' if ts_str else 'no_timestamp')
+                    return
+                # pyshark 的 sniff_time 是本地时间的 naive datetime
+                ts_ns = to_epoch_ns(ts_dt.astimezone())
+
+            src_ip, dst_ip = safe_get_ip(pkt)
+            src_port, dst_port = safe_get_ports(pkt)
+            proto = getattr(pkt, 'highest_layer', '') or getattr(pkt, '_ws.col.Protocol', '')
+            length = safe_length(pkt)
+            tcp = safe_get_tcp_fields(pkt)
+        except Exception:
+            # 单个报文解析失败不影响整体抓包，但计入跳过原因
+            stats.skip('parse_error')
+            return
+
+        if max_flows and aggregator.active_flows() >= max_flows:
+            # 达到活跃流上限：先按当前报文时间刷出已结束的窗口，仍超限则丢弃报文，保证内存有界
+            flush_and_write(ts_ns - window_ns)
+            if aggregator.active_flows() >= max_flows:
+                stats.skip('flow_limit')
+                stats.flows_active = aggregator.active_flows()
+                stats.maybe_report()
+                return
+
+        try:
+            aggregator.add_packet(ts_ns, src_ip, src_port, dst_ip, dst_port, proto, length, tcp=tcp)
+        except Exception:
+            stats.skip('aggregate_error')
+            if getattr(aggregator, 'error', None):
+                # 分片工作进程已退出或卡住：停止抓包，而不是对每个报文都等待超时
+                stop('aggregator_failed')
+            stats.flows_active = aggregator.active_flows()
+            stats.maybe_report()
+            return
+        stats.packets_parsed += 1
+
+        # 刷新早于当前窗口（当前时间 - window_seconds）的窗口；写入失败与报文解析/聚合分开统计
+        flush_and_write(ts_ns - window_ns)
+        stats.flows_active = aggregator.active_flows()
+        stats.maybe_report()
 
     # 捕获（timeout 单位为秒），或限制包数量
     iter_packets = None
     try:
         if duration:
-            capture.sniff(timeout=duration)
+            with metrics.timer('capture_sniff', sink=timings):
+                capture.sniff(timeout=duration)
             # pyshark 在 sniff 后会把包保存在 capture._packets 中
             iter_packets = list(getattr(capture, '_packets', []))
             try:
@@ -324,55 +678,25 @@ def capture_to_csv(interface, duration, bpf_filter, output_file, max_packets, ts
             except Exception:
                 pass
         elif max_packets:
-            capture.sniff(packet_count=max_packets)
+            with metrics.timer('capture_sniff', sink=timings):
+                capture.sniff(packet_count=max_packets)
             iter_packets = list(getattr(capture, '_packets', []))
             try:
                 capture.close()
             except Exception:
                 pass
         else:
-            # 持续捕获：逐包处理，直到手动中断（Ctrl+C）
-            for pkt in capture.sniff_continuously(packet_count=0):
-                try:
-                    ts_dt = getattr(pkt, 'sniff_time', None)
-                    if not ts_dt:
-                        # 退化为字符串时间戳解析
-                        ts_str = getattr(pkt, 'sniff_timestamp', '')
-                        try:
-                            ts_dt = datetime.fromisoformat(ts_str)
-                        except Exception:
-                            ts_dt = None
-
-                    src_ip, dst_ip = safe_get_ip(pkt)
-                    src_port, dst_port = safe_get_ports(pkt)
-                    proto = getattr(pkt, 'highest_layer', '') or getattr(pkt, '_ws.col.Protocol', '')
-                    length = safe_length(pkt)
-
-                    if ts_dt:
-                        aggregator.add_packet(ts_dt, src_ip, src_port, dst_ip, dst_port, proto, length)
-                        # 刷新早于当前窗口（当前时间 - window_seconds）的窗口
-                        cutoff = ts_dt - timedelta(seconds=window_seconds)
-                        flushed = aggregator.flush_older_than(cutoff)
-                        for item in flushed:
-                            writer.writerow([
-                                item['timestamp'],
-                                item['bytes_transferred'],
-                                item['packet_count'],
-                                item['connection_duration'],
-                                item['source_port'],
-                                item['destination_port'],
-                                item['retransmission_rate'],
-                                item['protocol'],
-                                item['bytes_per_packet'],
-                                item['packets_per_second'],
-                            ])
-                        out_f.flush()
-                    else:
-                        # 如果时间不可用，忽略或缓存在内存中（此处忽略）
-                        continue
-                except Exception:
-                    # 忽略单个解析错误
-                    continue
+            # 持续捕获：逐包处理，直到手动中断（Ctrl+C）或 stop_event 被设置
+            done = threading.Event()
+            watcher = threading.Thread(target=_close_on_stop, args=(capture, stop_event, done), daemon=True)
+            watcher.start()
+            try:
+                for pkt in capture.sniff_continuously(packet_count=0):
+                    if stop_event.is_set():
+                        break
+                    handle_packet(pkt)
+            finally:
+                done.set()
             # 持续捕获退出后，尝试关闭
             try:
                 capture.close()
@@ -386,65 +710,44 @@ def capture_to_csv(interface, duration, bpf_filter, output_file, max_packets, ts
             pass
         if iter_packets is None:
             iter_packets = list(getattr(capture, '_packets', []))
+        stop('interrupted')
 
     # 如果前面是一次性 sniff，iter_packets 已准备好，这里逐包处理并实时写入
     if iter_packets:
-        for pkt in iter_packets:
-            try:
-                ts_dt = getattr(pkt, 'sniff_time', None)
-                if not ts_dt:
-                    ts = getattr(pkt, 'sniff_timestamp', '')
-                    try:
-                        ts_dt = datetime.fromisoformat(str(ts))
-                    except Exception:
-                        ts_dt = None
-
-                src_ip, dst_ip = safe_get_ip(pkt)
-                src_port, dst_port = safe_get_ports(pkt)
-                proto = getattr(pkt, 'highest_layer', '') or getattr(pkt, '_ws.col.Protocol', '')
-                length = safe_length(pkt)
-
-                if ts_dt:
-                    aggregator.add_packet(ts_dt, src_ip, src_port, dst_ip, dst_port, proto, length)
-                    cutoff = ts_dt - timedelta(seconds=window_seconds)
-                    flushed = aggregator.flush_older_than(cutoff)
-                    for item in flushed:
-                        writer.writerow([
-                            item['timestamp'],
-                            item['bytes_transferred'],
-                            item['packet_count'],
-                            item['connection_duration'],
-                            item['source_port'],
-                            item['destination_port'],
-                            item['retransmission_rate'],
-                            item['protocol'],
-                            item['bytes_per_packet'],
-                            item['packets_per_second'],
-                        ])
-                    out_f.flush()
-                else:
-                    continue
-            except Exception:
-                continue
+        with metrics.timer('capture_process', sink=timings):
+            for pkt in iter_packets:
+                if stats.stop_reason in ('output_limit', 'aggregator_failed'):
+                    break
+                handle_packet(pkt)
 
     # 最后刷新剩余的窗口并关闭文件，确保最后一批数据也被写入
-    remaining = aggregator.flush_all()
-    for item in remaining:
-        writer.writerow([
-            item['timestamp'],
-            item['bytes_transferred'],
-            item['packet_count'],
-            item['connection_duration'],
-            item['source_port'],
-            item['destination_port'],
-            item['retransmission_rate'],
-            item['protocol'],
-            item['bytes_per_packet'],
-            item['packets_per_second'],
-        ])
-    out_f.flush()
-    out_f.close()
-
+    try:
+        remaining = aggregator.flush_all()
+        if remaining or pending_rows:
+            write_flushed(remaining)
+    except Exception as e:
+        stats.write_errors += 1
+        logging.error(f"Error writing the last windows: {str(e)}")
+    if segments is not None:
+        segments.close()
+    else:
+        out_f.close()
+    stats.flows_active = 0
+    if stats.stop_reason is None:
+        stats.stop_reason = 'stopped' if stop_event.is_set() else 'completed'
+    stats.finish()
+
+    summary = stats.snapshot()
+    summary['timings'] = timings
+    if segments is not None:
+        summary['manifest'] = segments.manifest_path
+        summary['segments'] = len(segments.segments())
+    if sketches:
+        summary['top_talkers'] = [
+            {'src_ip': ip, 'bytes': count, 'max_error': error}
+            for ip, count, error in aggregator.top_talkers.top(10)
+        ]
+    return summary
 
 if __name__ == "__main__":
     parser = argparse.ArgumentParser(description="Capture network packets and export to CSV (requires tshark/pyshark).")
@@ -455,6 +758,38 @@ if __name__ == "__main__":
     parser.add_argument('--output', default='', help='Output CSV file (default: auto-generate under uploads/)')
     parser.add_argument('--max-packets', type=int, default=0, help='Max packets to capture (0 = not used)')
     parser.add_argument('--tshark-path', dest='tshark_path', default=None, help='Optional full path to tshark executable')
+    parser.add_argument('--sketches', action='store_true', help='Add HyperLogLog/Space-Saving window features (distinct src IPs, dst ports, fan-out, top talker share)')
+    parser.add_argument('--workers', type=int, default=1, help='Aggregate in N worker processes sharded by flow hash (default 1 = in-process)')
+    parser.add_argument('--host-features', action='store_true', help='Add per-source/destination rolling features (bytes EWMA, flow count, fan-out, port entropy)')
+    parser.add_argument('--rotate-mb', type=float, default=0, help='Start a new output segment every N MB (0 = no size rotation)')
+    parser.add_argument('--rotate-seconds', type=int, default=0, help='Start a new output segment every N seconds of window time (0 = no time rotation)')
+    parser.add_argument('--no-compress', action='store_true', help='Keep closed segments as plain CSV instead of gzip')
+    parser.add_argument('--collector', default=None, help='Also ship flushed windows to a central collector at HOST:PORT (see utils/transport.py)')
+    parser.add_argument('--sensor-id', default=None, help='Sensor name reported to the collector (default: hostname)')
+    parser.add_argument('--spool-dir', default='spool', help='Directory for windows not yet acknowledged by the collector (default spool/)')
+    parser.add_argument('--spool-mb', type=float, default=64, help='Spool size limit in MB; the oldest windows are dropped beyond it (default 64)')
+    parser.add_argument('--profile', action='store_true', help='Run the capture under cProfile and write the profile to outputs/')
     args = parser.parse_args()
 
-    capture_to_csv(args.interface, args.duration, args.bpf, args.output, args.max_packets, args.tshark_path)
\ No newline at end of file
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    from utils.profiling import ProfileSession
+    with ProfileSession('capture', enabled=args.profile) as profile:
+        host_context = None
+        if args.host_features:
+            from utils.host_features import HostContext
+            host_context = HostContext()
+        # 传感器模式：刷出的窗口按批编码为二进制帧发送到采集端，断线时先写入本地有界缓存
+        sensor = None
+        if args.collector:
+            from utils.transport import SensorClient
+            host, _, port = args.collector.rpartition(':')
+            sensor = SensorClient(host, int(port), args.sensor_id, spool_dir=args.spool_dir, max_spool_bytes=int(args.spool_mb * 1024 * 1024))
+        try:
+            capture_to_csv(args.interface, args.duration, args.bpf, args.output, args.max_packets, args.tshark_path, sketches=args.sketches, workers=args.workers, host_context=host_context,
+                           rotate_bytes=int(args.rotate_mb * 1024 * 1024), rotate_seconds=args.rotate_seconds, compress=not args.no_compress,
+                           on_rows=sensor.send if sensor else None)
+        finally:
+            if sensor is not None:
+                logging.info(f"Sensor summary: {sensor.close(timeout=30)}")
+    if profile.result:
+        print(f"Profile written to {profile.result['profile_file']} (summary: {profile.result['summary_file']})")
\ No newline at end of file
@@ -3,10 +3,14 @@ import numpy as np
 from datetime import datetime, timedelta
 import time
 
-def generate_sample_data(start_date=None, duration_hours=24, output_file='network_traffic.csv'):
-    """Generate sample network traffic data with unique patterns each time"""
+def generate_sample_data(start_date=None, duration_hours=24, output_file='network_traffic.csv', seed=None):
+    """Generate sample network traffic data with unique patterns each time
+
+    Each row's ground truth is in `traffic_type` (normal, ddos,
+    data_exfiltration or port_scan). Pass `seed` for reproducible data.
+    """
     # Use current timestamp as seed for unique data generation
-    current_seed = int(time.time() * 1000) % 2**32
+    current_seed = int(time.time() * 1000) % 2**32 if seed is None else seed
     np.random.seed(current_seed)
     
     if start_date is None:
@@ -133,6 +137,12 @@ def generate_sample_data(start_date=None, duration_hours=24, output_file='networ
     # Create DataFrame
     df = pd.DataFrame(normal_data)
     
+    # Ground-truth labels in the same order as the rows above
+    df['traffic_type'] = np.concatenate([
+        np.full(n_normal, 'normal'),
+        np.repeat(['ddos', 'data_exfiltration', 'port_scan'], anomaly_sizes)
+    ])
+    
     # Add protocols with realistic distribution
     protocols = np.random.choice(
         ['TCP', 'UDP', 'HTTP', 'HTTPS', 'SSH', 'FTP'],
@@ -1,33 +1,69 @@
-import pandas as pd
 import numpy as np
-from sklearn.ensemble import IsolationForest
-from sklearn.preprocessing import StandardScaler, MinMaxScaler
-import matplotlib.pyplot as plt
-import seaborn as sns
 import logging
 from datetime import datetime
 import os
 import json
-from utils.mitigation_engine import MitigationEngine
+import warnings
+from utils.metrics import registry as metrics
+from utils.profiling import ProfileSession, profiling_requested
 
-# Create logs directory if it doesn't exist
-os.makedirs('logs', exist_ok=True)
-os.makedirs('outputs', exist_ok=True)
+# pandas, scikit-learn, matplotlib/seaborn and joblib are imported where they
+# are first needed, so importing this module (e.g. from app.py) stays cheap.
 
-# Enhanced logging setup
-logging.basicConfig(
-    filename=os.path.join('logs', f'security_logs_{datetime.now().strftime("%Y%m%d")}.log'),
-    level=logging.INFO,
-    format='%(asctime)s - %(levelname)s - %(message)s'
-)
+
+def init_runtime():
+    """Create the working directories and configure file logging.
+
+    Called explicitly by entry points (main(), app.py) instead of at import.
+    """
+    os.makedirs('logs', exist_ok=True)
+    os.makedirs('outputs', exist_ok=True)
+
+    # Enhanced logging setup
+    logging.basicConfig(
+        filename=os.path.join('logs', f'security_logs_{datetime.now().strftime("%Y%m%d")}.log'),
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+ANOMALY_LABELS = ['Normal', 'Anomaly']
 
 class NetworkAnomalyDetector:
     def __init__(self, config_file='config.json'):
         """Initialize detector with configuration."""
         self.config = self.load_config(config_file)
-        self.scaler = StandardScaler()
+        # Per-host rolling features join the model features when enabled
+        if self.config.get('host_features', {}).get('enabled', False):
+            from utils.host_features import HostContext
+            self.config['features'] = self.config['features'] + [
+                name for name in HostContext.FEATURES if name not in self.config['features']
+            ]
+        # Features of the current model; a fit on data without source/destination IPs
+        # leaves the host features out without changing the configured list
+        self.features = list(self.config['features'])
+        # Created on first fit (StandardScaler) or restored by load_model()/load_compact_model()
+        self.scaler = None
+        # Per hour-of-week scaling statistics, used instead of `scaler` when enabled
+        self.seasonal = None
+        self._seasonal_active = False
         self.model = None
-        self.mitigation_engine = MitigationEngine()
+        # Score cut-off derived from `contamination`; scores below it are anomalies
+        self.threshold = None
+        # Contiguous (n_samples, n_features) matrix shared by scaling, fit and score
+        self.feature_matrix = None
+        self._feature_source = None
+        # Path of the last loaded file, recorded with stored anomalies
+        self.source_file = None
+        # Unscaled copy of feature_matrix, kept only when drift monitoring is enabled
+        self._raw_matrix = None
+        self._drift_monitor = None
+        self._drift_reference = None
+        # Latest DriftMonitor.report(), refreshed on every fit and saved-model scoring
+        self.drift_report = None
+        self._anomaly_store = None
+        self._mitigation_engine = None
+        # Per-run stage timings (seconds), filled in when metrics are enabled
+        self.stage_timings = {}
         
     @staticmethod
     def load_config(config_file):
@@ -36,7 +72,9 @@ class NetworkAnomalyDetector:
             'features': ['feature1', 'feature2', 'feature3'],
             'contamination': 0.05,
             'n_estimators': 100,
-            'random_state': 42
+            'random_state': 42,
+            'feature_dtype': 'float32',
+            'model_path': os.path.join('models', 'isolation_forest.joblib')
         }
         try:
             with open(config_file, 'r') as f:
@@ -45,65 +83,234 @@ class NetworkAnomalyDetector:
             logging.warning(f"Config file {config_file} not found. Using defaults.")
             return default_config
 
-    def load_and_preprocess_data(self, filepath):
-        """Load and preprocess network traffic data."""
+    @property
+    def mitigation_engine(self):
+        """MitigationEngine, created on first use."""
+        if self._mitigation_engine is None:
+            from utils.mitigation_engine import MitigationEngine
+            self._mitigation_engine = MitigationEngine()
+        return self._mitigation_engine
+
+    def _stage(self, name):
+        """Time a pipeline stage under `detector_<name>`."""
+        return metrics.timer(f'detector_{name}', sink=self.stage_timings)
+
+    def load_and_preprocess_data(self, filepath, fit_scaler=True):
+        """Load and preprocess network traffic data.
+
+        With fit_scaler=False the already fitted (or loaded) scaler is applied
+        as-is, which is what scoring with a saved model needs.
+        """
         try:
-            df = pd.read_csv(filepath)
+            import pandas as pd
+            with self._stage('load'):
+                if str(filepath).endswith('.manifest.json'):
+                    # Rotated capture output: concatenate the segments listed in the manifest
+                    from utils.rotation import read_range
+                    df = read_range(filepath)
+                else:
+                    df = pd.read_csv(filepath)
             logging.info(f"Successfully loaded data from {filepath}")
-            
-            # Data validation
-            self._validate_data(df)
-            
-            # Handle missing values
-            df = self._handle_missing_values(df)
-            
-            # Feature scaling
-            df = self._scale_features(df)
-            
-            return df
+            self.source_file = os.path.basename(str(filepath))
+            metrics.incr('detector_rows_loaded', len(df))
+            return self.preprocess_frame(df, fit_scaler=fit_scaler)
             
         except Exception as e:
             logging.error(f"Error loading data: {str(e)}")
             raise
 
+    def preprocess_frame(self, df, fit_scaler=True, host_context=None):
+        """Preprocess an in-memory frame of flow windows (e.g. rows from a live capture).
+
+        Streaming callers pass the same `host_context` (a HostContext) with
+        every batch of one stream so host features carry over between batches.
+        """
+        if fit_scaler:
+            # A refit starts from the configured features again
+            self.features = list(self.config['features'])
+        
+        # Host context features for files captured without them
+        df = self._add_host_features(df, fit=fit_scaler, context=host_context)
+        
+        # Data validation
+        self._validate_data(df)
+        
+        # Build the feature matrix once; imputation and scaling work on it in place
+        X = self._build_feature_matrix(df)
+        
+        # Handle missing values
+        with self._stage('impute'):
+            self._handle_missing_values(X)
+        
+        # Drift is measured on raw values; scaled ones hide shifts because the scaler refits
+        self._raw_matrix = X.copy() if self.config.get('drift', {}).get('enabled', False) else None
+        
+        # Created before the timer: a cold scikit-learn import would dominate the 'scale' stage
+        if fit_scaler and self.scaler is None:
+            self.scaler = self._new_scaler()
+        
+        # Feature scaling; in place for float matrices, a new float array otherwise
+        with self._stage('scale'):
+            X = self._scale_features(X, fit=fit_scaler, timestamps=df.get('timestamp'))
+        
+        # Single write-back so plots, mitigation and exports see scaled values
+        df[self.features] = X
+        self.feature_matrix = X
+        self._feature_source = df
+        
+        return df
+
+    def _add_host_features(self, df, fit=True, context=None):
+        """Compute per-host rolling features when enabled and missing from the file.
+
+        Without source/destination IPs the features would be constant, so a
+        fit leaves them out of this model's features (`self.features`);
+        scoring with a saved model that uses them raises ValueError instead.
+        """
+        from utils.host_features import HostContext
+        if not set(HostContext.FEATURES) & set(self.features) or all(name in df.columns for name in HostContext.FEATURES):
+            return df
+        context = context or HostContext.from_config(self.config)
+        if context is None:
+            return df
+        if not HostContext.has_hosts(df):
+            if not fit:
+                raise ValueError("The saved model uses host features, but the data has no source_ip/destination_ip")
+            logging.warning("No source_ip/destination_ip columns; host features are left out of this model")
+            self.features = [name for name in self.features if name not in HostContext.FEATURES]
+            return df
+        with self._stage('context'):
+            return context.transform_frame(df)
+
+    def _use_model_features(self, features):
+        """Adopt a saved model's features: the configured ones, or those without host features."""
+        from utils.host_features import HostContext
+        features = list(features)
+        configured = list(self.config['features'])
+        if features not in (configured, [name for name in configured if name not in HostContext.FEATURES]):
+            raise ValueError(f"Model features {features} do not match config features")
+        self.features = features
+
     def _validate_data(self, df):
         """Validate input data structure."""
-        missing_features = set(self.config['features']) - set(df.columns)
+        missing_features = set(self.features) - set(df.columns)
         if missing_features:
             raise ValueError(f"Missing required features: {missing_features}")
 
-    def _handle_missing_values(self, df):
-        """Handle missing values in the dataset."""
-        # Check for missing values
-        missing_stats = df[self.config['features']].isnull().sum()
-        if missing_stats.any():
-            logging.warning(f"Missing values detected: {missing_stats.to_dict()}")
+    def _build_feature_matrix(self, df):
+        """Copy the configured features into one C-contiguous matrix.
+
+        float32 matches the dtype IsolationForest converts to internally, so
+        fit and score can use the buffer without further copies.
+        """
+        dtype = np.dtype(self.config.get('feature_dtype', 'float32'))
+        return np.ascontiguousarray(df[self.features].to_numpy(dtype=dtype, copy=True))
+
+    def _handle_missing_values(self, X):
+        """Fill missing values in the feature matrix with column means, in place."""
+        missing = np.isnan(X)
+        missing_counts = missing.sum(axis=0)
+        if missing_counts.any():
+            logging.warning(f"Missing values detected: {dict(zip(self.features, missing_counts.tolist()))}")
             
-        # Fill missing values with mean
-        df[self.config['features']] = df[self.config['features']].fillna(df[self.config['features']].mean())
-        return df
+            # Fill missing values with mean
+            with warnings.catch_warnings():
+                warnings.simplefilter('ignore', category=RuntimeWarning)
+                column_means = np.nanmean(X, axis=0, dtype=np.float64)
+            rows, cols = np.nonzero(missing)
+            X[rows, cols] = column_means[cols]
+        return X
 
-    def _scale_features(self, df):
-        """Scale features using StandardScaler."""
-        df[self.config['features']] = self.scaler.fit_transform(df[self.config['features']])
-        return df
+    def _scale_features(self, X, fit=True, timestamps=None):
+        """Scale the feature matrix and return it (in place when X is float32/float64).
+
+        Uses the seasonal baseline when enabled and the data has timestamps;
+        fitting then folds this batch into this detector's copy of the stored
+        per-bucket statistics instead of refitting one global StandardScaler.
+        The stored file only changes when save_model() is called.
+        """
+        seasonal_config = self.config.get('seasonal', {})
+        self._seasonal_active = bool(seasonal_config.get('enabled', False)) and timestamps is not None
+        if self._seasonal_active:
+            baseline = self._get_seasonal_baseline()
+            buckets = baseline.bucket_index(timestamps)
+            if fit:
+                baseline.update(X, buckets)
+            return baseline.transform(X, buckets)
+        if fit:
+            if self.scaler is None:
+                self.scaler = self._new_scaler()
+            return self.scaler.fit_transform(X)
+        if self.scaler is None:
+            raise ValueError("No fitted scaler. Call load_model() or load_compact_model() first.")
+        return self.scaler.transform(X)
+
+    @staticmethod
+    def _new_scaler():
+        from sklearn.preprocessing import StandardScaler
+        # copy=False: the scaler works in place on the detector's feature matrix
+        return StandardScaler(copy=False)
+
+    def _get_seasonal_baseline(self):
+        """Return the seasonal baseline, loading the stored statistics on first use."""
+        if self.seasonal is None or self.seasonal.features != self.features:
+            from utils.seasonal import SeasonalBaseline
+            seasonal_config = self.config.get('seasonal', {})
+            self.seasonal = SeasonalBaseline.load(
+                seasonal_config.get('path', os.path.join('models', 'seasonal_baseline.npz')),
+                self.features,
+                min_samples=seasonal_config.get('min_samples', 30),
+                timezone=seasonal_config.get('timezone', 'UTC'),
+            )
+        return self.seasonal
+
+    def raw_feature(self, df, name):
+        """Return feature `name` of a preprocessed frame in its original (unscaled) units."""
+        j = self.features.index(name)
+        values = df[name].to_numpy(dtype=np.float64)
+        if self._seasonal_active:
+            return self.seasonal.inverse_column(values, self.seasonal.bucket_index(df['timestamp']), j)
+        return values * self.scaler.scale_[j] + self.scaler.mean_[j]
+
+    def _get_feature_matrix(self, df):
+        """Return the preprocessed matrix for `df`, building one if `df` came from elsewhere."""
+        if self._feature_source is df and self.feature_matrix is not None and len(self.feature_matrix) == len(df):
+            return self.feature_matrix
+        return self._build_feature_matrix(df)
 
     def detect_anomalies(self, df):
-        """Detect anomalies using Isolation Forest."""
+        """Detect anomalies using Isolation Forest.
+
+        The forest is traversed once: raw scores are computed with
+        score_samples and labels come from comparing them with the
+        contamination-derived threshold, instead of fit_predict followed
+        by a second score_samples pass.
+        """
         try:
+            from sklearn.ensemble import IsolationForest
+            # contamination='auto' keeps fit from scoring the training set
+            # itself; the contamination threshold is derived below instead.
             self.model = IsolationForest(
-                contamination=self.config['contamination'],
+                contamination='auto',
                 random_state=self.config['random_state'],
                 n_estimators=self.config['n_estimators']
             )
             
-            # Fit and predict
-            predictions = self.model.fit_predict(df[self.config['features']])
-            df['anomaly'] = predictions
-            df['anomaly'] = df['anomaly'].map({1: 'Normal', -1: 'Anomaly'})
+            X = self._get_feature_matrix(df)
             
-            # Calculate anomaly scores
-            df['anomaly_score'] = self.model.score_samples(df[self.config['features']])
+            # Fit
+            with self._stage('fit'):
+                self.model.fit(X)
+            
+            # Calculate anomaly scores and derive labels from the threshold
+            with self._stage('score'):
+                scores = self.model.score_samples(X)
+                self._set_threshold(scores)
+            df['anomaly'] = self._labels_from_predictions(scores < self.threshold)
+            df['anomaly_score'] = scores
+            # Compared with the saved model's snapshot; save_model() replaces the snapshot
+            self._record_drift(df, None)
+            self._drift_reference = (self._raw_matrix, scores) if self._raw_matrix is not None else None
             
             # Log anomaly statistics
             self._log_anomaly_stats(df)
@@ -114,6 +321,198 @@ class NetworkAnomalyDetector:
             logging.error(f"Error in anomaly detection: {str(e)}")
             raise
 
+    def _get_drift_monitor(self):
+        """Return this process's drift monitor, loading the saved snapshot on first use."""
+        if self._drift_monitor is None or self._drift_monitor.features != self.features:
+            from utils.drift import DriftMonitor
+            self._drift_monitor = DriftMonitor.shared({**self.config, 'features': self.features})
+        return self._drift_monitor
+
+    def _record_drift(self, df, scores):
+        """Fold this batch's raw features (and saved-model scores) into the drift monitor.
+
+        `scores` is None after a refit: scores of a new forest are not
+        comparable with those of the model the snapshot belongs to.
+        """
+        if self._raw_matrix is None or self._feature_source is not df:
+            return None
+        try:
+            monitor = self._get_drift_monitor()
+            with self._stage('drift'), monitor.lock:
+                monitor.update(self._raw_matrix, scores)
+                self.drift_report = monitor.report()
+                # Shared with other detectors in this process; written periodically and at exit
+                monitor.maybe_save(interval_seconds=self.config['drift'].get('save_interval_seconds', 30))
+            for name, column in self.drift_report.get('columns', {}).items():
+                metrics.set_gauge(f'drift_psi_{name}', column['psi'])
+            if self.drift_report['retrain_recommended']:
+                logging.warning(f"Feature drift detected in {self.drift_report['drifted']}; retraining recommended")
+            return self.drift_report
+        except Exception as e:
+            # Drift tracking must never fail an analysis
+            logging.error(f"Error updating drift monitor: {str(e)}")
+            return None
+
+    def _set_threshold(self, scores):
+        """Derive and cache the score threshold, matching IsolationForest's offset_."""
+        contamination = self.config['contamination']
+        if contamination != 'auto':
+            # Same rule sklearn applies in fit(): the contamination percentile of training scores
+            self.model.offset_ = np.percentile(scores, 100.0 * contamination)
+            self.model.set_params(contamination=contamination)
+        self.threshold = float(self.model.offset_)
+        return self.threshold
+
+    def score_with_saved_model(self, df):
+        """Label a preprocessed batch with the loaded model and cached threshold.
+
+        Expects `df` from load_and_preprocess_data(..., fit_scaler=False)
+        after load_model(); no refit or percentile computation happens here.
+        """
+        try:
+            if self.model is None or self.threshold is None:
+                raise ValueError("No trained model loaded. Call load_model() first.")
+            
+            X = self._get_feature_matrix(df)
+            with self._stage('score'):
+                scores = self.model.score_samples(X)
+            df['anomaly'] = self._labels_from_predictions(scores < self.threshold)
+            df['anomaly_score'] = scores
+            self._record_drift(df, scores)
+            
+            self._log_anomaly_stats(df)
+            return df
+            
+        except Exception as e:
+            logging.error(f"Error scoring with saved model: {str(e)}")
+            raise
+
+    def save_model(self, path=None):
+        """Persist the fitted scaler, forest and threshold (and the seasonal baseline) for later batches."""
+        path = path or self.config.get('model_path', os.path.join('models', 'isolation_forest.joblib'))
+        try:
+            if self.model is None or self.threshold is None:
+                raise ValueError("No trained model to save. Run detect_anomalies() first.")
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            import joblib
+            joblib.dump({
+                'model': self.model,
+                'scaler': self.scaler,
+                'threshold': self.threshold,
+                'seasonal': self.seasonal if self._seasonal_active else None,
+                'features': self.features,
+                'contamination': self.config['contamination'],
+                'created_at': datetime.now().isoformat(),
+            }, path)
+            logging.info(f"Model saved to {path} (threshold={self.threshold:.6f})")
+            if self._seasonal_active:
+                # Training and retraining are the only paths that update the stored baseline
+                self.seasonal.save(self.config['seasonal'].get('path', os.path.join('models', 'seasonal_baseline.npz')))
+            if self._drift_reference is not None:
+                # The saved model's training data becomes the drift snapshot
+                monitor = self._get_drift_monitor()
+                with monitor.lock:
+                    monitor.fit_reference(*self._drift_reference)
+                    monitor.save(new_reference=True)
+            if self.config.get('compact_model_path'):
+                self.save_compact_model()
+            return path
+        except Exception as e:
+            logging.error(f"Error saving model: {str(e)}")
+            raise
+
+    def load_model(self, path=None):
+        """Load a model saved by save_model(), including its cached threshold."""
+        path = path or self.config.get('model_path', os.path.join('models', 'isolation_forest.joblib'))
+        try:
+            import joblib
+            bundle = joblib.load(path)
+            self._use_model_features(bundle['features'])
+            self.model = bundle['model']
+            self.scaler = bundle['scaler']
+            self.threshold = bundle['threshold']
+            self.seasonal = bundle.get('seasonal')
+            logging.info(f"Model loaded from {path} (threshold={self.threshold:.6f})")
+            return bundle
+        except Exception as e:
+            logging.error(f"Error loading model: {str(e)}")
+            raise
+
+    def save_compact_model(self, path=None):
+        """Export the forest as flat node arrays plus scaler and threshold metadata."""
+        path = path or self.config.get('compact_model_path', os.path.join('models', 'isolation_forest_compact'))
+        try:
+            if self.model is None or self.threshold is None:
+                raise ValueError("No trained model to save. Run detect_anomalies() first.")
+            from utils.compact_forest import CompactForest
+            seasonal = self.seasonal if self._seasonal_active else None
+            metadata = {
+                'threshold': self.threshold,
+                'features': self.features,
+                'contamination': self.config['contamination'],
+                'seasonal': seasonal is not None,
+                'created_at': datetime.now().isoformat(),
+            }
+            if seasonal is None:
+                metadata['scaler_mean'] = self.scaler.mean_.tolist()
+                metadata['scaler_scale'] = self.scaler.scale_.tolist()
+            else:
+                seasonal.save(f'{path}.seasonal.npz')
+            CompactForest.from_sklearn(self.model, metadata).save(path)
+            logging.info(f"Compact model saved to {path}.npy")
+            return path
+        except Exception as e:
+            logging.error(f"Error saving compact model: {str(e)}")
+            raise
+
+    def load_compact_model(self, path=None):
+        """Load a model exported by save_compact_model(); scikit-learn is not imported.
+
+        The node array is memory-mapped and scores match the original
+        forest, so score_with_saved_model() works unchanged.
+        """
+        path = path or self.config.get('compact_model_path', os.path.join('models', 'isolation_forest_compact'))
+        try:
+            from utils.compact_forest import ArrayScaler, CompactForest
+            forest = CompactForest.load(path)
+            meta = forest.metadata
+            self._use_model_features(meta['features'])
+            self.model = forest
+            self.threshold = meta['threshold']
+            if meta.get('seasonal'):
+                from utils.seasonal import SeasonalBaseline
+                seasonal_config = self.config.get('seasonal', {})
+                self.seasonal = SeasonalBaseline.load(
+                    f'{path}.seasonal.npz', self.features,
+                    min_samples=seasonal_config.get('min_samples', 30),
+                    timezone=seasonal_config.get('timezone', 'UTC'),
+                )
+            else:
+                self.scaler = ArrayScaler(meta['scaler_mean'], meta['scaler_scale'])
+            logging.info(f"Compact model loaded from {path}.npy (threshold={self.threshold:.6f})")
+            return meta
+        except Exception as e:
+            logging.error(f"Error loading compact model: {str(e)}")
+            raise
+
+    def load_saved_model(self):
+        """Load the compact export when present, otherwise the joblib bundle; returns the path loaded."""
+        compact_path = self.config.get('compact_model_path')
+        if compact_path and os.path.exists(f'{compact_path}.json'):
+            self.load_compact_model(compact_path)
+            return f'{compact_path}.npy'
+        path = self.config.get('model_path', os.path.join('models', 'isolation_forest.joblib'))
+        self.load_model(path)
+        return path
+
+    @staticmethod
+    def _labels_from_predictions(is_anomaly):
+        """Build the 'Normal'/'Anomaly' label column as a categorical from a boolean mask."""
+        import pandas as pd
+        return pd.Categorical.from_codes(is_anomaly.astype(np.int8), categories=ANOMALY_LABELS)
+
     def _log_anomaly_stats(self, df):
         """Log detailed anomaly statistics."""
         anomaly_stats = {
@@ -127,14 +526,15 @@ class NetworkAnomalyDetector:
         }
         logging.info(f"Anomaly detection statistics: {json.dumps(anomaly_stats, indent=2)}")
 
-    def visualize_results(self, df):
-        """Create and save visualization of anomalies."""
+    def visualize_results(self, df, timestamp=None):
+        """Create and save visualization of anomalies, named by `timestamp` (default: now)."""
         try:
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+            timestamp = timestamp or datetime.now().strftime("%Y%m%d_%H%M%S")
             
             # Create multiple visualizations
-            self._create_scatter_plot(df, timestamp)
-            self._create_anomaly_score_distribution(df, timestamp)
+            with self._stage('plotting'):
+                self._create_scatter_plot(df, timestamp)
+                self._create_anomaly_score_distribution(df, timestamp)
             
         except Exception as e:
             logging.error(f"Error in visualization: {str(e)}")
@@ -142,10 +542,12 @@ class NetworkAnomalyDetector:
 
     def _create_scatter_plot(self, df, timestamp):
         """Create scatter plot of anomalies."""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
         plt.figure(figsize=(12, 8))
         sns.scatterplot(
-            x=self.config['features'][0],
-            y=self.config['features'][1],
+            x=self.features[0],
+            y=self.features[1],
             hue='anomaly',
             data=df,
             palette={'Normal': 'blue', 'Anomaly': 'red'},
@@ -157,6 +559,8 @@ class NetworkAnomalyDetector:
 
     def _create_anomaly_score_distribution(self, df, timestamp):
         """Create distribution plot of anomaly scores."""
+        import matplotlib.pyplot as plt
+        import seaborn as sns
         plt.figure(figsize=(12, 6))
         sns.histplot(data=df, x='anomaly_score', hue='anomaly', bins=50)
         plt.title('Distribution of Anomaly Scores')
@@ -166,7 +570,8 @@ class NetworkAnomalyDetector:
     def get_mitigation_recommendations(self, df):
         """Get mitigation recommendations for detected anomalies."""
         try:
-            recommendations = self.mitigation_engine.analyze_anomalies(df)
+            with self._stage('mitigation'):
+                recommendations = self.mitigation_engine.analyze_anomalies(df)
             
             # Log recommendations
             logging.info(f"Generated {len(recommendations)} mitigation recommendations")
@@ -179,38 +584,133 @@ class NetworkAnomalyDetector:
             logging.error(f"Error generating mitigation recommendations: {str(e)}")
             raise
 
-def main():
+    def export_anomalies(self, df, timestamp):
+        """Export anomalous records sorted by score; returns the file path or None.
+
+        Records are also appended to the indexed anomaly store when the
+        `anomaly_store` config section enables it.
+        """
+        try:
+            with self._stage('export'):
+                anomalies_df = df[df['anomaly'] == 'Anomaly'].sort_values('anomaly_score')
+                if anomalies_df.empty:
+                    return None
+                anomaly_file = os.path.join('outputs', f'anomalies_{timestamp}.csv')
+                anomalies_df.to_csv(anomaly_file, index=False)
+                self._store_anomalies(anomalies_df, timestamp)
+            metrics.incr('detector_anomalies_exported', len(anomalies_df))
+            return anomaly_file
+        except Exception as e:
+            logging.error(f"Error exporting anomalies: {str(e)}")
+            raise
+
+    def _store_anomalies(self, anomalies_df, analysis_id):
+        """Append anomalies, with features back in original units, to the anomaly store."""
+        store_config = self.config.get('anomaly_store', {})
+        if not store_config.get('enabled', False):
+            return 0
+        if self._anomaly_store is None:
+            from utils.anomaly_store import AnomalyStore
+            self._anomaly_store = AnomalyStore(store_config.get('path', os.path.join('outputs', 'anomalies.db')))
+        raw = anomalies_df.copy()
+        if self._seasonal_active or (self.scaler is not None and hasattr(self.scaler, 'mean_')):
+            for name in self.features:
+                raw[name] = self.raw_feature(anomalies_df, name)
+        stored = self._anomaly_store.append(raw, analysis_id, source_file=self.source_file)
+        logging.info(f"Stored {stored} anomalies in {self._anomaly_store.path}")
+        return stored
+
+    def store_results(self, df, analysis_id):
+        """Keep every scored row, features in original units, for streaming exports (see utils/results_store.py)."""
+        results_config = self.config.get('results_store', {})
+        if not results_config.get('enabled', False):
+            return 0
+        try:
+            from utils.results_store import ResultsStore
+            with self._stage('results'):
+                store = ResultsStore(
+                    results_config.get('path', os.path.join('outputs', 'results.db')),
+                    max_analyses=results_config.get('max_analyses', 20),
+                )
+                raw = df.copy()
+                if self._seasonal_active or (self.scaler is not None and hasattr(self.scaler, 'mean_')):
+                    for name in self.features:
+                        raw[name] = self.raw_feature(df, name)
+                stored = store.write(raw, analysis_id, source_file=self.source_file)
+            logging.info(f"Stored {stored} scored rows in {store.path}")
+            return stored
+        except Exception as e:
+            logging.error(f"Error storing scored rows: {str(e)}")
+            raise
+
+def retrain_model(data_path, config_file='config.json'):
+    """Fit a new model on `data_path` (CSV or rotated-capture manifest) and save it.
+
+    Used by the drift retrain trigger; saving also refreshes the compact
+    export and the drift reference snapshot.
+    """
+    detector = NetworkAnomalyDetector(config_file)
+    df = detector.load_and_preprocess_data(data_path)
+    df = detector.detect_anomalies(df)
+    path = detector.save_model()
+    return {
+        'data_path': data_path,
+        'model_path': path,
+        'rows': len(df),
+        'threshold': detector.threshold,
+    }
+
+def main(data_path="network_traffic.csv"):
+    init_runtime()
     try:
         detector = NetworkAnomalyDetector()
         
-        # Load and process data
-        df = detector.load_and_preprocess_data("network_traffic.csv")
+        profiling_config = detector.config.get('profiling', {})
+        with ProfileSession(
+            'main',
+            enabled=profiling_requested(detector.config),
+            top_n=profiling_config.get('top_n', 20),
+            output_dir=profiling_config.get('output_dir', 'outputs'),
+        ) as profile:
+            # Load and process data
+            df = detector.load_and_preprocess_data(data_path)
+        
+            # Detect anomalies
+            df = detector.detect_anomalies(df)
         
-        # Detect anomalies
-        df = detector.detect_anomalies(df)
+            # Keep the fitted model and threshold for labelling later batches
+            detector.save_model()
         
-        # Visualize results
-        detector.visualize_results(df)
+            # Visualize results
+            detector.visualize_results(df)
         
-        # Generate alerts and export results
-        anomaly_count = df['anomaly'].value_counts().get('Anomaly', 0)
-        if anomaly_count > 0:
-            alert_msg = f"ALERT: Detected {anomaly_count} anomalous activities in network traffic!"
-            print(alert_msg)
-            logging.warning(alert_msg)
-            
-            # Export anomalous records
-            timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
-            anomalies_df = df[df['anomaly'] == 'Anomaly'].sort_values('anomaly_score')
-            anomalies_df.to_csv(os.path.join('outputs', f'anomalies_{timestamp}.csv'), index=False)
-            logging.info(f"Anomalous records exported to anomalies_{timestamp}.csv")
-        else:
-            logging.info("No anomalies detected in network traffic")
-            print("Network traffic is normal.")
+            # Generate alerts and export results
+            anomaly_count = df['anomaly'].value_counts().get('Anomaly', 0)
+            if anomaly_count > 0:
+                alert_msg = f"ALERT: Detected {anomaly_count} anomalous activities in network traffic!"
+                print(alert_msg)
+                logging.warning(alert_msg)
+            
+                # Export anomalous records
+                timestamp = datetime.now().strftime("%Y%m%d_%H%M%S")
+                detector.export_anomalies(df, timestamp)
+                logging.info(f"Anomalous records exported to anomalies_{timestamp}.csv")
+            else:
+                logging.info("No anomalies detected in network traffic")
+                print("Network traffic is normal.")
+
+        logging.info(f"Stage timings: {json.dumps(detector.stage_timings)}")
+        if profile.result:
+            print(f"Profile written to {profile.result['profile_file']}")
 
     except Exception as e:
         logging.error(f"Error in main execution: {str(e)}")
         print(f"An error occurred. Check the logs for details.")
 
 if __name__ == "__main__":
-    main()
+    import argparse
+    parser = argparse.ArgumentParser(description="Fit the model on one traffic file and export its anomalies.")
+    parser.add_argument('data', nargs='?', default="network_traffic.csv",
+                        help='CSV or rotated-capture manifest (default network_traffic.csv); '
+                             'use python -m utils.batch_analysis to score many files with the saved model')
+    main(parser.parse_args().data)
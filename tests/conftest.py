@@ -0,0 +1,5 @@
+import os
+import sys
+
+# Tests import the flat top-level modules (capture_to_csv, main, app) and the utils package
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,70 @@
+import csv
+import io
+import os
+
+import numpy as np
+import pandas as pd
+
+from capture_to_csv import CSV_HEADER, aggregate_rows
+from utils.batch_aggregator import PACKET_COLUMNS, aggregate_frame, aggregate_packet_csv, aggregate_packets
+
+SAMPLE_CSV = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'network_traffic.csv')
+BASE = 1_700_000_000
+
+# Flows with missing ports/IPs: each missing key is its own group value, as in aggregate_rows
+MISSING_KEY_ROWS = [
+    (BASE + 1, '10.0.0.1', '1000', '10.0.0.2', '80', 'TCP', 100, ''),
+    (BASE + 2, '10.0.0.1', None, '10.0.0.2', '80', 'TCP', 200, ''),
+    (BASE + 3, '10.0.0.1', '1000', '10.0.0.2', None, 'TCP', 300, ''),
+    (BASE + 4, '10.0.0.1', None, '10.0.0.2', None, 'TCP', 400, ''),
+    (BASE + 5, None, '1000', '10.0.0.2', '80', 'UDP', 500, ''),
+    (BASE + 6, '10.0.0.1', '1000', None, '80', 'UDP', 600, ''),
+    (BASE + 7, '10.0.0.1', None, '10.0.0.2', '80', 'TCP', 700, ''),
+    (BASE + 40, '10.0.0.1', None, '10.0.0.2', '80', 'TCP', 800, ''),
+]
+
+
+def _records(flows):
+    return flows[CSV_HEADER].to_dict('records')
+
+
+def test_network_traffic_csv_matches_aggregate_rows():
+    with open(SAMPLE_CSV, newline='', encoding='utf-8') as f:
+        reader = csv.reader(f)
+        next(reader)
+        expected = aggregate_rows(list(reader))
+    flows = aggregate_packet_csv(SAMPLE_CSV)
+    assert len(expected) > 0
+    assert _records(flows) == [{name: row[name] for name in CSV_HEADER} for row in expected]
+
+
+def test_missing_keys_match_aggregate_rows():
+    assert aggregate_packets(MISSING_KEY_ROWS) == aggregate_rows(MISSING_KEY_ROWS)
+
+
+def test_missing_keys_survive_a_csv_round_trip():
+    buffer = io.StringIO()
+    pd.DataFrame(MISSING_KEY_ROWS, columns=PACKET_COLUMNS).to_csv(buffer, index=False)
+    buffer.seek(0)
+    # read_csv turns the missing keys into NaN and the ports into floats
+    flows = aggregate_frame(pd.read_csv(buffer))
+    expected = aggregate_rows(MISSING_KEY_ROWS)
+    assert flows['bytes_transferred'].tolist() == [row['bytes_transferred'] for row in expected]
+    assert flows['packet_count'].tolist() == [row['packet_count'] for row in expected]
+    assert flows['timestamp'].tolist() == [row['timestamp'] for row in expected]
+
+
+def test_nan_timestamps_and_lengths():
+    frame = pd.DataFrame({
+        'timestamp': [BASE + 1.5, np.nan, BASE + 2.25, BASE + 31.0],
+        'src_ip': ['10.0.0.1'] * 4,
+        'src_port': ['1000'] * 4,
+        'dst_ip': ['10.0.0.2'] * 4,
+        'dst_port': ['80'] * 4,
+        'protocol': ['UDP'] * 4,
+        'length': [100, 200, np.nan, -5],
+        'info': [''] * 4,
+    })
+    # aggregate_rows skips a NaN timestamp (it cannot be parsed) and counts a NaN length as 0
+    rows = list(frame.itertuples(index=False, name=None))
+    assert _records(aggregate_frame(frame)) == [{name: row[name] for name in CSV_HEADER} for row in aggregate_rows(rows)]
@@ -0,0 +1,30 @@
+import pytest
+
+from capture_to_csv import check_number
+from utils.capture_manager import CaptureManager
+
+
+@pytest.mark.parametrize('value', ['x', None, True, float('nan'), 1.5, -1])
+def test_check_number_rejects(value):
+    with pytest.raises(ValueError):
+        check_number('max_packets', value)
+
+
+def test_check_number_converts():
+    assert check_number('duration', '30', minimum=1, maximum=3600) == 30
+    assert check_number('max_output_mb', 2.5, integer=False) == 2.5
+    with pytest.raises(ValueError):
+        check_number('duration', 7200, minimum=1, maximum=3600)
+
+
+@pytest.mark.parametrize('kwargs', [
+    {'limits': {'max_flows': 'many'}},
+    {'limits': {'max_duration_seconds': -5}},
+    {'limits': ['max_flows']},
+    {'workers': 0},
+])
+def test_bad_limits_fail_before_the_session_starts(tmp_path, kwargs):
+    manager = CaptureManager({'capture_manager': {'score': False, 'output_dir': str(tmp_path)}})
+    with pytest.raises(ValueError):
+        manager.start('lo', **kwargs)
+    assert manager.sessions == {}
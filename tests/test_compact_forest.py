@@ -0,0 +1,58 @@
+import json
+import os
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from generate_sample_data import generate_sample_data
+from main import NetworkAnomalyDetector
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')
+
+
+@pytest.fixture
+def trained(tmp_path):
+    """Config file and scoring CSV for a model saved both as joblib and as a compact export."""
+    with open(CONFIG_FILE) as f:
+        config = json.load(f)
+    config['model_path'] = str(tmp_path / 'model.joblib')
+    config['compact_model_path'] = str(tmp_path / 'compact')
+    config['metrics'] = {'enabled': False}
+    config_file = tmp_path / 'config.json'
+    config_file.write_text(json.dumps(config))
+
+    train_file = tmp_path / 'train.csv'
+    generate_sample_data('2024-01-01', duration_hours=12, output_file=str(train_file), seed=0)
+    detector = NetworkAnomalyDetector(str(config_file))
+    detector.detect_anomalies(detector.load_and_preprocess_data(str(train_file)))
+    detector.save_model()
+
+    score_file = tmp_path / 'score.csv'
+    frame = generate_sample_data('2024-02-01', duration_hours=4, output_file=str(score_file), seed=1)
+    # Rows with missing features (imputed with column means) and with every feature zero
+    extra = frame.iloc[:3].copy()
+    features = config['features']
+    extra.loc[extra.index[0], features[:2]] = np.nan
+    extra.loc[extra.index[1], features] = np.nan
+    extra.loc[extra.index[2], features] = 0
+    pd.concat([frame, extra], ignore_index=True).to_csv(score_file, index=False)
+    return str(config_file), str(score_file)
+
+
+def _score(config_file, score_file, compact):
+    detector = NetworkAnomalyDetector(config_file)
+    if compact:
+        detector.load_compact_model()
+    else:
+        detector.load_model()
+    return detector.score_with_saved_model(detector.load_and_preprocess_data(score_file, fit_scaler=False))
+
+
+def test_compact_model_matches_joblib_model(trained):
+    config_file, score_file = trained
+    expected = _score(config_file, score_file, compact=False)
+    actual = _score(config_file, score_file, compact=True)
+    assert np.allclose(actual['anomaly_score'], expected['anomaly_score'], rtol=1e-9, atol=1e-12)
+    assert (actual['anomaly'] == expected['anomaly']).all()
+    assert np.isfinite(actual['anomaly_score'].iloc[-3:]).all()
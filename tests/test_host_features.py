@@ -0,0 +1,91 @@
+import json
+import os
+import time
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from generate_sample_data import generate_sample_data
+from main import NetworkAnomalyDetector
+from utils.capture_manager import ScoringService
+from utils.host_features import HostContext
+
+CONFIG_FILE = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'config.json')
+
+
+class _Session:
+    """Session interface ScoringService expects."""
+
+    def __init__(self, session_id):
+        self.id = session_id
+        self.output_file = f'{session_id}.csv'
+
+    def record_scores(self, windows, anomalies, min_score, latency=None):
+        pass
+
+    def record_dropped(self, error=None):
+        raise AssertionError(error)
+
+
+@pytest.fixture
+def config_file(tmp_path):
+    with open(CONFIG_FILE) as f:
+        config = json.load(f)
+    config['model_path'] = str(tmp_path / 'model.joblib')
+    config['compact_model_path'] = ''
+    config['metrics'] = {'enabled': False}
+    config['anomaly_store'] = {'enabled': False}
+    config['host_features'] = {**config['host_features'], 'enabled': True}
+    path = tmp_path / 'config.json'
+    path.write_text(json.dumps(config))
+    return str(path)
+
+
+def _with_hosts(frame):
+    rng = np.random.default_rng(0)
+    frame = frame.copy()
+    frame['source_ip'] = [f'10.0.0.{i}' for i in rng.integers(1, 6, len(frame))]
+    frame['destination_ip'] = [f'10.0.1.{i}' for i in rng.integers(1, 4, len(frame))]
+    return frame
+
+
+def test_fit_without_hosts_keeps_config_features(config_file, tmp_path):
+    train_file = tmp_path / 'train.csv'
+    generate_sample_data('2024-01-01', duration_hours=6, output_file=str(train_file), seed=0)
+    detector = NetworkAnomalyDetector(config_file)
+    configured = list(detector.config['features'])
+    detector.detect_anomalies(detector.load_and_preprocess_data(str(train_file)))
+    detector.save_model()
+
+    assert detector.config['features'] == configured
+    assert not set(HostContext.FEATURES) & set(detector.features)
+
+    scorer = NetworkAnomalyDetector(config_file)
+    scorer.load_saved_model()
+    assert scorer.features == detector.features
+    df = scorer.score_with_saved_model(scorer.load_and_preprocess_data(str(train_file), fit_scaler=False))
+    assert len(df) > 0
+
+
+def test_scoring_service_keeps_host_state_between_batches(config_file, tmp_path):
+    frame = _with_hosts(generate_sample_data('2024-01-01', duration_hours=6, output_file=str(tmp_path / 'train.csv'), seed=0))
+    detector = NetworkAnomalyDetector(config_file)
+    detector.detect_anomalies(detector.preprocess_frame(frame.copy()))
+    detector.save_model()
+
+    stream = _with_hosts(generate_sample_data('2024-02-01', duration_hours=2, output_file=str(tmp_path / 'score.csv'), seed=1))
+    stream = stream.drop(columns=HostContext.FEATURES, errors='ignore').sort_values('timestamp', ignore_index=True)
+    expected = HostContext.from_config(detector.config).transform_frame(stream.copy())
+
+    scored = []
+    service = ScoringService(config_file, store_anomalies=False, on_scored=lambda _, df: scored.append(df))
+    session = _Session('stream')
+    half = len(stream) // 2
+    for batch in (stream.iloc[:half], stream.iloc[half:]):
+        service._score(session, batch.to_dict('records'), time.monotonic())
+
+    features = service.detector.features
+    raw = pd.concat([pd.DataFrame({name: service.detector.raw_feature(df, name) for name in features}) for df in scored], ignore_index=True)
+    for name in HostContext.FEATURES:
+        np.testing.assert_allclose(raw[name], expected[name].astype(float), rtol=1e-3, atol=0.05)
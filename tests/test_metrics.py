@@ -0,0 +1,29 @@
+import tracemalloc
+
+import pytest
+
+from utils.metrics import MetricsRegistry
+
+
+@pytest.fixture
+def tracing():
+    started = not tracemalloc.is_tracing()
+    if started:
+        tracemalloc.start()
+    yield
+    if started:
+        tracemalloc.stop()
+
+
+def test_nested_timer_keeps_outer_peak(tracing):
+    metrics = MetricsRegistry(track_memory=True)
+    size = 8 * 1024 * 1024
+    with metrics.timer('outer'):
+        block = bytearray(size)
+        del block
+        with metrics.timer('inner'):
+            small = bytearray(1024)
+            del small
+    gauges = metrics.snapshot()['gauges']
+    assert gauges['outer_peak_memory_bytes'] >= size
+    assert gauges['inner_peak_memory_bytes'] < size
@@ -0,0 +1,61 @@
+import json
+
+import pytest
+
+from utils.rotation import RotatingCsvWriter, read_range, segments_for_range
+from utils.timestamps import NS_PER_SECOND, iso_utc
+
+HEADER = ['timestamp', 'bytes_transferred', 'source_ip']
+BASE = 1_704_103_200 * NS_PER_SECOND
+
+
+def _rows(starts):
+    return [
+        {'timestamp': timestamp, 'bytes_transferred': 100 + i, 'source_ip': '10.0.0.1', 'window_start_ns': start}
+        for i, (start, timestamp) in enumerate(zip(starts, iso_utc(starts)))
+    ]
+
+
+def test_open_segment_is_readable_before_the_manifest_catches_up(tmp_path):
+    writer = RotatingCsvWriter(str(tmp_path / 'edge.csv'), HEADER, max_seconds=3600, compress=False, manifest_interval=3600)
+    writer.write_rows(_rows([BASE, BASE + 30 * NS_PER_SECOND]))
+    writer.write_rows(_rows([BASE + 60 * NS_PER_SECOND]))
+    manifest = writer.manifest_path
+    # Throttled: the manifest has not recorded the open segment's rows yet
+    with open(manifest, encoding='utf-8') as f:
+        assert json.load(f)['segments'][0]['start_ns'] is None
+    assert len(segments_for_range(manifest, BASE + 45 * NS_PER_SECOND)) == 1
+    assert read_range(manifest, BASE + 45 * NS_PER_SECOND)['bytes_transferred'].tolist() == [100]
+    assert len(read_range(manifest)) == 3
+    writer.close()
+
+
+def test_manifest_records_rows_after_writes(tmp_path):
+    writer = RotatingCsvWriter(str(tmp_path / 'edge.csv'), HEADER, compress=False, manifest_interval=0)
+    writer.write_rows(_rows([BASE, BASE + 30 * NS_PER_SECOND]))
+    with open(writer.manifest_path, encoding='utf-8') as f:
+        segment = json.load(f)['segments'][0]
+    assert (segment['rows'], segment['start_ns'], segment['end_ns'], segment['closed']) == (2, BASE, BASE + 30 * NS_PER_SECOND, False)
+    writer.close()
+
+
+def test_closed_segments_outside_the_range_are_skipped(tmp_path):
+    writer = RotatingCsvWriter(str(tmp_path / 'edge.csv'), HEADER, max_seconds=60, compress=False)
+    writer.write_rows(_rows([BASE]))
+    writer.write_rows(_rows([BASE + 120 * NS_PER_SECOND]))
+    writer.close()
+    paths = segments_for_range(writer.manifest_path, BASE + 90 * NS_PER_SECOND)
+    assert [path.rsplit('.', 2)[-2] for path in paths] == ['00002']
+
+
+def test_partial_write_counts_only_written_rows(tmp_path):
+    writer = RotatingCsvWriter(str(tmp_path / 'edge.csv'), HEADER, compress=False, manifest_interval=0)
+    rows = _rows([BASE, BASE + 30 * NS_PER_SECOND, BASE + 60 * NS_PER_SECOND])
+    broken = {'bytes_transferred': 0}
+    with pytest.raises(KeyError):
+        writer.write_rows(rows[:1] + [broken] + rows[1:])
+    assert writer.rows_written == 1
+    # The caller retries only the rows after the written one
+    writer.write_rows(rows[1:])
+    writer.close()
+    assert read_range(writer.manifest_path)['bytes_transferred'].tolist() == [100, 101, 102]
@@ -0,0 +1,69 @@
+from multiprocessing import shared_memory
+
+import pytest
+
+from capture_to_csv import RollingAggregator
+from utils.sharded_aggregator import ShardedAggregator, _run, _synthetic_packets
+from utils.timestamps import NS_PER_SECOND
+
+
+def _sorted_rows(rows):
+    return sorted(tuple(sorted(row.items())) for row in rows)
+
+
+def _in_process(packets, window_seconds, tcp_idle_seconds):
+    aggregator = RollingAggregator(window_seconds=window_seconds, tcp_idle_seconds=tcp_idle_seconds)
+    return _run(aggregator, packets, window_seconds * NS_PER_SECOND)
+
+
+def _sharded(packets, window_seconds, tcp_idle_seconds, **kwargs):
+    with ShardedAggregator(window_seconds=window_seconds, workers=2, tcp_idle_seconds=tcp_idle_seconds, **kwargs) as aggregator:
+        return _run(aggregator, packets, window_seconds * NS_PER_SECOND)
+
+
+def test_matches_in_process_aggregator():
+    """Same rows as RollingAggregator, including retransmissions and connections reset after idling."""
+    packets = _synthetic_packets(20_000, flows=500, seed=1)
+    expected = _in_process(packets, window_seconds=1, tcp_idle_seconds=2)
+    actual = _sharded(packets, window_seconds=1, tcp_idle_seconds=2)
+    assert any(row['retransmission_rate'] for row in expected)
+    assert _sorted_rows(actual) == _sorted_rows(expected)
+    starts = [row['window_start_ns'] for row in actual]
+    assert starts == sorted(starts)
+
+
+def test_idle_gap_starts_a_new_connection_without_a_flush():
+    base = 1_700_000_000 * NS_PER_SECOND
+    conn = ('10.0.0.1', '1000', '10.0.0.2', '443')
+    packets = [
+        (base, *conn, 'TCP', '100', (0x18, 1000, 100)),
+        # More than tcp_idle_seconds later the same sequence number starts a new
+        # connection, although no window was flushed in between
+        (base + 5 * NS_PER_SECOND, *conn, 'TCP', '100', (0x18, 1000, 100)),
+        (base + 5 * NS_PER_SECOND + 1, *conn, 'TCP', '100', (0x18, 1000, 100)),
+    ]
+    expected = _in_process(packets, window_seconds=30, tcp_idle_seconds=2)
+    assert len(expected) == 1
+    assert expected[0]['retransmission_rate'] == pytest.approx(1 / 3)
+    assert _sorted_rows(_sharded(packets, 30, 2)) == _sorted_rows(expected)
+
+
+def test_values_that_cannot_be_joined_round_trip():
+    base = 1_700_000_000 * NS_PER_SECOND
+    packets = [
+        (base, '10.0.0.1', 1000, '10.0.0.2', 80, 'UDP', 60, None),
+        (base + 1, '10.0.0.1', '1000', '10.0.0.2', '80', 'odd\x00proto', '', None),
+        (base + 2, '10.0.0.3', '', '10.0.0.4', '', 'ICMP', '98', None),
+    ]
+    assert _sorted_rows(_sharded(packets, 30, 300)) == _sorted_rows(_in_process(packets, 30, 300))
+
+
+def test_close_without_flush_frees_shared_memory():
+    aggregator = ShardedAggregator(window_seconds=30, workers=2)
+    aggregator.add_packet(1_700_000_000 * NS_PER_SECOND, '10.0.0.1', '1000', '10.0.0.2', '80', 'TCP', '60')
+    names = [name for ring in aggregator._rings for name in ring.names]
+    aggregator.close()
+    for name in names:
+        with pytest.raises(FileNotFoundError):
+            shared_memory.SharedMemory(name=name)
+    assert aggregator.flush_all() == []
@@ -0,0 +1,107 @@
+import json
+import os
+import time
+
+import pytest
+
+from utils.transport import FRAME_HEADER, Collector, RemoteSensor, SensorClient, decode_payload, encode_frame
+
+TEMPLATE = {
+    'timestamp': '2024-01-01T10:00:00+00:00', 'bytes_transferred': 1500, 'packet_count': 3,
+    'connection_duration': 1.25, 'source_port': '51514', 'destination_port': '443',
+    'retransmission_rate': 0.0, 'protocol': 'TLS', 'bytes_per_packet': 500.0,
+    'packets_per_second': 2.4, 'syn_ratio': 0.0, 'fin_ratio': 0.0, 'rst_ratio': 0.0,
+    'out_of_order_rate': 0.0, 'source_ip': '10.0.0.1', 'destination_ip': '10.0.0.2',
+}
+
+
+def _decode(frame):
+    _, _, flags, n_rows, length = FRAME_HEADER.unpack_from(frame)
+    assert len(frame) == FRAME_HEADER.size + length
+    return decode_payload(flags, n_rows, frame[FRAME_HEADER.size:])
+
+
+def _batches(rows, batch_rows):
+    batches = []
+    for b in range(rows // batch_rows):
+        batch = []
+        for i in range(batch_rows):
+            row = dict(TEMPLATE)
+            n = b * batch_rows + i
+            row['window_start_ns'] = 1704103200 * 10 ** 9 + (n // 1000) * 30 * 10 ** 9
+            row['bytes_transferred'] = 1000 + n % 5000
+            row['source_port'] = str(1024 + n % 60000)
+            batch.append(row)
+        batches.append(batch)
+    return batches
+
+
+@pytest.mark.parametrize('compress', [True, False])
+def test_text_values_round_trip_with_any_character(compress):
+    rows = [
+        {'protocol': 'a\x1fb', 'info': 'line\nbreak', 'count': 1, 'ratio': 0.5},
+        {'protocol': '', 'info': 'ünïcödé \x00 end', 'count': 2, 'ratio': 1},
+        {'protocol': None, 'info': '\x1f\x1f', 'count': 3, 'ratio': 2.25},
+    ]
+    meta, decoded = _decode(encode_frame(rows, 'sensor', 1, 7, compress=compress))
+    assert (meta['sensor'], meta['boot'], meta['seq']) == ('sensor', 1, 7)
+    assert decoded == [
+        {'protocol': 'a\x1fb', 'info': 'line\nbreak', 'count': 1, 'ratio': 0.5},
+        {'protocol': '', 'info': 'ünïcödé \x00 end', 'count': 2, 'ratio': 1.0},
+        {'protocol': '', 'info': '\x1f\x1f', 'count': 3, 'ratio': 2.25},
+    ]
+
+
+def test_mismatched_text_lengths_are_rejected():
+    frame = bytearray(encode_frame([{'protocol': 'TCP'}, {'protocol': 'UDP'}], 'sensor', 1, 1, compress=False))
+    # Row count in the header no longer matches the column's value lengths
+    frame[FRAME_HEADER.size - 8:FRAME_HEADER.size - 4] = (1).to_bytes(4, 'big')
+    with pytest.raises(ValueError):
+        _decode(bytes(frame))
+
+
+def test_stored_positions_survive_a_restart(tmp_path):
+    sensor = RemoteSensor('edge-1', str(tmp_path))
+    sensor.mark_stored(3, 41)
+    sensor.mark_stored(3, 42)
+    assert not os.path.exists(f'{sensor.state_path}.tmp')
+    assert RemoteSensor('edge-1', str(tmp_path)).last_seq == {3: 42}
+
+
+def test_loopback_delivers_every_row_exactly_once(tmp_path):
+    """Collector outage and restart with fresh in-memory state, plus a resent frame whose ack was lost."""
+    batches = _batches(rows=20000, batch_rows=500)
+    rows = sum(len(batch) for batch in batches)
+    outage_batches = 5
+    collector = Collector('127.0.0.1', 0, output_dir=str(tmp_path / 'collector'), rotation={'compress': False}).start()
+    port = collector.address[1]
+    sensor = SensorClient('127.0.0.1', port, 'loopback', spool_dir=str(tmp_path / 'spool'), max_backoff=0.2)
+    half = len(batches) // 2
+    for batch in batches[:half]:
+        sensor.send(batch)
+    deadline = time.monotonic() + 30
+    while len(sensor.spool) and time.monotonic() < deadline:
+        time.sleep(0.01)
+    # Outage: stop the collector, keep sending into the spool, restart on the same port
+    collector.stop()
+    stored_before = sum(s['rows'] for s in collector.snapshot()['sensors'])
+    # The last delivered frame again, as if the collector had died before acknowledging it
+    sensor.spool.push(f'{sensor.boot:020d}_{half:012d}', encode_frame(batches[half - 1], sensor.sensor_id, sensor.boot, half))
+    for batch in batches[half:half + outage_batches]:
+        sensor.send(batch)
+    assert len(sensor.spool) > outage_batches
+    # A new collector: dedup positions come only from the state file on disk
+    restarted = Collector('127.0.0.1', port, output_dir=collector.output_dir, rotation={'compress': False}).start()
+    for batch in batches[half + outage_batches:]:
+        sensor.send(batch)
+    sensor.close(timeout=60)
+    restarted.stop()
+
+    after_restart = restarted.snapshot()['sensors']
+    assert stored_before + sum(s['rows'] for s in after_restart) == rows
+    assert sum(s['duplicates'] for s in after_restart) == 1
+    stored_rows = 0
+    for manifest in (collector.sensors['loopback'].manifest, restarted.sensors['loopback'].manifest):
+        with open(manifest, 'r', encoding='utf-8') as f:
+            stored_rows += sum(segment['rows'] for segment in json.load(f)['segments'])
+    assert stored_rows == rows
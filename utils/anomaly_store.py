@@ -0,0 +1,186 @@
+import os
+import sqlite3
+from contextlib import closing
+
+import numpy as np
+
+from utils.timestamps import epoch_seconds
+
+FEATURE_COLUMNS = [
+    'bytes_transferred',
+    'packet_count',
+    'connection_duration',
+    'retransmission_rate',
+    'bytes_per_packet',
+    'packets_per_second',
+]
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS anomalies (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    analysis_id TEXT NOT NULL,
+    source_file TEXT,
+    ts INTEGER,
+    timestamp TEXT,
+    protocol TEXT,
+    source_ip TEXT,
+    source_port INTEGER,
+    destination_port INTEGER,
+    bytes_transferred REAL,
+    packet_count REAL,
+    connection_duration REAL,
+    retransmission_rate REAL,
+    bytes_per_packet REAL,
+    packets_per_second REAL,
+    anomaly_score REAL
+);
+CREATE INDEX IF NOT EXISTS idx_anomalies_ts ON anomalies (ts);
+CREATE INDEX IF NOT EXISTS idx_anomalies_protocol_ts ON anomalies (protocol, ts);
+CREATE INDEX IF NOT EXISTS idx_anomalies_dst_port_ts ON anomalies (destination_port, ts);
+CREATE INDEX IF NOT EXISTS idx_anomalies_src_port ON anomalies (source_port);
+CREATE INDEX IF NOT EXISTS idx_anomalies_source_ip_ts ON anomalies (source_ip, ts);
+CREATE INDEX IF NOT EXISTS idx_anomalies_analysis ON anomalies (analysis_id);
+"""
+
+# Filterable columns -> SQL comparison
+FILTERS = {
+    'protocol': 'protocol = ?',
+    'source_ip': 'source_ip = ?',
+    'source_port': 'source_port = ?',
+    'destination_port': 'destination_port = ?',
+    'analysis_id': 'analysis_id = ?',
+    'start': 'ts >= ?',
+    'end': 'ts < ?',
+    'min_score': 'anomaly_score >= ?',
+    'max_score': 'anomaly_score <= ?',
+}
+
+GROUP_BY = {
+    'protocol': 'protocol',
+    'destination_port': 'destination_port',
+    'source_port': 'source_port',
+    'source_ip': 'source_ip',
+    'hour': "strftime('%Y-%m-%dT%H:00:00', ts, 'unixepoch')",
+    'day': "strftime('%Y-%m-%d', ts, 'unixepoch')",
+}
+
+ORDER_BY = {
+    'time': 'ts DESC, id DESC',
+    'score': 'anomaly_score ASC, id ASC',
+}
+
+
+class AnomalyStore:
+    """Embedded SQLite store of anomalous records from every analysis.
+
+    Rows are appended per analysis and indexed on time, protocol,
+    destination port and source so historical searches do not need to scan
+    the per-run CSV exports.
+    """
+
+    def __init__(self, path=os.path.join('outputs', 'anomalies.db')):
+        self.path = path
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def append(self, df, analysis_id, source_file=None):
+        """Append anomalous rows (features in original units) and return the count."""
+        if df.empty:
+            return 0
+        ts = epoch_seconds(df['timestamp']) if 'timestamp' in df else [None] * len(df)
+        columns = {
+            'timestamp': _column(df, 'timestamp', str),
+            'protocol': _column(df, 'protocol', str),
+            'source_ip': _column(df, 'source_ip', str) if 'source_ip' in df else _column(df, 'src_ip', str),
+            'source_port': _column(df, 'source_port', _to_int),
+            'destination_port': _column(df, 'destination_port', _to_int),
+        }
+        features = {name: _column(df, name, float) for name in FEATURE_COLUMNS}
+        scores = _column(df, 'anomaly_score', float)
+        rows = [
+            (
+                analysis_id, source_file, None if ts[i] is None else int(ts[i]),
+                columns['timestamp'][i], columns['protocol'][i], columns['source_ip'][i],
+                columns['source_port'][i], columns['destination_port'][i],
+                *(features[name][i] for name in FEATURE_COLUMNS),
+                scores[i],
+            )
+            for i in range(len(df))
+        ]
+        placeholders = ', '.join(['?'] * (8 + len(FEATURE_COLUMNS) + 1))
+        with closing(self._connect()) as conn, conn:
+            conn.executemany(
+                f"INSERT INTO anomalies (analysis_id, source_file, ts, timestamp, protocol, source_ip, "
+                f"source_port, destination_port, {', '.join(FEATURE_COLUMNS)}, anomaly_score) "
+                f"VALUES ({placeholders})",
+                rows,
+            )
+        return len(rows)
+
+    def _where(self, filters):
+        clauses, params = [], []
+        for key, value in filters.items():
+            if value is None or value == '' or key not in FILTERS:
+                continue
+            clauses.append(FILTERS[key])
+            params.append(value)
+        return (' WHERE ' + ' AND '.join(clauses)) if clauses else '', params
+
+    def query(self, filters=None, limit=100, offset=0, order='time'):
+        """Return a page of matching records plus the total match count."""
+        where, params = self._where(filters or {})
+        order_sql = ORDER_BY.get(order, ORDER_BY['time'])
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            total = conn.execute(f'SELECT COUNT(*) FROM anomalies{where}', params).fetchone()[0]
+            cursor = conn.execute(
+                f'SELECT * FROM anomalies{where} ORDER BY {order_sql} LIMIT ? OFFSET ?',
+                params + [int(limit), int(offset)],
+            )
+            records = [dict(row) for row in cursor]
+        return {'total': total, 'limit': int(limit), 'offset': int(offset), 'records': records}
+
+    def aggregate(self, group_by, filters=None, limit=100):
+        """Server-side aggregation of matching records by one dimension."""
+        if group_by not in GROUP_BY:
+            raise ValueError(f"Unsupported group_by '{group_by}'. Use one of: {sorted(GROUP_BY)}")
+        where, params = self._where(filters or {})
+        key_sql = GROUP_BY[group_by]
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            cursor = conn.execute(
+                f'SELECT {key_sql} AS key, COUNT(*) AS count, AVG(anomaly_score) AS avg_score, '
+                f'MIN(anomaly_score) AS min_score, SUM(bytes_transferred) AS total_bytes, '
+                f'MIN(ts) AS first_ts, MAX(ts) AS last_ts '
+                f'FROM anomalies{where} GROUP BY key ORDER BY count DESC LIMIT ?',
+                params + [int(limit)],
+            )
+            groups = [dict(row) for row in cursor]
+        return {'group_by': group_by, 'groups': groups}
+
+
+def _column(df, name, cast):
+    if name not in df:
+        return [None] * len(df)
+    values = df[name].tolist()
+    out = []
+    for value in values:
+        if value is None or (isinstance(value, float) and np.isnan(value)):
+            out.append(None)
+        else:
+            try:
+                out.append(cast(value))
+            except (TypeError, ValueError):
+                out.append(None)
+    return out
+
+
+def _to_int(value):
+    return int(float(value))
@@ -0,0 +1,385 @@
+import argparse
+import fnmatch
+import json
+import logging
+import multiprocessing as mp
+import os
+import shutil
+import tarfile
+import time
+import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+DATA_SUFFIXES = ('.csv', '.csv.gz', '.manifest.json')
+ARCHIVE_SUFFIXES = ('.zip', '.tar', '.tar.gz', '.tgz', '.tar.bz2')
+# Archive members are copied in chunks so the size limit holds whatever the headers claim
+COPY_CHUNK_BYTES = 1024 * 1024
+
+# Loaded once per worker process by _init_worker()
+_detector = None
+
+
+def is_data_file(name):
+    return name.lower().endswith(DATA_SUFFIXES)
+
+
+def is_archive(name):
+    return name.lower().endswith(ARCHIVE_SUFFIXES)
+
+
+def _unique_path(directory, name):
+    path = os.path.join(directory, name)
+    stem, suffix = name, ''
+    for known in DATA_SUFFIXES:
+        if name.lower().endswith(known):
+            stem, suffix = name[:-len(known)], name[-len(known):]
+            break
+    n = 1
+    while os.path.exists(path):
+        path = os.path.join(directory, f'{stem}_{n}{suffix}')
+        n += 1
+    return path
+
+
+def _copy_limited(src, dst, limit):
+    """Copy `src` to `dst`, raising ValueError once more than `limit` bytes were read; returns bytes copied."""
+    copied = 0
+    while True:
+        chunk = src.read(COPY_CHUNK_BYTES)
+        if not chunk:
+            return copied
+        copied += len(chunk)
+        if limit is not None and copied > limit:
+            raise ValueError(f"Archive contents exceed the {limit} byte extraction limit")
+        dst.write(chunk)
+
+
+def extract_archive(path, extract_dir, max_files=None, max_bytes=None):
+    """Copy the data files of a zip/tar archive into `extract_dir`; returns their paths.
+
+    Members are streamed one at a time and written under their base name
+    (renamed on collisions), so member paths cannot escape `extract_dir`.
+    Extraction stops with ValueError as soon as more than `max_files`
+    data files or `max_bytes` uncompressed bytes would be written; the
+    files written so far are removed. Rotation manifests are skipped: the
+    segments they list are relative to the original capture directory.
+    """
+    os.makedirs(extract_dir, exist_ok=True)
+    extracted = []
+    written = 0
+
+    def copy_member(name, open_member):
+        nonlocal written
+        if max_files is not None and len(extracted) >= max_files:
+            raise ValueError(f"{os.path.basename(path)} holds more than {max_files} data files")
+        target = _unique_path(extract_dir, name)
+        extracted.append(target)
+        with open_member() as src, open(target, 'wb') as dst:
+            written += _copy_limited(src, dst, None if max_bytes is None else max_bytes - written)
+
+    try:
+        if path.lower().endswith('.zip'):
+            with zipfile.ZipFile(path) as archive:
+                for member in archive.infolist():
+                    name = os.path.basename(member.filename)
+                    if member.is_dir() or not name.lower().endswith(('.csv', '.csv.gz')):
+                        continue
+                    copy_member(name, lambda: archive.open(member))
+        else:
+            with tarfile.open(path, 'r:*') as archive:
+                for member in archive:
+                    name = os.path.basename(member.name)
+                    if not member.isfile() or not name.lower().endswith(('.csv', '.csv.gz')):
+                        continue
+                    copy_member(name, lambda: archive.extractfile(member))
+        logging.info(f"Extracted {len(extracted)} files ({written} bytes) from {path} to {extract_dir}")
+        return extracted
+    except (zipfile.BadZipFile, tarfile.TarError, ValueError) as e:
+        logging.error(f"Error extracting archive {path}: {str(e)}")
+        for target in extracted:
+            if os.path.exists(target):
+                os.remove(target)
+        if isinstance(e, ValueError):
+            raise
+        raise ValueError(f"Unreadable archive {os.path.basename(path)}: {str(e)}") from e
+
+
+def expand_inputs(paths, extract_dir, max_files=None, max_bytes=None):
+    """Resolve files, directories, glob patterns and archives into a de-duplicated list of data files.
+
+    Directories contribute their top-level CSVs and rotation manifests;
+    archives are extracted into `extract_dir`. More than `max_files`
+    files, or more than `max_bytes` extracted from archives, raise
+    ValueError before anything further is extracted, and `extract_dir`
+    is removed.
+    """
+    files = []
+    budget = {'bytes': max_bytes}
+    try:
+        _expand(paths, extract_dir, files, max_files, budget)
+    except Exception:
+        shutil.rmtree(extract_dir, ignore_errors=True)
+        raise
+    seen = set()
+    return [path for path in files if not (os.path.abspath(path) in seen or seen.add(os.path.abspath(path)))]
+
+
+def _expand(paths, extract_dir, files, max_files, budget):
+    for path in paths:
+        if any(ch in os.path.basename(path) for ch in '*?['):
+            directory = os.path.dirname(path) or '.'
+            matches = sorted(
+                os.path.join(directory, name) for name in os.listdir(directory)
+                if fnmatch.fnmatch(name, os.path.basename(path))
+            )
+            _expand(matches, extract_dir, files, max_files, budget)
+        elif os.path.isdir(path):
+            files.extend(sorted(
+                os.path.join(path, name) for name in os.listdir(path)
+                if is_data_file(name) and os.path.isfile(os.path.join(path, name))
+            ))
+        elif not os.path.exists(path):
+            raise ValueError(f"File not found: {path}")
+        elif is_archive(path):
+            extracted = extract_archive(
+                path, extract_dir,
+                max_files=None if max_files is None else max(max_files - len(files), 0),
+                max_bytes=budget['bytes'],
+            )
+            if budget['bytes'] is not None:
+                budget['bytes'] -= sum(os.path.getsize(target) for target in extracted)
+            files.extend(extracted)
+        elif is_data_file(path):
+            files.append(path)
+        else:
+            raise ValueError(f"Unsupported file type: {os.path.basename(path)}")
+        if max_files is not None and len(files) > max_files:
+            raise ValueError(f"More than {max_files} files given; at most {max_files} per batch")
+
+
+def _load_model(detector, model_path):
+    if model_path.endswith('.npy'):
+        detector.load_compact_model(model_path[:-len('.npy')])
+    else:
+        detector.load_model(model_path)
+    return model_path
+
+
+def _init_worker(config_file, model_path):
+    """Load the saved model once for every file this process scores."""
+    global _detector
+    from main import NetworkAnomalyDetector
+    detector = NetworkAnomalyDetector(config_file)
+    # Per-process monitors would overwrite each other's saved drift state
+    detector.config['drift'] = {**detector.config.get('drift', {}), 'enabled': False}
+    _load_model(detector, model_path)
+    _detector = detector
+
+
+def _score_file(path):
+    """Score one file with the worker's model; returns (stats, anomalies in original units)."""
+    import pandas as pd
+
+    detector = _detector
+    detector.stage_timings = {}
+    started = time.perf_counter()
+    stats = {'file': path}
+    try:
+        df = detector.load_and_preprocess_data(path, fit_scaler=False)
+        df = detector.score_with_saved_model(df)
+        is_anomaly = (df['anomaly'] == 'Anomaly').to_numpy()
+        scores = df['anomaly_score'].to_numpy()
+        anomalies = df[is_anomaly].copy()
+        for name in detector.features:
+            anomalies[name] = detector.raw_feature(anomalies, name)
+        anomalies.insert(0, 'source_file', os.path.basename(path))
+        times = pd.to_datetime(df['timestamp'], errors='coerce') if 'timestamp' in df else pd.Series(dtype='datetime64[ns]')
+        stats.update({
+            'rows': len(df),
+            'anomaly_count': int(is_anomaly.sum()),
+            'anomaly_percentage': round(float(is_anomaly.mean()) * 100, 2) if len(df) else 0,
+            'score_min': round(float(scores.min()), 6) if len(df) else None,
+            'score_mean': round(float(scores.mean()), 6) if len(df) else None,
+            'start': times.min().isoformat() if times.notna().any() else None,
+            'end': times.max().isoformat() if times.notna().any() else None,
+            'recommendations': detector.get_mitigation_recommendations(df),
+            'timings': detector.stage_timings,
+            'seconds': round(time.perf_counter() - started, 3),
+        })
+        return stats, anomalies
+    except Exception as e:
+        logging.error(f"Error analyzing {path} in batch: {str(e)}")
+        stats.update({'error': str(e), 'seconds': round(time.perf_counter() - started, 3)})
+        return stats, None
+
+
+def _ensure_model(files, config_file):
+    """Path of the saved model, fitting and saving one on the first file when none exists yet.
+
+    Prefers the joblib bundle: scikit-learn's compiled scorer is faster
+    than the compact forest on whole files. The compact export is used
+    only when no bundle exists.
+    """
+    from main import NetworkAnomalyDetector
+    detector = NetworkAnomalyDetector(config_file)
+    compact_path = detector.config.get('compact_model_path')
+    model_path = detector.config.get('model_path', os.path.join('models', 'isolation_forest.joblib'))
+    # Loading here fails early on a feature mismatch instead of in every worker
+    if os.path.exists(model_path):
+        return _load_model(detector, model_path), False
+    if compact_path and os.path.exists(f'{compact_path}.json'):
+        return _load_model(detector, f'{compact_path}.npy'), False
+    logging.warning(f"No saved model found; fitting one on {files[0]}")
+    df = detector.load_and_preprocess_data(files[0])
+    detector.detect_anomalies(df)
+    return detector.save_model(), True
+
+
+def run_batch(files, config_file='config.json', workers=0, batch_id=None, output_dir='outputs', store_anomalies=True):
+    """Score every file with one saved model and yield progress events, ending with the merged report.
+
+    Events are dicts: one 'started', one 'file' per finished file (in
+    completion order, with that file's statistics) and a final 'finished'
+    carrying the report. Files are scored in `workers` processes (0 = one
+    per CPU), started with the spawn method so that forking a threaded
+    caller such as the Flask app cannot deadlock them, and each loads the
+    model once; a file that fails is reported
+    with its error and the batch carries on. Anomalies of all files are
+    merged into one CSV, sorted by score, with a source_file column, and
+    appended to the anomaly store under `batch_id`.
+    """
+    from utils.metrics import registry as metrics
+
+    if not files:
+        raise ValueError("No data files to analyze")
+    from utils.results_store import new_analysis_id
+
+    batch_id = batch_id or new_analysis_id('batch_')
+    started = time.perf_counter()
+    model_path, fitted = _ensure_model(files, config_file)
+    workers = min(workers or os.cpu_count() or 1, len(files))
+    yield {'event': 'started', 'batch_id': batch_id, 'files': len(files), 'workers': workers, 'model_path': model_path, 'model_fitted': fitted}
+
+    results = {}
+    anomaly_frames = []
+
+    def finished(path, stats, anomalies):
+        results[path] = stats
+        if anomalies is not None and not anomalies.empty:
+            anomaly_frames.append(anomalies)
+        metrics.incr('batch_files_analyzed')
+        return {'event': 'file', 'done': len(results), 'total': len(files), **stats}
+
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context('spawn'), initializer=_init_worker, initargs=(config_file, model_path)) as pool:
+            futures = {pool.submit(_score_file, path): path for path in files}
+            for future in as_completed(futures):
+                yield finished(futures[future], *future.result())
+    else:
+        _init_worker(config_file, model_path)
+        for path in files:
+            yield finished(path, *_score_file(path))
+
+    report = _merge(batch_id, [results[path] for path in files], anomaly_frames, output_dir, config_file, store_anomalies)
+    report.update({
+        'model_path': model_path,
+        'model_fitted': fitted,
+        'workers': workers,
+        'seconds': round(time.perf_counter() - started, 3),
+    })
+    report['rows_per_second'] = round(report['totals']['rows'] / report['seconds'], 1) if report['seconds'] else None
+    report_file = os.path.join(output_dir, f'{batch_id}.json')
+    report['report_file'] = report_file
+    with open(report_file, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2, default=str)
+    logging.info(f"Batch {batch_id}: {report['totals']['files']} files, {report['totals']['rows']} rows, "
+                 f"{report['totals']['anomaly_count']} anomalies in {report['seconds']}s")
+    yield {'event': 'finished', 'report': report}
+
+
+def _merge(batch_id, file_stats, anomaly_frames, output_dir, config_file, store_anomalies):
+    """Combine per-file statistics and anomalies into the batch report."""
+    import pandas as pd
+    from main import NetworkAnomalyDetector
+
+    os.makedirs(output_dir, exist_ok=True)
+    scored = [stats for stats in file_stats if 'error' not in stats]
+    rows = sum(stats['rows'] for stats in scored)
+    anomaly_count = sum(stats['anomaly_count'] for stats in scored)
+    anomalies_file = None
+    stored = 0
+    if anomaly_frames:
+        anomalies = pd.concat(anomaly_frames, ignore_index=True).sort_values('anomaly_score', kind='stable')
+        anomalies_file = os.path.join(output_dir, f'anomalies_{batch_id}.csv')
+        anomalies.to_csv(anomalies_file, index=False)
+        store_config = NetworkAnomalyDetector.load_config(config_file).get('anomaly_store', {})
+        if store_anomalies and store_config.get('enabled', False):
+            from utils.anomaly_store import AnomalyStore
+            store = AnomalyStore(store_config.get('path', os.path.join('outputs', 'anomalies.db')))
+            for frame in anomaly_frames:
+                stored += store.append(frame, batch_id, source_file=frame['source_file'].iloc[0])
+    return {
+        'batch_id': batch_id,
+        'totals': {
+            'files': len(file_stats),
+            'files_failed': len(file_stats) - len(scored),
+            'rows': rows,
+            'anomaly_count': anomaly_count,
+            'anomaly_percentage': round(anomaly_count / rows * 100, 2) if rows else 0,
+            'score_min': min((stats['score_min'] for stats in scored if stats['score_min'] is not None), default=None),
+            'start': min((stats['start'] for stats in scored if stats['start']), default=None),
+            'end': max((stats['end'] for stats in scored if stats['end']), default=None),
+        },
+        'files': file_stats,
+        'anomalies_file': anomalies_file,
+        'anomalies_stored': stored,
+        'top_files': [
+            stats['file'] for stats in sorted(scored, key=lambda stats: -stats['anomaly_percentage'])[:5]
+        ],
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Score many CSV files, directories or zip/tar archives with one saved model.")
+    parser.add_argument('inputs', nargs='+', help="CSV files, rotation manifests, directories, glob patterns (e.g. 'uploads/*.csv') or archives")
+    parser.add_argument('--config', default='config.json', help='Config file (default config.json)')
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: config, 0 = one per CPU)')
+    parser.add_argument('--json', action='store_true', help='Print progress events as JSON lines instead of a table')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open(args.config, 'r', encoding='utf-8') as f:
+        options = json.load(f).get('batch', {})
+    from utils.results_store import new_analysis_id
+    batch_id = new_analysis_id('batch_')
+    files = expand_inputs(
+        args.inputs, os.path.join(options.get('extract_dir', os.path.join('uploads', 'batches')), batch_id),
+        max_files=options.get('max_files', 500), max_bytes=options.get('max_extract_mb', 1024) * 1024 * 1024,
+    )
+    events = run_batch(
+        files, args.config,
+        workers=args.workers if args.workers is not None else options.get('workers', 0),
+        batch_id=batch_id,
+        output_dir=options.get('output_dir', 'outputs'),
+    )
+    for event in events:
+        if args.json:
+            print(json.dumps(event, default=str), flush=True)
+        elif event['event'] == 'started':
+            print(f"Scoring {event['files']} files with {event['workers']} workers using {event['model_path']}")
+        elif event['event'] == 'file':
+            name = os.path.basename(event['file'])
+            if 'error' in event:
+                print(f"[{event['done']}/{event['total']}] {name}: ERROR {event['error']}", flush=True)
+            else:
+                print(f"[{event['done']}/{event['total']}] {name}: {event['rows']} rows, "
+                      f"{event['anomaly_count']} anomalies ({event['anomaly_percentage']}%) in {event['seconds']}s", flush=True)
+        else:
+            report = event['report']
+            totals = report['totals']
+            print(f"{totals['files']} files ({totals['files_failed']} failed), {totals['rows']} rows, "
+                  f"{totals['anomaly_count']} anomalies ({totals['anomaly_percentage']}%) in {report['seconds']}s "
+                  f"({report['rows_per_second']} rows/s)")
+            if report['anomalies_file']:
+                print(f"Merged anomalies written to {report['anomalies_file']}")
+            print(f"Report written to {report['report_file']}")
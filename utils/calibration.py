@@ -0,0 +1,218 @@
+import argparse
+import hashlib
+import itertools
+import json
+import logging
+import multiprocessing as mp
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime
+
+import numpy as np
+
+DEFAULT_GRID = {
+    'contamination': [0.05, 0.1, 0.15, 0.2],
+    'n_estimators': [50, 100, 200],
+    'max_samples': ['auto', 512],
+}
+# Label values that count as normal traffic; everything else is an anomaly
+NORMAL_LABELS = {'normal', 'benign', '0', 'false'}
+
+
+def _cache_key(data_path, config, label_column):
+    stat = os.stat(data_path)
+    parts = [
+        os.path.abspath(data_path), stat.st_size, stat.st_mtime_ns, config['features'],
+        config.get('feature_dtype', 'float32'), config.get('seasonal', {}).get('enabled', False),
+        label_column,
+    ]
+    return hashlib.sha1(json.dumps(parts).encode('utf-8')).hexdigest()[:16]
+
+
+def prepare_dataset(data_path, config_file='config.json', label_column='traffic_type', cache_dir=os.path.join('models', 'cache')):
+    """Preprocess a labeled file once and cache the scaled matrix and labels as .npy files.
+
+    Returns (matrix_path, labels_path). Labels are stored as strings with
+    every normal value mapped to 'normal', so per-type recall can be
+    reported for the rest. The cache is keyed on the file, the feature
+    settings and the label column, so a changed file, config or label
+    column is preprocessed again.
+    """
+    from main import NetworkAnomalyDetector
+
+    detector = NetworkAnomalyDetector(config_file)
+    key = _cache_key(data_path, detector.config, label_column)
+    matrix_path = os.path.join(cache_dir, f'calibration_{key}_X.npy')
+    labels_path = os.path.join(cache_dir, f'calibration_{key}_labels.npy')
+    if os.path.exists(matrix_path) and os.path.exists(labels_path):
+        logging.info(f"Using cached calibration matrix {matrix_path}")
+        return matrix_path, labels_path
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        seasonal = detector.config.get('seasonal', {})
+        if seasonal.get('enabled', False):
+            # Fit a baseline for this file only; the production baseline is left untouched
+            detector.config['seasonal'] = {**seasonal, 'path': os.path.join(cache_dir, f'calibration_{key}_seasonal.npz')}
+        df = detector.load_and_preprocess_data(data_path)
+        if label_column not in df.columns:
+            raise ValueError(f"Label column '{label_column}' not found in {data_path}")
+        labels = df[label_column].astype(str).str.strip()
+        lowered = labels.str.lower()
+        # Boolean/0-1 label columns become normal/anomaly
+        labels = labels.where(~lowered.isin(NORMAL_LABELS), 'normal').where(~lowered.isin({'1', 'true'}), 'anomaly')
+        np.save(matrix_path, detector.feature_matrix)
+        np.save(labels_path, labels.to_numpy(dtype=str))
+        logging.info(f"Cached {detector.feature_matrix.shape} calibration matrix in {matrix_path}")
+        return matrix_path, labels_path
+    except Exception as e:
+        logging.error(f"Error preparing calibration data from {data_path}: {str(e)}")
+        raise
+
+
+def _parse_max_samples(value):
+    if value == 'auto':
+        return value
+    number = float(value)
+    return int(number) if number > 1 else number
+
+
+def _evaluate_forest(task):
+    """Fit one forest and score it at every contamination (runs in a worker process)."""
+    from sklearn.ensemble import IsolationForest
+
+    matrix_path, labels_path, n_estimators, max_samples, contaminations, random_state = task
+    # Memory-mapped: every worker shares the cached matrix through the page cache
+    X = np.load(matrix_path, mmap_mode='r')
+    labels = np.load(labels_path)
+    truth = labels != 'normal'
+    model = IsolationForest(n_estimators=n_estimators, max_samples=max_samples, contamination='auto', random_state=random_state)
+    started = time.perf_counter()
+    model.fit(X)
+    fit_seconds = time.perf_counter() - started
+    started = time.perf_counter()
+    scores = model.score_samples(X)
+    score_seconds = time.perf_counter() - started
+
+    results = []
+    for contamination in contaminations:
+        # Same threshold rule as NetworkAnomalyDetector._set_threshold
+        predicted = scores < np.percentile(scores, 100.0 * contamination)
+        tp = int((predicted & truth).sum())
+        fp = int((predicted & ~truth).sum())
+        fn = int((~predicted & truth).sum())
+        precision = tp / (tp + fp) if tp + fp else 0.0
+        recall = tp / (tp + fn) if tp + fn else 0.0
+        results.append({
+            'contamination': contamination,
+            'n_estimators': n_estimators,
+            'max_samples': max_samples,
+            'precision': round(precision, 4),
+            'recall': round(recall, 4),
+            'f1': round(2 * precision * recall / (precision + recall), 4) if precision + recall else 0.0,
+            'flagged': int(predicted.sum()),
+            'recall_by_type': {
+                name: round(float(predicted[labels == name].mean()), 4)
+                for name in sorted(set(labels[truth].tolist()))
+            },
+            'fit_seconds': round(fit_seconds, 4),
+            'score_seconds': round(score_seconds, 4),
+            'score_us_per_row': round(score_seconds / len(X) * 1e6, 3),
+            'tree_nodes': int(sum(estimator.tree_.node_count for estimator in model.estimators_)),
+        })
+    return results
+
+
+def calibrate(data_path, config_file='config.json', grid=None, workers=0, label_column='traffic_type',
+              cache_dir=os.path.join('models', 'cache'), f1_tolerance=0.01):
+    """Evaluate a contamination/n_estimators/max_samples grid on a labeled file.
+
+    The file is preprocessed once (see prepare_dataset()); each
+    (n_estimators, max_samples) forest is fitted and scored once in a
+    worker process, and every contamination is evaluated on those scores,
+    since contamination only moves the threshold. Returns all settings
+    sorted by F1 with the best one and the cheapest to score within
+    `f1_tolerance` of it.
+    """
+    from main import NetworkAnomalyDetector
+
+    grid = {**DEFAULT_GRID, **(grid or {})}
+    random_state = NetworkAnomalyDetector.load_config(config_file).get('random_state', 42)
+    started = time.perf_counter()
+    matrix_path, labels_path = prepare_dataset(data_path, config_file, label_column, cache_dir)
+    prepare_seconds = time.perf_counter() - started
+
+    tasks = [
+        (matrix_path, labels_path, int(n_estimators), _parse_max_samples(max_samples), [float(c) for c in grid['contamination']], random_state)
+        for n_estimators, max_samples in itertools.product(grid['n_estimators'], grid['max_samples'])
+    ]
+    workers = min(workers or os.cpu_count() or 1, len(tasks))
+    started = time.perf_counter()
+    if workers > 1:
+        with ProcessPoolExecutor(max_workers=workers, mp_context=mp.get_context()) as pool:
+            batches = list(pool.map(_evaluate_forest, tasks))
+    else:
+        batches = [_evaluate_forest(task) for task in tasks]
+    grid_seconds = time.perf_counter() - started
+
+    results = sorted((row for batch in batches for row in batch), key=lambda row: (-row['f1'], row['score_seconds']))
+    best = results[0]
+    near_best = [row for row in results if row['f1'] >= best['f1'] - f1_tolerance]
+    cheapest = min(near_best, key=lambda row: row['score_seconds'])
+    rows = len(np.load(labels_path, mmap_mode='r'))
+    return {
+        'data_path': data_path,
+        'rows': rows,
+        'matrix_cache': matrix_path,
+        'workers': workers,
+        'forests': len(tasks),
+        'prepare_seconds': round(prepare_seconds, 3),
+        'grid_seconds': round(grid_seconds, 3),
+        'forest_seconds_total': round(sum(batch[0]['fit_seconds'] + batch[0]['score_seconds'] for batch in batches), 3),
+        'best': best,
+        'cheapest_near_best': cheapest,
+        'results': results,
+    }
+
+
+def _print_table(report):
+    print(f"{'contam':>7} {'trees':>6} {'samples':>8} {'prec':>6} {'recall':>6} {'f1':>6} {'fit_s':>7} {'score_s':>8} {'us/row':>7}")
+    for row in report['results']:
+        print(f"{row['contamination']:>7} {row['n_estimators']:>6} {str(row['max_samples']):>8} {row['precision']:>6.3f} {row['recall']:>6.3f} "
+              f"{row['f1']:>6.3f} {row['fit_seconds']:>7.3f} {row['score_seconds']:>8.3f} {row['score_us_per_row']:>7.2f}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Choose contamination, n_estimators and max_samples on a labeled dataset.")
+    parser.add_argument('data', help='Labeled CSV, e.g. from generate_sample_data.py (traffic_type column)')
+    parser.add_argument('--config', default='config.json', help='Config file (default config.json)')
+    parser.add_argument('--contamination', default=None, help='Comma-separated contamination values (default: config)')
+    parser.add_argument('--n-estimators', default=None, help='Comma-separated n_estimators values (default: config)')
+    parser.add_argument('--max-samples', default=None, help="Comma-separated max_samples values: 'auto', a row count or a fraction (default: config)")
+    parser.add_argument('--workers', type=int, default=None, help='Worker processes (default: config, 0 = one per CPU)')
+    parser.add_argument('--label-column', default=None, help='Ground-truth column (default: config, traffic_type)')
+    parser.add_argument('--output', default=None, help='Write the full report to this JSON file (default outputs/calibration_<timestamp>.json)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open(args.config, 'r', encoding='utf-8') as f:
+        options = json.load(f).get('calibration', {})
+    grid = dict(options.get('grid', {}))
+    for name, value in (('contamination', args.contamination), ('n_estimators', args.n_estimators), ('max_samples', args.max_samples)):
+        if value:
+            grid[name] = value.split(',')
+    report = calibrate(
+        args.data, args.config, grid=grid,
+        workers=args.workers if args.workers is not None else options.get('workers', 0),
+        label_column=args.label_column or options.get('label_column', 'traffic_type'),
+        cache_dir=options.get('cache_dir', os.path.join('models', 'cache')),
+        f1_tolerance=options.get('f1_tolerance', 0.01),
+    )
+    output = args.output or os.path.join('outputs', f"calibration_{datetime.now().strftime('%Y%m%d_%H%M%S')}.json")
+    os.makedirs(os.path.dirname(output) or '.', exist_ok=True)
+    with open(output, 'w', encoding='utf-8') as f:
+        json.dump(report, f, indent=2)
+    _print_table(report)
+    print(f"Best F1: {json.dumps({k: report['best'][k] for k in ('contamination', 'n_estimators', 'max_samples', 'f1')})}")
+    print(f"Cheapest within tolerance: {json.dumps({k: report['cheapest_near_best'][k] for k in ('contamination', 'n_estimators', 'max_samples', 'f1', 'score_us_per_row')})}")
+    print(f"Report written to {output}")
@@ -0,0 +1,413 @@
+import argparse
+import json
+import logging
+import os
+import queue
+import re
+import threading
+import time
+import uuid
+import weakref
+from datetime import datetime
+
+from capture_to_csv import UPLOAD_DIR, CaptureStats, capture_to_csv, check_number
+from utils.metrics import registry as metrics
+
+# Per-session limits; 0 disables a limit
+DEFAULT_LIMITS = {
+    'max_duration_seconds': 0,
+    'max_flows': 200000,
+    'max_output_mb': 1024,
+}
+# Limits that must be whole numbers; the others may be fractional
+INTEGER_LIMITS = {'max_flows'}
+
+
+class ScoringService:
+    """One saved model shared by every capture session.
+
+    Sessions submit flushed flow windows; a single worker thread scores
+    them with the saved model (the compact export when present, otherwise
+    the joblib bundle), so the model is loaded once and the detector is
+    never used from two threads. When the queue is full a batch is dropped
+    and counted rather than blocking the capture thread. Each batch's time
+    from submit() to scored (window flush to alert) is recorded as the
+    `capture_scoring_latency` timer and passed to the session. Each session
+    keeps one HostContext, so host features computed here (for rows that
+    arrive without them) carry state from batch to batch.
+    """
+
+    def __init__(self, config_file='config.json', queue_size=64, on_scored=None, on_drift=None, retry_seconds=30, store_anomalies=True):
+        self.config_file = config_file
+        self.store_anomalies = store_anomalies
+        self.on_scored = on_scored
+        # Called with (drift report, session) when the model's drift monitor recommends a retrain
+        self.on_drift = on_drift
+        self.retry_seconds = retry_seconds
+        self.detector = None
+        self.error = None
+        self.batches_scored = 0
+        self.batches_dropped = 0
+        self.windows_scored = 0
+        self._queue = queue.Queue(maxsize=queue_size)
+        self._thread = None
+        self._lock = threading.Lock()
+        self._last_attempt = None
+        # session -> HostContext (None when host features are disabled); dropped with the session
+        self._host_contexts = weakref.WeakKeyDictionary()
+
+    def submit(self, session, rows):
+        """Queue a batch of flow windows from `session`; returns False if it was dropped."""
+        self._ensure_started()
+        try:
+            self._queue.put_nowait((session, list(rows), time.monotonic()))
+            return True
+        except queue.Full:
+            with self._lock:
+                self.batches_dropped += 1
+            session.record_dropped()
+            return False
+
+    def _ensure_started(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='capture-scoring', daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            item = self._queue.get()
+            try:
+                if item is None:
+                    return
+                if item[0] == 'reload':
+                    # Handled on the worker thread so a batch never sees a half-replaced detector
+                    self.detector = None
+                    continue
+                self._score(*item)
+            finally:
+                self._queue.task_done()
+
+    def reload(self):
+        """Drop the loaded model; the next batch loads the newly saved one."""
+        self._last_attempt = None
+        if self._thread is not None:
+            self._queue.put(('reload', None))
+
+    def _load_detector(self):
+        if self.detector is not None:
+            return self.detector
+        now = time.monotonic()
+        if self._last_attempt is not None and now - self._last_attempt < self.retry_seconds:
+            return None
+        self._last_attempt = now
+        try:
+            from main import NetworkAnomalyDetector
+            detector = NetworkAnomalyDetector(self.config_file)
+            detector.load_saved_model()
+            self.detector = detector
+            self.error = None
+        except Exception as e:
+            logging.error(f"Error loading model for capture scoring: {str(e)}")
+            self.error = str(e)
+        return self.detector
+
+    def _score(self, session, rows, submitted):
+        detector = self._load_detector()
+        if detector is None:
+            session.record_dropped()
+            return
+        try:
+            import pandas as pd
+            if session not in self._host_contexts:
+                from utils.host_features import HostContext
+                self._host_contexts[session] = HostContext.from_config(detector.config)
+            df = detector.preprocess_frame(pd.DataFrame(rows), fit_scaler=False, host_context=self._host_contexts[session])
+            df = detector.score_with_saved_model(df)
+            anomalies = df[df['anomaly'] == 'Anomaly']
+            if self.store_anomalies and not anomalies.empty:
+                detector.source_file = os.path.basename(session.output_file)
+                detector._store_anomalies(anomalies, session.id)
+            if self.on_scored is not None:
+                self.on_scored(detector, df)
+            if self.on_drift is not None and detector.drift_report and detector.drift_report['retrain_recommended']:
+                self.on_drift(detector.drift_report, session)
+            latency = time.monotonic() - submitted
+            metrics.observe('capture_scoring_latency', latency)
+            session.record_scores(len(df), len(anomalies), float(df['anomaly_score'].min()), latency)
+            with self._lock:
+                self.batches_scored += 1
+                self.windows_scored += len(df)
+        except Exception as e:
+            logging.error(f"Error scoring capture session {session.id}: {str(e)}")
+            session.record_dropped(str(e))
+
+    def snapshot(self):
+        return {
+            'model_loaded': self.detector is not None,
+            'error': self.error,
+            'queued_batches': self._queue.qsize(),
+            'batches_scored': self.batches_scored,
+            'batches_dropped': self.batches_dropped,
+            'windows_scored': self.windows_scored,
+        }
+
+    def close(self, timeout=10.0):
+        """Score what is queued, then stop the worker thread."""
+        if self._thread is not None and self._thread.is_alive():
+            self._queue.put(None)
+            self._thread.join(timeout)
+
+
+class CaptureSession:
+    """One long-lived capture of a single interface with its own aggregator and output file."""
+
+    def __init__(self, session_id, interface, output_file, options, limits):
+        self.id = session_id
+        self.interface = interface
+        self.output_file = output_file
+        # Set when output is rotated into segments listed in a manifest
+        self.manifest = None
+        self.options = options
+        self.limits = limits
+        self.stats = CaptureStats()
+        self.stop_event = threading.Event()
+        self.thread = None
+        self.state = 'starting'
+        self.error = None
+        self.created_at = datetime.now().isoformat()
+        self.finished_at = None
+        self._lock = threading.Lock()
+        self.scoring = {
+            'windows_scored': 0,
+            'anomalies': 0,
+            'min_score': None,
+            'batches_dropped': 0,
+            'last_latency_ms': None,
+            'max_latency_ms': None,
+            'last_error': None,
+        }
+
+    def stop(self, reason='stopped'):
+        if self.stats.stop_reason is None:
+            self.stats.stop_reason = reason
+        self.stop_event.set()
+
+    def record_scores(self, windows, anomalies, min_score, latency=None):
+        """latency: seconds from the batch's flush to its scores (including queueing)."""
+        with self._lock:
+            self.scoring['windows_scored'] += windows
+            self.scoring['anomalies'] += anomalies
+            if self.scoring['min_score'] is None or min_score < self.scoring['min_score']:
+                self.scoring['min_score'] = round(min_score, 6)
+            if latency is not None:
+                latency_ms = round(latency * 1000, 3)
+                self.scoring['last_latency_ms'] = latency_ms
+                if self.scoring['max_latency_ms'] is None or latency_ms > self.scoring['max_latency_ms']:
+                    self.scoring['max_latency_ms'] = latency_ms
+
+    def record_dropped(self, error=None):
+        with self._lock:
+            self.scoring['batches_dropped'] += 1
+            if error:
+                self.scoring['last_error'] = error
+
+    def snapshot(self):
+        with self._lock:
+            scoring = dict(self.scoring)
+        return {
+            'id': self.id,
+            'interface': self.interface,
+            'state': self.state,
+            'output_file': self.output_file,
+            'manifest': self.manifest,
+            'options': self.options,
+            'limits': self.limits,
+            'created_at': self.created_at,
+            'finished_at': self.finished_at,
+            'error': self.error,
+            'capture': self.stats.snapshot(),
+            'scoring': scoring,
+        }
+
+
+class CaptureManager:
+    """Runs captures on several interfaces at once as start/stop/status sessions.
+
+    Each session has its own thread, aggregator, output CSV and limits
+    (duration, active flows, output size); all sessions share one
+    ScoringService. Settings come from the `capture_manager` config section.
+    """
+
+    def __init__(self, config=None, config_file='config.json', on_scored=None, on_drift=None):
+        options = (config or {}).get('capture_manager', {})
+        self.config = config or {}
+        self.max_sessions = options.get('max_sessions', 4)
+        self.output_dir = options.get('output_dir', UPLOAD_DIR)
+        self.default_limits = {**DEFAULT_LIMITS, **options.get('limits', {})}
+        # Output segment rotation shared by all sessions (see utils/rotation.py)
+        self.rotation = options.get('rotation', {})
+        self.scoring = None
+        if options.get('score', True):
+            self.scoring = ScoringService(
+                config_file, queue_size=options.get('scoring_queue_size', 64), on_scored=on_scored, on_drift=on_drift,
+            )
+        self.sessions = {}
+        self._lock = threading.Lock()
+
+    def start(self, interface, bpf_filter='tcp or udp', tshark_path=None, sketches=False, workers=1, host_features=None, limits=None):
+        """Start capturing `interface` in the background; returns the new session."""
+        if not interface:
+            raise ValueError("Interface is required")
+        if limits is not None and not isinstance(limits, dict):
+            raise ValueError("limits must be an object")
+        unknown = set(limits or {}) - set(DEFAULT_LIMITS)
+        if unknown:
+            raise ValueError(f"Unknown limits: {sorted(unknown)}")
+        # Checked before the session thread starts, so bad request values fail the request
+        limits = {
+            name: check_number(name, value, integer=name in INTEGER_LIMITS)
+            for name, value in {**self.default_limits, **(limits or {})}.items()
+        }
+        workers = check_number('workers', workers, minimum=1)
+        with self._lock:
+            running = [s for s in self.sessions.values() if s.state in ('starting', 'running')]
+            if len(running) >= self.max_sessions:
+                raise ValueError(f"Maximum of {self.max_sessions} concurrent capture sessions reached")
+            if any(s.interface == interface for s in running):
+                raise ValueError(f"Interface {interface} is already being captured")
+            session_id = uuid.uuid4().hex[:12]
+            safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', interface)
+            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+            output_file = os.path.join(self.output_dir, f'network_traffic_{safe_name}_{timestamp}_{session_id}.csv')
+            options = {
+                'bpf_filter': bpf_filter,
+                'tshark_path': tshark_path,
+                'sketches': bool(sketches),
+                'workers': workers,
+                'host_features': host_features,
+            }
+            session = CaptureSession(session_id, interface, output_file, options, limits)
+            session.thread = threading.Thread(target=self._run, args=(session,), name=f'capture-{safe_name}', daemon=True)
+            if self.rotation.get('max_mb') or self.rotation.get('interval_seconds'):
+                from utils.rotation import manifest_path_for
+                session.manifest = manifest_path_for(output_file)
+            self.sessions[session_id] = session
+        session.thread.start()
+        logging.info(f"Capture session {session_id} started on {interface} -> {output_file}")
+        return session
+
+    def _host_context(self, session):
+        from utils.host_features import HostContext
+        enabled = session.options['host_features']
+        if enabled is None:
+            return HostContext.from_config(self.config)
+        if not enabled:
+            return None
+        options = {k: v for k, v in self.config.get('host_features', {}).items() if k != 'enabled'}
+        return HostContext(**options)
+
+    def _run(self, session):
+        limits = session.limits
+        timer = None
+        if limits['max_duration_seconds']:
+            timer = threading.Timer(limits['max_duration_seconds'], session.stop, args=('duration_limit',))
+            timer.daemon = True
+            timer.start()
+        on_rows = None
+        if self.scoring is not None:
+            on_rows = lambda rows: self.scoring.submit(session, rows)
+        session.state = 'running'
+        try:
+            capture_to_csv(
+                interface=session.interface,
+                duration=0,
+                bpf_filter=session.options['bpf_filter'],
+                output_file=session.output_file,
+                max_packets=0,
+                tshark_path=session.options['tshark_path'],
+                stats=session.stats,
+                sketches=session.options['sketches'],
+                workers=session.options['workers'],
+                host_context=self._host_context(session),
+                stop_event=session.stop_event,
+                max_flows=limits['max_flows'],
+                max_output_bytes=int(limits['max_output_mb'] * 1024 * 1024),
+                on_rows=on_rows,
+                rotate_bytes=int(self.rotation.get('max_mb', 0) * 1024 * 1024),
+                rotate_seconds=self.rotation.get('interval_seconds', 0),
+                compress=self.rotation.get('compress', True),
+            )
+            session.state = 'stopped'
+        except Exception as e:
+            logging.error(f"Error in capture session {session.id} on {session.interface}: {str(e)}")
+            session.error = str(e)
+            session.state = 'failed'
+        finally:
+            if timer is not None:
+                timer.cancel()
+            session.finished_at = datetime.now().isoformat()
+            logging.info(f"Capture session {session.id} on {session.interface} ended ({session.state})")
+
+    def get(self, session_id):
+        session = self.sessions.get(session_id)
+        if session is None:
+            raise KeyError(f"Unknown capture session: {session_id}")
+        return session
+
+    def stop(self, session_id, wait=5.0):
+        """Ask a session to stop and wait up to `wait` seconds for its final flush."""
+        session = self.get(session_id)
+        session.stop()
+        if session.thread is not None:
+            session.thread.join(wait)
+        return session.snapshot()
+
+    def stop_all(self, wait=5.0):
+        sessions = list(self.sessions.values())
+        for session in sessions:
+            session.stop()
+        for session in sessions:
+            if session.thread is not None:
+                session.thread.join(wait)
+        if self.scoring is not None:
+            self.scoring.close()
+        return [session.snapshot() for session in sessions]
+
+    def status(self):
+        return {
+            'sessions': [session.snapshot() for session in self.sessions.values()],
+            'scoring': self.scoring.snapshot() if self.scoring is not None else None,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Capture several interfaces concurrently, scoring windows with the saved model.")
+    parser.add_argument('--interface', action='append', required=True, help='Interface to capture; repeat for several NICs')
+    parser.add_argument('--filter', dest='bpf', default='tcp or udp', help='BPF filter for every session (default "tcp or udp")')
+    parser.add_argument('--tshark-path', dest='tshark_path', default=None, help='Optional full path to tshark executable')
+    parser.add_argument('--config', default='config.json', help='Config file (default config.json)')
+    parser.add_argument('--max-duration', type=int, default=None, help='Stop each session after N seconds (default: config)')
+    parser.add_argument('--no-score', action='store_true', help='Only write CSVs, do not score windows')
+    parser.add_argument('--status-interval', type=float, default=30.0, help='Seconds between status lines (default 30)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    if args.no_score:
+        config.setdefault('capture_manager', {})['score'] = False
+    manager = CaptureManager(config, config_file=args.config)
+    limits = {} if args.max_duration is None else {'max_duration_seconds': args.max_duration}
+    for name in args.interface:
+        manager.start(name, bpf_filter=args.bpf, tshark_path=args.tshark_path, limits=limits)
+    next_status = time.monotonic() + args.status_interval
+    try:
+        while any(s.thread.is_alive() for s in manager.sessions.values()):
+            time.sleep(0.5)
+            if time.monotonic() >= next_status:
+                next_status += args.status_interval
+                print(json.dumps({s.interface: s.stats.snapshot() for s in manager.sessions.values()}))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(manager.stop_all(), indent=2))
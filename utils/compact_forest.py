@@ -0,0 +1,216 @@
+import argparse
+import json
+import os
+import time
+
+import numpy as np
+
+FORMAT_VERSION = 1
+
+NODE_DTYPE = np.dtype([
+    ('feature', 'i4'),
+    ('threshold', 'f8'),
+    ('left', 'i4'),
+    ('right', 'i4'),
+    ('missing_left', 'u1'),
+    # Leaf contribution to the path length: depth + c(n_node_samples) - 1
+    ('value', 'f8'),
+])
+
+
+def _node_depths(children_left, children_right):
+    """Depth of every node with the root at 1, as Tree.compute_node_depths() (scikit-learn >= 1.3) returns."""
+    depths = np.zeros(len(children_left), dtype=np.float64)
+    frontier, depth = np.array([0]), 1
+    while frontier.size:
+        depths[frontier] = depth
+        internal = frontier[children_left[frontier] != -1]
+        frontier = np.concatenate([children_left[internal], children_right[internal]])
+        depth += 1
+    return depths
+
+
+def _average_path_length(n_samples):
+    """c(n): average path length of an unsuccessful BST search (same formula as scikit-learn)."""
+    n_samples = np.asarray(n_samples, dtype=np.float64)
+    result = np.zeros(n_samples.shape)
+    result[n_samples == 2] = 1.0
+    many = n_samples > 2
+    result[many] = (
+        2.0 * (np.log(n_samples[many] - 1.0) + np.euler_gamma)
+        - 2.0 * (n_samples[many] - 1.0) / n_samples[many]
+    )
+    return result
+
+
+class ArrayScaler:
+    """Stand-in for a fitted StandardScaler restored from plain arrays (transform in place)."""
+
+    def __init__(self, mean, scale):
+        self.mean_ = np.asarray(mean, dtype=np.float64)
+        self.scale_ = np.asarray(scale, dtype=np.float64)
+
+    def transform(self, X):
+        X -= self.mean_.astype(X.dtype, copy=False)
+        X /= self.scale_.astype(X.dtype, copy=False)
+        return X
+
+
+class CompactForest:
+    """A trained IsolationForest flattened into one contiguous node array.
+
+    All trees are evaluated together, one level at a time, with NumPy
+    gathers; leaves point to themselves so every tree can take the same
+    number of steps. score_samples() matches IsolationForest.score_samples
+    exactly. The node array is saved as a plain .npy and memory-mapped on
+    load, next to a small JSON file of metadata.
+    """
+
+    def __init__(self, nodes, roots, levels, n_features, max_samples, metadata=None):
+        self.nodes = nodes
+        self.roots = np.asarray(roots, dtype=np.int64)
+        self.levels = int(levels)
+        self.n_features = int(n_features)
+        self.max_samples = int(max_samples)
+        self.metadata = metadata or {}
+        self.denominator = len(self.roots) * float(_average_path_length([self.max_samples])[0])
+        # Contiguous per-field copies for fast gathers (the node array itself may be memory-mapped)
+        self._feature = np.ascontiguousarray(nodes['feature'], dtype=np.intp)
+        self._threshold = np.ascontiguousarray(nodes['threshold'])
+        self._children = np.ascontiguousarray(np.stack([nodes['right'], nodes['left']], axis=1), dtype=np.intp)
+        self._missing_left = np.ascontiguousarray(nodes['missing_left'], dtype=bool)
+        self._value = np.ascontiguousarray(nodes['value'])
+        self.has_missing = bool(self._missing_left.any())
+
+    @classmethod
+    def from_sklearn(cls, model, metadata=None):
+        """Flatten a fitted sklearn IsolationForest."""
+        blocks, roots, levels, offset = [], [], 0, 0
+        for estimator, features in zip(model.estimators_, model.estimators_features_):
+            tree = estimator.tree_
+            n = tree.node_count
+            block = np.zeros(n, dtype=NODE_DTYPE)
+            leaf = tree.children_left == -1
+            index = np.arange(n) + offset
+            block['feature'] = np.where(leaf, 0, np.asarray(features)[np.maximum(tree.feature, 0)])
+            block['threshold'] = np.where(leaf, np.inf, tree.threshold)
+            block['left'] = np.where(leaf, index, tree.children_left + offset)
+            block['right'] = np.where(leaf, index, tree.children_right + offset)
+            missing_left = getattr(tree, 'missing_go_to_left', None)
+            if missing_left is not None:
+                block['missing_left'] = np.where(leaf, 0, missing_left)
+            depths = _node_depths(tree.children_left, tree.children_right)
+            block['value'] = depths + _average_path_length(tree.n_node_samples) - 1.0
+            blocks.append(block)
+            roots.append(offset)
+            levels = max(levels, int(depths.max()))
+            offset += n
+        return cls(np.concatenate(blocks), roots, levels, model.n_features_in_, model._max_samples, metadata)
+
+    def score_samples(self, X, chunk_rows=16384):
+        """Same values as IsolationForest.score_samples (lower is more abnormal)."""
+        X = np.asarray(X, dtype=np.float32)
+        if X.ndim != 2 or X.shape[1] != self.n_features:
+            raise ValueError(f"Expected {self.n_features} features, got shape {X.shape}")
+        scores = np.empty(len(X))
+        for start in range(0, len(X), chunk_rows):
+            depths = self._depths(X[start:start + chunk_rows])
+            scores[start:start + chunk_rows] = -(2 ** (-depths / self.denominator))
+        return scores
+
+    def _depths(self, X):
+        flat = np.ascontiguousarray(X).ravel()
+        row_offsets = (np.arange(len(X)) * self.n_features)[None, :]
+        current = np.repeat(self.roots[:, None], len(X), axis=1)
+        for _ in range(self.levels):
+            values = flat[row_offsets + self._feature[current]]
+            go_left = values <= self._threshold[current]
+            if self.has_missing:
+                go_left |= np.isnan(values) & self._missing_left[current]
+            # children[:, 1] is the left child, children[:, 0] the right one
+            current = self._children[current, go_left.view(np.uint8)]
+        leaf_values = self._value[current]
+        # Accumulate tree by tree, in the same order as scikit-learn
+        depths = np.zeros(len(X))
+        for tree_values in leaf_values:
+            depths += tree_values
+        return depths
+
+    def save(self, path):
+        """Write `<path>.npy` (nodes) and `<path>.json` (metadata); returns the .npy path."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        np.save(f'{path}.npy', np.ascontiguousarray(self.nodes))
+        meta = {
+            'format_version': FORMAT_VERSION,
+            'roots': self.roots.tolist(),
+            'levels': self.levels,
+            'n_features': self.n_features,
+            'max_samples': self.max_samples,
+            **self.metadata,
+        }
+        with open(f'{path}.json', 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        return f'{path}.npy'
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        """Load a forest written by save(); the node array is memory-mapped by default."""
+        with open(f'{path}.json', 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        if meta.get('format_version') != FORMAT_VERSION:
+            raise ValueError(f"Unsupported compact model format: {meta.get('format_version')}")
+        nodes = np.load(f'{path}.npy', mmap_mode='r' if mmap else None)
+        metadata = {k: v for k, v in meta.items() if k not in {'format_version', 'roots', 'levels', 'n_features', 'max_samples'}}
+        return cls(nodes, meta['roots'], meta['levels'], meta['n_features'], meta['max_samples'], metadata)
+
+
+def benchmark(bundle_path, output=None, rows=10000, repeats=20, seed=0):
+    """Export a saved joblib model bundle and compare it with sklearn on random batches."""
+    import joblib
+
+    bundle = joblib.load(bundle_path)
+    model = bundle['model']
+    forest = CompactForest.from_sklearn(model)
+    output = output or os.path.splitext(bundle_path)[0] + '_compact'
+    forest.save(output)
+    started = time.perf_counter()
+    forest = CompactForest.load(output)
+    load_seconds = time.perf_counter() - started
+
+    rng = np.random.default_rng(seed)
+    X = rng.normal(size=(rows, forest.n_features)).astype(np.float32)
+    report = {
+        'joblib_bytes': os.path.getsize(bundle_path),
+        'compact_bytes': os.path.getsize(f'{output}.npy') + os.path.getsize(f'{output}.json'),
+        'compact_load_ms': round(load_seconds * 1000, 3),
+        'max_abs_diff': float(np.max(np.abs(forest.score_samples(X) - model.score_samples(X)))),
+        'batches': [],
+    }
+    for size in [1, 10, 100, 1000, rows]:
+        batch = X[:size]
+        timings = {}
+        for name, scorer in (('sklearn', model.score_samples), ('compact', forest.score_samples)):
+            n = repeats if size < rows else max(1, repeats // 10)
+            started = time.perf_counter()
+            for _ in range(n):
+                scorer(batch)
+            timings[name] = (time.perf_counter() - started) / n
+        report['batches'].append({
+            'rows': size,
+            'sklearn_ms': round(timings['sklearn'] * 1000, 3),
+            'compact_ms': round(timings['compact'] * 1000, 3),
+            'speedup': round(timings['sklearn'] / timings['compact'], 1),
+        })
+    return report
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Export a saved IsolationForest to the compact array format and check score parity.")
+    parser.add_argument('bundle', help='Model bundle written by NetworkAnomalyDetector.save_model()')
+    parser.add_argument('--output', default=None, help='Output path prefix (default: <bundle>_compact)')
+    parser.add_argument('--rows', type=int, default=10000, help='Rows in the largest benchmark batch (default 10000)')
+    args = parser.parse_args()
+
+    print(json.dumps(benchmark(args.bundle, args.output, args.rows), indent=2))
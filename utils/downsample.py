@@ -0,0 +1,59 @@
+import numpy as np
+
+METHODS = ('lttb', 'minmax')
+
+
+def lttb(x, y, points):
+    """Indices of the points kept by Largest-Triangle-Three-Buckets.
+
+    The first and last points are always kept. The rest are split into
+    `points - 2` buckets; from each, the point forming the largest
+    triangle with the previously kept point and the next bucket's average
+    is chosen, which keeps peaks and the overall shape of the line.
+    """
+    x = np.asarray(x, dtype=np.float64)
+    y = np.asarray(y, dtype=np.float64)
+    n = len(x)
+    if points >= n or n <= 2:
+        return np.arange(n)
+    if points < 3:
+        return np.array([0, n - 1])[:max(points, 1)]
+    edges = np.floor(np.linspace(1, n - 1, points - 1)).astype(np.int64)
+    kept = np.empty(points, dtype=np.int64)
+    kept[0], kept[-1] = 0, n - 1
+    previous = 0
+    for i in range(points - 2):
+        lo, hi = edges[i], edges[i + 1]
+        next_lo, next_hi = (edges[i + 1], edges[i + 2]) if i + 2 < len(edges) else (n - 1, n)
+        avg_x = x[next_lo:next_hi].mean()
+        avg_y = y[next_lo:next_hi].mean()
+        area = np.abs((x[previous] - avg_x) * (y[lo:hi] - y[previous]) - (x[previous] - x[lo:hi]) * (avg_y - y[previous]))
+        previous = lo + int(np.argmax(area))
+        kept[i + 1] = previous
+    return kept
+
+
+def minmax(x, y, points):
+    """Indices of each bucket's minimum and maximum (about `points` in total), in order.
+
+    Keeps every extreme value, so spikes and dips survive downsampling.
+    """
+    y = np.asarray(y, dtype=np.float64)
+    n = len(y)
+    if points >= n or n <= 2:
+        return np.arange(n)
+    buckets = max(points // 2, 1)
+    edges = np.linspace(0, n, buckets + 1).astype(np.int64)
+    starts = edges[:-1]
+    lows = np.array([lo + int(np.argmin(y[lo:hi])) for lo, hi in zip(starts, edges[1:])])
+    highs = np.array([lo + int(np.argmax(y[lo:hi])) for lo, hi in zip(starts, edges[1:])])
+    return np.unique(np.concatenate([lows, highs]))
+
+
+def downsample(x, y, points, method='lttb'):
+    """Indices of at most about `points` points of (x, y) chosen with `method` ('lttb' or 'minmax')."""
+    if method == 'lttb':
+        return lttb(x, y, points)
+    if method == 'minmax':
+        return minmax(x, y, points)
+    raise ValueError(f"Unsupported method '{method}'. Use one of: {list(METHODS)}")
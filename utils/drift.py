@@ -0,0 +1,341 @@
+import atexit
+import json
+import logging
+import os
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+
+# Anomaly scores (score_samples) lie in [-1, 0]
+SCORE_EDGES = np.linspace(-1.0, 0.0, 51)[1:-1]
+# Bin probability floor so empty bins do not make PSI infinite
+_EPSILON = 1e-4
+
+# One monitor per (state file, features) in this process (see DriftMonitor.shared)
+_shared = {}
+_shared_lock = threading.Lock()
+
+
+def psi(reference_counts, current_counts):
+    """Population stability index between two histograms over the same bins."""
+    ref = np.asarray(reference_counts, dtype=np.float64)
+    cur = np.asarray(current_counts, dtype=np.float64)
+    if ref.sum() == 0 or cur.sum() == 0:
+        return 0.0
+    p = np.maximum(ref / ref.sum(), _EPSILON)
+    q = np.maximum(cur / cur.sum(), _EPSILON)
+    return float(np.sum((q - p) * np.log(q / p)))
+
+
+class _Histogram:
+    """Counts over fixed bin edges, plus count/mean/M2; merging two is adding counts."""
+
+    def __init__(self, edges):
+        self.edges = np.asarray(edges, dtype=np.float64)
+        self.counts = np.zeros(len(self.edges) + 1, dtype=np.float64)
+        self.n = 0.0
+        self.mean = 0.0
+        self.m2 = 0.0
+
+    def add(self, values):
+        values = np.asarray(values, dtype=np.float64)
+        values = values[np.isfinite(values)]
+        if len(values) == 0:
+            return
+        self.counts += np.bincount(np.searchsorted(self.edges, values, side='right'), minlength=len(self.counts))
+        # Chan et al. merge of the batch mean/M2
+        n_b = float(len(values))
+        mean_b = float(values.mean())
+        m2_b = float(((values - mean_b) ** 2).sum())
+        total = self.n + n_b
+        delta = mean_b - self.mean
+        self.mean += delta * n_b / total
+        self.m2 += m2_b + delta ** 2 * self.n * n_b / total
+        self.n = total
+
+    def decay(self, factor):
+        self.counts *= factor
+        self.n *= factor
+        self.m2 *= factor
+
+    @property
+    def std(self):
+        return float(np.sqrt(self.m2 / self.n)) if self.n else 0.0
+
+    def to_dict(self):
+        return {'edges': self.edges.tolist(), 'counts': self.counts.tolist(), 'n': self.n, 'mean': self.mean, 'm2': self.m2}
+
+    @classmethod
+    def from_dict(cls, data):
+        hist = cls(data['edges'])
+        hist.counts = np.asarray(data['counts'], dtype=np.float64)
+        hist.n, hist.mean, hist.m2 = data['n'], data['mean'], data['m2']
+        return hist
+
+
+class DriftMonitor:
+    """Compares live feature and score distributions with the training snapshot.
+
+    fit_reference() bins each raw feature at the training data's quantiles
+    and bins scores on a fixed [-1, 0] grid. update() folds each scored
+    batch into the current histograms, which are halved whenever they hold
+    more than `window_rows` rows, so they follow recent traffic. report()
+    computes PSI per feature and for the scores, plus each feature's mean
+    shift in training standard deviations. A retrain is recommended once
+    `min_rows` rows have been seen and a PSI is above `psi_threshold`.
+
+    Detectors in one process share a monitor (see shared()); callers hold
+    `lock` around update() and report().
+    """
+
+    def __init__(self, features, bins=20, psi_threshold=0.2, min_rows=500, window_rows=20000):
+        self.features = list(features)
+        self.bins = bins
+        self.psi_threshold = psi_threshold
+        self.min_rows = min_rows
+        self.window_rows = window_rows
+        self.reference = None
+        self.current = None
+        self.fitted_at = None
+        self.rows_since_fit = 0
+        self.lock = threading.RLock()
+        self.path = None
+        # Modification time of the state file when this monitor last read or wrote it
+        self._mtime = None
+        self._dirty = False
+        self._last_saved = time.monotonic()
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `drift` config section; None when disabled."""
+        options = config.get('drift', {})
+        if not options.get('enabled', False):
+            return None
+        return cls.load(
+            options.get('path', os.path.join('models', 'drift_state.json')),
+            config['features'],
+            bins=options.get('bins', 20),
+            psi_threshold=options.get('psi_threshold', 0.2),
+            min_rows=options.get('min_rows', 500),
+            window_rows=options.get('window_rows', 20000),
+        )
+
+    @classmethod
+    def shared(cls, config):
+        """Process-wide monitor for the `drift` config section; None when disabled.
+
+        Loaded once and saved at exit, so concurrent detectors update the
+        same histograms instead of each rewriting the state file.
+        """
+        options = config.get('drift', {})
+        if not options.get('enabled', False):
+            return None
+        key = (os.path.abspath(options.get('path', os.path.join('models', 'drift_state.json'))), tuple(config['features']))
+        with _shared_lock:
+            if key not in _shared:
+                monitor = cls.from_config(config)
+                atexit.register(monitor.maybe_save, None, 0)
+                _shared[key] = monitor
+            return _shared[key]
+
+    def fit_reference(self, X, scores):
+        """Snapshot the training distribution of raw features X and their scores."""
+        X = np.asarray(X, dtype=np.float64)
+        quantiles = np.linspace(0.0, 1.0, self.bins + 1)[1:-1]
+        reference = {}
+        for j, name in enumerate(self.features):
+            column = X[:, j][np.isfinite(X[:, j])]
+            edges = np.unique(np.quantile(column, quantiles)) if len(column) else np.array([])
+            reference[name] = _Histogram(edges)
+            reference[name].add(column)
+        reference['anomaly_score'] = _Histogram(SCORE_EDGES)
+        reference['anomaly_score'].add(scores)
+        self.reference = reference
+        self.current = {name: _Histogram(hist.edges) for name, hist in reference.items()}
+        self.fitted_at = datetime.now().isoformat()
+        self.rows_since_fit = 0
+        self._dirty = True
+        return self
+
+    def update(self, X, scores=None):
+        """Fold a batch of raw features, and optionally its scores, into the current histograms."""
+        if self.reference is None:
+            return self
+        X = np.asarray(X, dtype=np.float64)
+        if self.current[self.features[0]].n + len(X) > self.window_rows:
+            for hist in self.current.values():
+                hist.decay(0.5)
+        for j, name in enumerate(self.features):
+            self.current[name].add(X[:, j])
+        if scores is not None:
+            self.current['anomaly_score'].add(scores)
+        self.rows_since_fit += len(X)
+        self._dirty = True
+        return self
+
+    def report(self):
+        """Drift metrics per feature and for scores, and whether a retrain is recommended."""
+        if self.reference is None:
+            return {'fitted': False, 'retrain_recommended': False}
+        columns = {}
+        for name, ref in self.reference.items():
+            cur = self.current[name]
+            value = psi(ref.counts, cur.counts)
+            columns[name] = {
+                'psi': round(value, 6),
+                'mean_shift': round(abs(cur.mean - ref.mean) / ref.std, 6) if ref.std and cur.n else 0.0,
+                'reference_mean': ref.mean,
+                'current_mean': cur.mean if cur.n else None,
+                'drifted': value > self.psi_threshold,
+            }
+        drifted = sorted(name for name, column in columns.items() if column['drifted'])
+        return {
+            'fitted': True,
+            'fitted_at': self.fitted_at,
+            'rows_since_fit': self.rows_since_fit,
+            'psi_threshold': self.psi_threshold,
+            'columns': columns,
+            'drifted': drifted,
+            'retrain_recommended': bool(drifted) and self.rows_since_fit >= self.min_rows,
+        }
+
+    def maybe_save(self, path=None, interval_seconds=30):
+        """save() if there are unsaved updates and the last save is `interval_seconds` old."""
+        if not self._dirty or time.monotonic() - self._last_saved < interval_seconds:
+            return None
+        return self.save(path)
+
+    def save(self, path=None, new_reference=False):
+        """Write the reference and current histograms to JSON (atomically).
+
+        Unless `new_reference` is set, a file changed by another process
+        since this monitor last read or wrote it (e.g. a retrain run from
+        the command line) is not overwritten; its snapshot is loaded instead.
+        """
+        path = path or self.path
+        if path is None:
+            return None
+        with self.lock:
+            return self._save(path, new_reference)
+
+    def _mtime_of(self, path):
+        try:
+            return os.stat(path).st_mtime_ns
+        except FileNotFoundError:
+            return None
+
+    def _save(self, path, new_reference):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        on_disk = self._mtime_of(path)
+        if not new_reference and on_disk is not None and on_disk != self._mtime:
+            logging.info(f"Drift snapshot in {path} was replaced; reloading it instead of overwriting")
+            replaced = DriftMonitor.load(path, self.features)
+            if replaced.reference is not None:
+                self.reference, self.current = replaced.reference, replaced.current
+                self.fitted_at, self.rows_since_fit = replaced.fitted_at, replaced.rows_since_fit
+            self._mtime = on_disk
+            self._dirty = False
+            self._last_saved = time.monotonic()
+            return path
+        data = {
+            'features': self.features,
+            'fitted_at': self.fitted_at,
+            'rows_since_fit': self.rows_since_fit,
+            'reference': {k: v.to_dict() for k, v in (self.reference or {}).items()},
+            'current': {k: v.to_dict() for k, v in (self.current or {}).items()},
+        }
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        self.path = path
+        self._mtime = self._mtime_of(path)
+        self._dirty = False
+        self._last_saved = time.monotonic()
+        return path
+
+    @classmethod
+    def load(cls, path, features, **options):
+        """Load state saved with save(); returns an unfitted monitor if missing or incompatible."""
+        monitor = cls(features, **options)
+        monitor.path = path
+        if not path or not os.path.exists(path):
+            return monitor
+        monitor._mtime = monitor._mtime_of(path)
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            if data['features'] != monitor.features or not data['reference']:
+                return monitor
+            monitor.reference = {k: _Histogram.from_dict(v) for k, v in data['reference'].items()}
+            monitor.current = {k: _Histogram.from_dict(v) for k, v in data['current'].items()}
+            monitor.fitted_at = data['fitted_at']
+            monitor.rows_since_fit = data['rows_since_fit']
+        except Exception as e:
+            logging.error(f"Error loading drift state from {path}: {str(e)}")
+        return monitor
+
+
+class RetrainScheduler:
+    """Runs retraining jobs in a background thread, one at a time.
+
+    request() starts `train_fn(data_path)` unless a job is running or the
+    last one started less than `cooldown_seconds` ago; `on_complete` is
+    called with the job's result (e.g. to reload models that are in use).
+    """
+
+    def __init__(self, train_fn, cooldown_seconds=3600, on_complete=None):
+        self.train_fn = train_fn
+        self.cooldown_seconds = cooldown_seconds
+        self.on_complete = on_complete
+        self.history = []
+        self._thread = None
+        self._last_start = None
+        self._lock = threading.Lock()
+
+    def request(self, data_path, reason='manual', force=False):
+        """Schedule a retrain on `data_path`; returns False if skipped (busy or cooling down)."""
+        with self._lock:
+            if self._thread is not None and self._thread.is_alive():
+                return False
+            now = time.monotonic()
+            if not force and self._last_start is not None and now - self._last_start < self.cooldown_seconds:
+                return False
+            self._last_start = now
+            job = {
+                'data_path': data_path,
+                'reason': reason,
+                'state': 'running',
+                'started_at': datetime.now().isoformat(),
+                'finished_at': None,
+                'result': None,
+                'error': None,
+            }
+            self.history.append(job)
+            del self.history[:-20]
+            self._thread = threading.Thread(target=self._run, args=(job,), name='retrain', daemon=True)
+            self._thread.start()
+        logging.info(f"Retraining scheduled on {data_path} ({reason})")
+        return True
+
+    def _run(self, job):
+        try:
+            job['result'] = self.train_fn(job['data_path'])
+            job['state'] = 'completed'
+            if self.on_complete is not None:
+                self.on_complete(job['result'])
+        except Exception as e:
+            logging.error(f"Error retraining on {job['data_path']}: {str(e)}")
+            job['error'] = str(e)
+            job['state'] = 'failed'
+        finally:
+            job['finished_at'] = datetime.now().isoformat()
+
+    def status(self):
+        with self._lock:
+            running = self._thread is not None and self._thread.is_alive()
+            return {'running': running, 'cooldown_seconds': self.cooldown_seconds, 'jobs': [dict(job) for job in self.history]}
@@ -0,0 +1,220 @@
+import math
+from collections import deque
+from itertools import groupby
+
+import numpy as np
+import pandas as pd
+
+from utils.timestamps import NS_PER_SECOND, to_epoch_ns
+
+
+def _clogc(count):
+    return count * math.log2(count) if count > 1 else 0.0
+
+
+class _HostState:
+    """Rolling state of one host over its last N windows.
+
+    Each window slot keeps its own flow, peer and port counts; totals are
+    kept alongside and adjusted when a slot expires, so adding a flow and
+    reading features are O(1) amortized.
+    """
+
+    __slots__ = ('slots', 'flows', 'peers', 'ports', 'port_clogc', 'window', 'window_bytes', 'ewma_base')
+
+    def __init__(self):
+        self.slots = deque()   # [window, flows, peer counts, port counts]
+        self.flows = 0
+        self.peers = {}
+        self.ports = {}
+        # sum of c*log2(c) over port counts, for incremental entropy
+        self.port_clogc = 0.0
+        self.window = None
+        self.window_bytes = 0.0
+        self.ewma_base = None
+
+    def add(self, window, peer, port, nbytes, history, alpha):
+        self._advance(window, alpha)
+        self._expire(self.window - history + 1)
+        if not self.slots or self.slots[-1][0] != self.window:
+            self.slots.append([self.window, 0, {}, {}])
+        slot = self.slots[-1]
+        slot[1] += 1
+        self.flows += 1
+        slot[2][peer] = slot[2].get(peer, 0) + 1
+        self.peers[peer] = self.peers.get(peer, 0) + 1
+        slot[3][port] = slot[3].get(port, 0) + 1
+        count = self.ports.get(port, 0)
+        self.port_clogc += _clogc(count + 1) - _clogc(count)
+        self.ports[port] = count + 1
+        self.window_bytes += nbytes
+
+    def _advance(self, window, alpha):
+        if self.window is None:
+            self.window = window
+            return
+        if window <= self.window:
+            # Late rows count towards the host's current window
+            return
+        ewma = self.window_bytes if self.ewma_base is None else alpha * self.window_bytes + (1 - alpha) * self.ewma_base
+        # Windows without traffic from this host decay the average towards 0
+        self.ewma_base = ewma * (1 - alpha) ** (window - self.window - 1)
+        self.window = window
+        self.window_bytes = 0.0
+
+    def _expire(self, oldest_window):
+        while self.slots and self.slots[0][0] < oldest_window:
+            _, flows, peers, ports = self.slots.popleft()
+            self.flows -= flows
+            for peer, count in peers.items():
+                remaining = self.peers[peer] - count
+                if remaining:
+                    self.peers[peer] = remaining
+                else:
+                    del self.peers[peer]
+            for port, count in ports.items():
+                total = self.ports[port]
+                self.port_clogc += _clogc(total - count) - _clogc(total)
+                if total - count:
+                    self.ports[port] = total - count
+                else:
+                    del self.ports[port]
+
+    def bytes_ewma(self, alpha):
+        if self.ewma_base is None:
+            return self.window_bytes
+        return alpha * self.window_bytes + (1 - alpha) * self.ewma_base
+
+    def port_entropy(self):
+        if self.flows <= 0:
+            return 0.0
+        return max(math.log2(self.flows) - self.port_clogc / self.flows, 0.0)
+
+
+class HostContext:
+    """Per-source and per-destination rolling features for flow windows.
+
+    Flow windows are fed in time order (one aggregation window at a time)
+    and each row gets the context of its source and destination host over
+    the last `history_windows` windows: EWMA of bytes per window, flow
+    count, distinct peers (fan-out / fan-in) and destination port entropy.
+    State is incremental, so streaming capture and offline analysis produce
+    the same values without rescanning history.
+    """
+
+    FEATURES = [
+        'src_bytes_ewma',
+        'src_flow_count',
+        'src_fanout',
+        'src_port_entropy',
+        'dst_bytes_ewma',
+        'dst_flow_count',
+        'dst_fanin',
+    ]
+
+    def __init__(self, window_seconds=30, history_windows=10, ewma_alpha=0.3, idle_windows=None):
+        self.window_ns = int(window_seconds * NS_PER_SECOND)
+        self.history_windows = history_windows
+        self.alpha = ewma_alpha
+        # Hosts silent for this many windows are dropped to bound memory
+        self.idle_windows = idle_windows or 4 * history_windows
+        self.sources = {}
+        self.destinations = {}
+        self._last_prune = None
+
+    @classmethod
+    def from_config(cls, config):
+        """Build from the `host_features` config section; None when disabled."""
+        options = dict(config.get('host_features', {}))
+        if not options.pop('enabled', False):
+            return None
+        return cls(**options)
+
+    def _window_of(self, row):
+        window_start = row.get('window_start_ns')
+        if window_start is None:
+            window_start = to_epoch_ns(row.get('timestamp'))
+        return window_start // self.window_ns
+
+    def update(self, rows):
+        """Fold flow-window rows into the state and add FEATURES to each row (in place)."""
+        for window, group in groupby(rows, key=self._window_of):
+            group = list(group)
+            for row in group:
+                self._add(window, row)
+            for row in group:
+                row.update(self._features(row))
+            self._maybe_prune(window)
+        return rows
+
+    def _add(self, window, row):
+        src, dst = row.get('source_ip', ''), row.get('destination_ip', '')
+        port = row.get('destination_port', '')
+        try:
+            nbytes = float(row.get('bytes_transferred') or 0)
+        except (TypeError, ValueError):
+            nbytes = 0.0
+        source = self.sources.get(src)
+        if source is None:
+            source = self.sources[src] = _HostState()
+        source.add(window, dst, port, nbytes, self.history_windows, self.alpha)
+        destination = self.destinations.get(dst)
+        if destination is None:
+            destination = self.destinations[dst] = _HostState()
+        destination.add(window, src, port, nbytes, self.history_windows, self.alpha)
+
+    def _features(self, row):
+        source = self.sources[row.get('source_ip', '')]
+        destination = self.destinations[row.get('destination_ip', '')]
+        return {
+            'src_bytes_ewma': round(source.bytes_ewma(self.alpha), 3),
+            'src_flow_count': source.flows,
+            'src_fanout': len(source.peers),
+            'src_port_entropy': round(source.port_entropy(), 6),
+            'dst_bytes_ewma': round(destination.bytes_ewma(self.alpha), 3),
+            'dst_flow_count': destination.flows,
+            'dst_fanin': len(destination.peers),
+        }
+
+    def _maybe_prune(self, window):
+        if self._last_prune is None:
+            self._last_prune = window
+        if window - self._last_prune < self.history_windows:
+            return
+        self._last_prune = window
+        for hosts in (self.sources, self.destinations):
+            for host in [h for h, state in hosts.items() if window - state.window > self.idle_windows]:
+                del hosts[host]
+
+    @staticmethod
+    def has_hosts(df):
+        """Whether `df` has non-empty source_ip and destination_ip columns to key host state on."""
+        return all(name in df and df[name].fillna('').astype(str).ne('').any() for name in ('source_ip', 'destination_ip'))
+
+    def transform_frame(self, df):
+        """Add FEATURES columns to a flow-window DataFrame, processing rows in time order.
+
+        Raises ValueError when the frame has no source/destination IPs:
+        every row would fall into one host and the features would be constant.
+        """
+        if not self.has_hosts(df):
+            raise ValueError("Host features need source_ip and destination_ip columns")
+        columns = ['timestamp', 'source_ip', 'destination_ip', 'destination_port', 'bytes_transferred']
+        frame = pd.DataFrame({name: df[name] if name in df else '' for name in columns}, index=df.index)
+        frame['source_ip'] = frame['source_ip'].fillna('').astype(str)
+        frame['destination_ip'] = frame['destination_ip'].fillna('').astype(str)
+        frame['window_start_ns'] = _window_starts(frame['timestamp'])
+        order = np.argsort(frame['window_start_ns'].to_numpy(), kind='stable')
+        rows = frame.iloc[order].to_dict('records')
+        self.update(rows)
+        features = pd.DataFrame(rows, columns=self.FEATURES, index=frame.index[order])
+        for name in self.FEATURES:
+            df[name] = features[name].reindex(df.index)
+        return df
+
+
+def _window_starts(timestamps):
+    parsed = pd.to_datetime(pd.Series(timestamps).astype(str), utc=True, format='mixed', errors='coerce')
+    epoch = pd.Timestamp(0, tz='UTC')
+    # Unparseable timestamps fall into the epoch window
+    return ((parsed.fillna(epoch) - epoch) // pd.Timedelta(1, 'ns')).astype(np.int64).to_numpy()
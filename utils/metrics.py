@@ -0,0 +1,172 @@
+import re
+import threading
+import time
+import tracemalloc
+from contextlib import contextmanager
+
+
+class _NullTimer:
+    """No-op context manager returned when metrics are disabled."""
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class MetricsRegistry:
+    """Lightweight in-process registry of stage timers, counters and gauges.
+
+    Timers are context managers; when the registry is disabled they return a
+    shared no-op object so instrumented code pays only an attribute lookup.
+    """
+
+    def __init__(self, enabled=True, track_memory=False):
+        self.enabled = enabled
+        self.track_memory = track_memory
+        self._lock = threading.Lock()
+        self._timers = {}
+        self._counters = {}
+        self._gauges = {}
+        # Running timers -> highest traced memory seen so far (see _timed)
+        self._memory_peaks = {}
+        self._memory_lock = threading.Lock()
+
+    def configure(self, enabled=None, track_memory=None):
+        """Update registry switches, typically from the `metrics` config section."""
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if track_memory is not None:
+            self.track_memory = bool(track_memory)
+        if self.enabled and self.track_memory and not tracemalloc.is_tracing():
+            tracemalloc.start()
+
+    def timer(self, name, sink=None):
+        """Time a block and record it under `name`.
+
+        If `sink` is a dict, the elapsed seconds are also accumulated in it
+        under `name` so callers can report per-run stage timings.
+        """
+        if not self.enabled:
+            return _NULL_TIMER
+        return self._timed(name, sink)
+
+    @contextmanager
+    def _timed(self, name, sink):
+        trace_memory = self.track_memory and tracemalloc.is_tracing()
+        if trace_memory:
+            token = self._start_memory_peak()
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - start
+            self.observe(name, elapsed)
+            if sink is not None:
+                sink[name] = round(sink.get(name, 0.0) + elapsed, 6)
+            if trace_memory:
+                self.set_gauge(f'{name}_peak_memory_bytes', self._stop_memory_peak(token))
+
+    def _start_memory_peak(self):
+        """Start tracking the traced-memory peak of one timed block.
+
+        tracemalloc has a single process-wide peak. Before it is reset for
+        the new block, the peak so far is credited to every block still
+        running, so nested and concurrent timers keep their own maximum.
+        Traced memory is process-wide: concurrent blocks see each other's
+        allocations.
+        """
+        token = object()
+        with self._memory_lock:
+            current, peak = tracemalloc.get_traced_memory()
+            for key, value in self._memory_peaks.items():
+                self._memory_peaks[key] = max(value, peak)
+            tracemalloc.reset_peak()
+            self._memory_peaks[token] = current
+        return token
+
+    def _stop_memory_peak(self, token):
+        with self._memory_lock:
+            _, peak = tracemalloc.get_traced_memory()
+            return max(self._memory_peaks.pop(token), peak)
+
+    def observe(self, name, seconds):
+        """Record a single duration sample for `name`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            stats = self._timers.get(name)
+            if stats is None:
+                stats = self._timers[name] = {'count': 0, 'sum': 0.0, 'max': 0.0, 'last': 0.0}
+            stats['count'] += 1
+            stats['sum'] += seconds
+            stats['last'] = seconds
+            if seconds > stats['max']:
+                stats['max'] = seconds
+
+    def incr(self, name, value=1):
+        """Increment counter `name` by `value`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + value
+
+    def set_gauge(self, name, value):
+        """Set gauge `name` to `value`."""
+        if not self.enabled:
+            return
+        with self._lock:
+            self._gauges[name] = value
+
+    def snapshot(self):
+        """Return a JSON-serializable copy of all metrics."""
+        with self._lock:
+            return {
+                'timers': {name: dict(stats) for name, stats in self._timers.items()},
+                'counters': dict(self._counters),
+                'gauges': dict(self._gauges),
+            }
+
+    def reset(self):
+        """Drop all recorded metrics."""
+        with self._lock:
+            self._timers.clear()
+            self._counters.clear()
+            self._gauges.clear()
+
+    def to_prometheus(self, prefix='ntad'):
+        """Render all metrics in the Prometheus text exposition format."""
+        snap = self.snapshot()
+        lines = []
+        for name, stats in sorted(snap['timers'].items()):
+            metric = _metric_name(prefix, name, 'seconds')
+            lines.append(f'# TYPE {metric} summary')
+            lines.append(f'{metric}_count {stats["count"]}')
+            lines.append(f'{metric}_sum {stats["sum"]:.6f}')
+            lines.append(f'# TYPE {metric}_max gauge')
+            lines.append(f'{metric}_max {stats["max"]:.6f}')
+        for name, value in sorted(snap['counters'].items()):
+            metric = _metric_name(prefix, name, 'total')
+            lines.append(f'# TYPE {metric} counter')
+            lines.append(f'{metric} {value}')
+        for name, value in sorted(snap['gauges'].items()):
+            metric = _metric_name(prefix, name)
+            lines.append(f'# TYPE {metric} gauge')
+            lines.append(f'{metric} {value}')
+        return '\n'.join(lines) + '\n'
+
+
+def _metric_name(prefix, name, suffix=None):
+    name = re.sub(r'[^a-zA-Z0-9_]', '_', name)
+    parts = [prefix, name]
+    if suffix and not name.endswith(suffix):
+        parts.append(suffix)
+    return '_'.join(parts)
+
+
+# Process-wide default registry shared by the detector, capture and Flask app
+registry = MetricsRegistry()
@@ -1,6 +1,5 @@
 import numpy as np
 import pandas as pd
-from sklearn.cluster import KMeans
 import json
 import logging
 from datetime import datetime
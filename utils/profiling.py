@@ -0,0 +1,95 @@
+import cProfile
+import io
+import logging
+import os
+import pstats
+from datetime import datetime
+
+
+class ProfileSession:
+    """Run a block under cProfile and write the profile plus a hotspot summary.
+
+    Used as a context manager around a single analysis or capture. When
+    disabled it does nothing and `result` stays None. After the block, the
+    raw profile is saved as `profile_<name>_<timestamp>.prof` (loadable with
+    pstats or snakeviz) next to a plain-text top-N summary.
+    """
+
+    def __init__(self, name, enabled=True, top_n=20, output_dir='outputs', sort_by='cumulative'):
+        self.name = name
+        self.enabled = enabled
+        self.top_n = top_n
+        self.output_dir = output_dir
+        self.sort_by = sort_by
+        self.result = None
+        self._profiler = None
+
+    def __enter__(self):
+        if self.enabled:
+            self._profiler = cProfile.Profile()
+            try:
+                self._profiler.enable()
+            except ValueError as e:
+                # Another profiler is already active on this thread
+                logging.warning(f"Profiling disabled for {self.name}: {str(e)}")
+                self._profiler = None
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._profiler is None:
+            return False
+        self._profiler.disable()
+        try:
+            self.result = self._write_artifacts()
+        except Exception as e:
+            logging.error(f"Error writing profile for {self.name}: {str(e)}")
+        return False
+
+    def _write_artifacts(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        timestamp = datetime.now().strftime("%Y%m%d_%H%M%S_%f")
+        base = os.path.join(self.output_dir, f'profile_{self.name}_{timestamp}')
+        profile_file = f'{base}.prof'
+        summary_file = f'{base}.txt'
+
+        self._profiler.dump_stats(profile_file)
+
+        buffer = io.StringIO()
+        stats = pstats.Stats(self._profiler, stream=buffer)
+        stats.sort_stats(self.sort_by).print_stats(self.top_n)
+        with open(summary_file, 'w', encoding='utf-8') as f:
+            f.write(buffer.getvalue())
+
+        hotspots = self._hotspots(stats)
+        logging.info(f"Profile for {self.name} written to {profile_file}")
+        return {
+            'profile_file': profile_file,
+            'summary_file': summary_file,
+            'total_seconds': round(stats.total_tt, 6),
+            'hotspots': hotspots,
+        }
+
+    def _hotspots(self, stats):
+        """Return the top-N functions by the configured sort key."""
+        key_index = {'cumulative': 3, 'tottime': 2, 'ncalls': 1}.get(self.sort_by, 3)
+        rows = []
+        for (filename, line, func), (cc, ncalls, tottime, cumtime, _) in stats.stats.items():
+            rows.append((
+                {
+                    'function': func,
+                    'location': f'{os.path.basename(filename)}:{line}',
+                    'ncalls': ncalls,
+                    'tottime': round(tottime, 6),
+                    'cumtime': round(cumtime, 6),
+                },
+                (None, ncalls, tottime, cumtime)[key_index],
+            ))
+        rows.sort(key=lambda r: r[1], reverse=True)
+        return [entry for entry, _ in rows[:self.top_n]]
+
+
+def profiling_requested(config, header_value=None):
+    """Decide whether to profile a run from the config or a request header value."""
+    if header_value is not None and str(header_value).strip().lower() in {'1', 'true', 'yes', 'on'}:
+        return True
+    return bool(config.get('profiling', {}).get('enabled', False))
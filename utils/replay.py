@@ -0,0 +1,355 @@
+import argparse
+import json
+import logging
+import os
+import sys
+import threading
+import time
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from capture_to_csv import RollingAggregator
+from utils.batch_aggregator import KEY_COLUMNS, length_column
+from utils.timestamps import NS_PER_SECOND, epoch_ns_column, iso_utc
+
+# Sleeps shorter than this are skipped and the packet is processed immediately
+_MIN_SLEEP = 0.002
+
+
+class ReplaySession:
+    """Session interface ScoringService expects; keeps every batch latency for percentiles."""
+
+    def __init__(self, session_id, output_file):
+        self.id = session_id
+        self.output_file = output_file
+        self.manifest = None
+        self.latencies = []
+        self.scoring = {'windows_scored': 0, 'anomalies': 0, 'min_score': None, 'batches_dropped': 0, 'last_error': None}
+        self._lock = threading.Lock()
+
+    def record_scores(self, windows, anomalies, min_score, latency=None):
+        with self._lock:
+            self.scoring['windows_scored'] += windows
+            self.scoring['anomalies'] += anomalies
+            if self.scoring['min_score'] is None or min_score < self.scoring['min_score']:
+                self.scoring['min_score'] = round(min_score, 6)
+            if latency is not None:
+                self.latencies.append(latency)
+
+    def record_dropped(self, error=None):
+        with self._lock:
+            self.scoring['batches_dropped'] += 1
+            if error:
+                self.scoring['last_error'] = error
+
+
+def detect_mode(path):
+    """'packets' for raw packet CSVs (network_traffic.csv), 'windows' for flow-window CSVs or manifests."""
+    if path.endswith('.manifest.json'):
+        return 'windows'
+    columns = pd.read_csv(path, nrows=0).columns
+    if 'src_ip' in columns and 'length' in columns:
+        return 'packets'
+    if 'bytes_transferred' in columns:
+        return 'windows'
+    raise ValueError(f"{path} is neither a packet capture CSV nor a flow window CSV")
+
+
+def _rss_bytes():
+    """Current resident set size (Linux), else the peak from getrusage."""
+    try:
+        with open('/proc/self/statm', 'r') as f:
+            return int(f.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        try:
+            import resource
+            return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+        except ImportError:
+            return None
+
+
+def _aggregator_bytes(aggregator, sample_flows=64):
+    """Estimate the aggregator's flow-state memory from a sample of flows (state size is constant per flow)."""
+    if not aggregator.active_flows():
+        return 0
+    sampled, total = 0, 0
+    for flows in aggregator.windows.values():
+        for key, state in flows.items():
+            total += sys.getsizeof(key) + sum(sys.getsizeof(part) for part in key)
+            total += sys.getsizeof(state) + sum(sys.getsizeof(value) for value in state.values())
+            sampled += 1
+            if sampled >= sample_flows:
+                break
+        if sampled >= sample_flows:
+            break
+    containers = sys.getsizeof(aggregator.windows) + sum(sys.getsizeof(flows) for flows in aggregator.windows.values())
+    return int(total / sampled * aggregator.active_flows()) + containers
+
+
+class Replay:
+    """Feeds a recorded capture through the live aggregation and scoring path.
+
+    Packet CSVs go packet by packet through a RollingAggregator with the
+    same flush rule as capture_to_csv. Flow-window CSVs (and rotation
+    manifests) are emitted one window at a time at the window's end.
+    `speed` is a multiple of the recorded pace (1 = original speed); 0
+    replays as fast as possible. Flushed windows are submitted to a
+    ScoringService as a live session would, after `host_context` (a
+    HostContext, as capture's write_flushed uses) adds per-host features
+    to windows that lack them. Throughput, aggregator size and scoring
+    backlog are sampled every `sample_seconds`.
+    """
+
+    def __init__(self, path, speed=1.0, scoring=None, window_seconds=30, sketches=False, max_flows=0, sample_seconds=1.0, limit=0,
+                 host_context=None):
+        self.path = path
+        self.mode = detect_mode(path)
+        self.speed = float(speed or 0)
+        self.scoring = scoring
+        self.window_ns = int(window_seconds * NS_PER_SECOND)
+        self.max_flows = max_flows
+        self.sample_seconds = sample_seconds
+        self.limit = limit
+        self.aggregator = RollingAggregator(window_seconds=window_seconds, sketches=sketches)
+        self.host_context = host_context
+        self.session = ReplaySession(f"replay_{datetime.now().strftime('%Y%m%d_%H%M%S')}", path)
+        self.packets = 0
+        self.windows = 0
+        self.skipped = {}
+        self.timeline = []
+        self.max_lag = 0.0
+        self._data_origin = None
+        self._wall_origin = None
+        self._first_ns = None
+        self._last_ns = None
+        self._next_sample = None
+        self._last_sample = None
+
+    def _pace(self, ts_ns):
+        """Wait until `ts_ns` is due at the replay speed; tracks how far behind schedule we are."""
+        if self._first_ns is None:
+            self._first_ns = ts_ns
+        if self._last_ns is None or ts_ns > self._last_ns:
+            self._last_ns = ts_ns
+        if not self.speed:
+            return
+        now = time.perf_counter()
+        if self._data_origin is None:
+            self._data_origin, self._wall_origin = ts_ns, now
+            return
+        delay = self._wall_origin + (ts_ns - self._data_origin) / NS_PER_SECOND / self.speed - now
+        if delay > _MIN_SLEEP:
+            time.sleep(delay)
+        elif -delay > self.max_lag:
+            self.max_lag = -delay
+
+    def _emit(self, rows):
+        self.windows += len(rows)
+        if self.host_context is not None and any(name not in rows[0] for name in self.host_context.FEATURES):
+            # Host state spans the whole replay; a scoring batch alone would only see its own windows
+            self.host_context.update(rows)
+        if self.scoring is not None:
+            self.scoring.submit(self.session, rows)
+
+    def _skip(self, reason, count=1):
+        self.skipped[reason] = self.skipped.get(reason, 0) + count
+
+    def _maybe_sample(self, force=False):
+        now = time.perf_counter()
+        if not force and now < self._next_sample:
+            return
+        self._next_sample = now + self.sample_seconds
+        last_time, last_packets, last_windows = self._last_sample
+        interval = max(now - last_time, 1e-9)
+        self.timeline.append({
+            'elapsed_seconds': round(now - self._started, 3),
+            'data_time': iso_utc([self._last_ns])[0] if self._last_ns is not None else None,
+            'packets': self.packets,
+            'windows': self.windows,
+            'packets_per_second': round((self.packets - last_packets) / interval, 1),
+            'windows_per_second': round((self.windows - last_windows) / interval, 1),
+            'active_flows': self.aggregator.active_flows(),
+            'open_windows': len(self.aggregator.windows),
+            'aggregator_bytes': _aggregator_bytes(self.aggregator),
+            'rss_bytes': _rss_bytes(),
+            'scoring_queue': self.scoring.snapshot()['queued_batches'] if self.scoring is not None else None,
+        })
+        self._last_sample = (now, self.packets, self.windows)
+
+    def _replay_packets(self, chunk_rows):
+        aggregator = self.aggregator
+        reader = pd.read_csv(
+            self.path, chunksize=chunk_rows, keep_default_na=False,
+            dtype={'timestamp': str, 'length': str, **{name: str for name in KEY_COLUMNS}},
+        )
+        for chunk in reader:
+            ts_ns, valid = epoch_ns_column(chunk['timestamp'])
+            if not valid.all():
+                self._skip('bad_timestamp', int((~valid).sum()))
+                chunk = chunk[valid]
+                ts_ns = ts_ns[valid]
+            columns = zip(
+                ts_ns.tolist(), chunk['src_ip'].tolist(), chunk['src_port'].tolist(), chunk['dst_ip'].tolist(),
+                chunk['dst_port'].tolist(), chunk['protocol'].tolist(), length_column(chunk['length']).tolist(),
+            )
+            for ts, src_ip, src_port, dst_ip, dst_port, proto, length in columns:
+                self._pace(ts)
+                self.packets += 1
+                if self.max_flows and aggregator.active_flows() >= self.max_flows:
+                    # Same policy as capture_to_csv: flush finished windows, then drop the packet if still full
+                    flushed = aggregator.flush_older_than(ts - self.window_ns)
+                    if flushed:
+                        self._emit(flushed)
+                    if aggregator.active_flows() >= self.max_flows:
+                        self._skip('flow_limit')
+                        continue
+                aggregator.add_packet(ts, src_ip, src_port, dst_ip, dst_port, proto, length)
+                flushed = aggregator.flush_older_than(ts - self.window_ns)
+                if flushed:
+                    self._emit(flushed)
+                if self.packets & 1023 == 0:
+                    self._maybe_sample()
+                if self.limit and self.packets >= self.limit:
+                    break
+            if self.limit and self.packets >= self.limit:
+                break
+        self._maybe_sample(force=True)
+        flushed = aggregator.flush_all()
+        if flushed:
+            self._emit(flushed)
+
+    def _window_frames(self, chunk_rows):
+        if self.mode == 'windows' and self.path.endswith('.manifest.json'):
+            from utils.rotation import read_range
+            yield read_range(self.path)
+        else:
+            yield from pd.read_csv(self.path, chunksize=chunk_rows)
+
+    def _replay_windows(self, chunk_rows):
+        pending, pending_start = [], None
+        for frame in self._window_frames(chunk_rows):
+            if 'window_start_ns' in frame.columns:
+                starts = frame['window_start_ns'].to_numpy(dtype=np.int64)
+                valid = np.ones(len(frame), dtype=bool)
+            else:
+                starts, valid = epoch_ns_column(frame['timestamp'])
+                starts = starts - starts % self.window_ns
+            frame = frame.drop(columns=['window_start_ns'], errors='ignore')
+            for start, ok, row in zip(starts.tolist(), valid.tolist(), frame.to_dict('records')):
+                if not ok:
+                    self._skip('bad_timestamp')
+                    continue
+                if pending and start != pending_start:
+                    # A window is complete once rows of another window arrive; it is due at its end
+                    self._pace(pending_start + self.window_ns)
+                    self._emit(pending)
+                    pending = []
+                    self._maybe_sample()
+                pending_start = start
+                row['window_start_ns'] = start
+                pending.append(row)
+                self.packets += int(row.get('packet_count') or 0)
+                if self.limit and self.windows + len(pending) >= self.limit:
+                    break
+            if self.limit and self.windows + len(pending) >= self.limit:
+                break
+        if pending:
+            self._pace(pending_start + self.window_ns)
+            self._emit(pending)
+
+    def run(self, chunk_rows=100000, drain_timeout=600):
+        """Replay the whole file; returns the report (see summarize())."""
+        self._started = time.perf_counter()
+        self._next_sample = self._started + self.sample_seconds
+        self._last_sample = (self._started, 0, 0)
+        try:
+            if self.mode == 'packets':
+                self._replay_packets(chunk_rows)
+            else:
+                self._replay_windows(chunk_rows)
+            self._replayed_at = time.perf_counter()
+            if self.scoring is not None:
+                # Wait for the last batches so their latency is included
+                self.scoring.close(timeout=drain_timeout)
+            self._finished_at = time.perf_counter()
+            self._maybe_sample(force=True)
+        except Exception as e:
+            logging.error(f"Error replaying {self.path}: {str(e)}")
+            raise
+        return self.summarize()
+
+    def summarize(self):
+        wall = max(self._replayed_at - self._started, 1e-9)
+        data_seconds = (self._last_ns - self._first_ns) / NS_PER_SECOND if self._first_ns is not None else 0.0
+        latency = None
+        if self.session.latencies:
+            values = np.asarray(self.session.latencies) * 1000
+            latency = {
+                'batches': len(values),
+                'p50': round(float(np.percentile(values, 50)), 3),
+                'p95': round(float(np.percentile(values, 95)), 3),
+                'p99': round(float(np.percentile(values, 99)), 3),
+                'max': round(float(values.max()), 3),
+            }
+        memory = {
+            'peak_active_flows': max((s['active_flows'] for s in self.timeline), default=0),
+            'peak_aggregator_bytes': max((s['aggregator_bytes'] for s in self.timeline), default=0),
+            'peak_rss_bytes': max((s['rss_bytes'] or 0 for s in self.timeline), default=0),
+        }
+        return {
+            'input': self.path,
+            'mode': self.mode,
+            'speed': self.speed or 'max',
+            'session_id': self.session.id,
+            'packets': self.packets,
+            'windows': self.windows,
+            'skipped': self.skipped,
+            'data_seconds': round(data_seconds, 3),
+            'wall_seconds': round(wall, 3),
+            'drain_seconds': round(self._finished_at - self._replayed_at, 3),
+            'achieved_speed': round(data_seconds / wall, 2),
+            'packets_per_second': round(self.packets / wall, 1),
+            'windows_per_second': round(self.windows / wall, 1),
+            'max_schedule_lag_seconds': round(self.max_lag, 3),
+            'window_to_alert_ms': latency,
+            'scoring': {**self.session.scoring, 'service': self.scoring.snapshot()} if self.scoring is not None else None,
+            'memory': memory,
+            'timeline': self.timeline,
+        }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a recorded capture through the streaming aggregation and scoring path.")
+    parser.add_argument('input', help='Raw packet CSV (e.g. network_traffic.csv), flow-window CSV, or rotation manifest')
+    parser.add_argument('--speed', type=float, default=1.0, help='Multiple of the recorded pace (default 1 = original speed)')
+    parser.add_argument('--max-speed', action='store_true', help='Replay as fast as possible (same as --speed 0)')
+    parser.add_argument('--config', default='config.json', help='Config file with the saved model paths (default config.json)')
+    parser.add_argument('--no-score', action='store_true', help='Only aggregate, do not score windows')
+    parser.add_argument('--store-anomalies', action='store_true', help='Store anomalies found during the replay in the anomaly store')
+    parser.add_argument('--max-flows', type=int, default=0, help='Active flow limit, as for capture sessions (default 0 = none)')
+    parser.add_argument('--sketches', action='store_true', help='Keep streaming sketches in the aggregator, as capture --sketches does')
+    parser.add_argument('--queue-size', type=int, default=64, help='Scoring queue size in batches (default 64)')
+    parser.add_argument('--sample-seconds', type=float, default=1.0, help='Seconds between timeline samples (default 1)')
+    parser.add_argument('--limit', type=int, default=0, help='Stop after N packets (packet CSVs) or N windows (default 0 = all)')
+    parser.add_argument('--report', default=None, help='Write the full report, including the timeline, to this JSON file')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s - %(levelname)s - %(message)s')
+    scoring = None
+    if not args.no_score:
+        from utils.capture_manager import ScoringService
+        scoring = ScoringService(args.config, queue_size=args.queue_size, store_anomalies=args.store_anomalies)
+    from main import NetworkAnomalyDetector
+    from utils.host_features import HostContext
+    replay = Replay(
+        args.input, speed=0 if args.max_speed else args.speed, scoring=scoring, sketches=args.sketches,
+        max_flows=args.max_flows, sample_seconds=args.sample_seconds, limit=args.limit,
+        host_context=HostContext.from_config(NetworkAnomalyDetector.load_config(args.config)),
+    )
+    report = replay.run()
+    if args.report:
+        with open(args.report, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+    print(json.dumps({k: v for k, v in report.items() if k != 'timeline'}, indent=2))
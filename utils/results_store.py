@@ -0,0 +1,286 @@
+import base64
+import csv
+import io
+import json
+import os
+import sqlite3
+import uuid
+from contextlib import closing
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+from utils.anomaly_store import FEATURE_COLUMNS
+from utils.timestamps import epoch_seconds
+
+COLUMNS = [
+    'seq', 'ts', 'timestamp', 'protocol', 'source_ip', 'destination_ip', 'source_port', 'destination_port',
+    *FEATURE_COLUMNS, 'anomaly_score', 'is_anomaly',
+]
+
+# Time sort key; rows without a parseable timestamp sort first instead of dropping out of keyset paging
+TS_KEY = 'IFNULL(ts, -9223372036854775808)'
+
+SCHEMA = f"""
+CREATE TABLE IF NOT EXISTS analyses (
+    analysis_id TEXT PRIMARY KEY,
+    source_file TEXT,
+    created_at TEXT,
+    rows INTEGER,
+    anomalies INTEGER
+);
+CREATE TABLE IF NOT EXISTS scored_rows (
+    analysis_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    ts INTEGER,
+    timestamp TEXT,
+    protocol TEXT,
+    source_ip TEXT,
+    destination_ip TEXT,
+    source_port INTEGER,
+    destination_port INTEGER,
+    {', '.join(f'{name} REAL' for name in FEATURE_COLUMNS)},
+    anomaly_score REAL,
+    is_anomaly INTEGER,
+    PRIMARY KEY (analysis_id, seq)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS idx_scored_rows_score ON scored_rows (analysis_id, anomaly_score, seq);
+CREATE INDEX IF NOT EXISTS idx_scored_rows_anomaly_score ON scored_rows (analysis_id, is_anomaly, anomaly_score, seq);
+CREATE INDEX IF NOT EXISTS idx_scored_rows_ts ON scored_rows (analysis_id, ts);
+CREATE INDEX IF NOT EXISTS idx_scored_rows_time ON scored_rows (analysis_id, {TS_KEY}, seq);
+"""
+
+# Filterable columns -> SQL comparison (the analysis id is always part of the query)
+FILTERS = {
+    'protocol': 'protocol = ?',
+    'source_ip': 'source_ip = ?',
+    'destination_ip': 'destination_ip = ?',
+    'source_port': 'source_port = ?',
+    'destination_port': 'destination_port = ?',
+    'start': 'ts >= ?',
+    'end': 'ts < ?',
+    'min_score': 'anomaly_score >= ?',
+    'max_score': 'anomaly_score <= ?',
+    'anomalies_only': 'is_anomaly = ?',
+}
+
+# Time series -> aggregate over the rows (flow windows) sharing a timestamp
+SERIES = {
+    'bytes_transferred': 'SUM(bytes_transferred)',
+    'packet_count': 'SUM(packet_count)',
+    'connection_duration': 'AVG(connection_duration)',
+    'retransmission_rate': 'AVG(retransmission_rate)',
+    'bytes_per_packet': 'AVG(bytes_per_packet)',
+    'packets_per_second': 'SUM(packets_per_second)',
+    'flows': 'COUNT(*)',
+    'anomaly_score': 'MIN(anomaly_score)',
+    'anomaly_count': 'SUM(is_anomaly)',
+}
+
+# Sort order -> (ORDER BY, cursor key expressions); rows are paged by key, not by OFFSET
+ORDERS = {
+    'time': (f'{TS_KEY} ASC, seq ASC', [TS_KEY, 'seq']),
+    'file': ('seq ASC', ['seq']),
+    'score': ('anomaly_score ASC, seq ASC', ['anomaly_score', 'seq']),
+}
+
+
+def new_analysis_id(prefix=''):
+    """Unique analysis id: a readable second-resolution timestamp plus a random suffix."""
+    return f"{prefix}{datetime.now().strftime('%Y%m%d_%H%M%S')}_{uuid.uuid4().hex[:8]}"
+
+
+def encode_cursor(order, row):
+    """Opaque cursor pointing just after `row` (its key values, in ORDERS order) in `order`."""
+    key = list(row)
+    return base64.urlsafe_b64encode(json.dumps([order, key]).encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def decode_cursor(order, cursor):
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        cursor_order, key = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (ValueError, TypeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+    if cursor_order != order or len(key) != len(ORDERS[order][1]):
+        raise ValueError(f"Cursor does not belong to order '{order}'")
+    return key
+
+
+class ResultsStore:
+    """SQLite store of every scored row of recent analyses, for streaming exports.
+
+    Rows keep their file order (`seq`) and features in original units.
+    Reads are paged by key (time then seq, seq, or score then seq) so each
+    page is an index range scan, and rows are fetched in batches while the response
+    is being written. Only the newest `max_analyses` analyses are kept.
+    """
+
+    def __init__(self, path=os.path.join('outputs', 'results.db'), max_analyses=20):
+        self.path = path
+        self.max_analyses = max_analyses
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        with closing(self._connect()) as conn:
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.executescript(SCHEMA)
+
+    def _connect(self):
+        return sqlite3.connect(self.path, timeout=30)
+
+    def write(self, df, analysis_id, source_file=None, chunk_rows=10000):
+        """Replace the stored rows of `analysis_id` with scored frame `df` (features in original units)."""
+        with closing(self._connect()) as conn, conn:
+            conn.execute('DELETE FROM scored_rows WHERE analysis_id = ?', (analysis_id,))
+            anomalies = 0
+            for start in range(0, len(df), chunk_rows):
+                chunk = df.iloc[start:start + chunk_rows]
+                rows = self._rows(chunk, analysis_id, start)
+                anomalies += sum(row[-1] for row in rows)
+                conn.executemany(
+                    f"INSERT INTO scored_rows (analysis_id, {', '.join(COLUMNS)}) VALUES ({', '.join(['?'] * (len(COLUMNS) + 1))})",
+                    rows,
+                )
+            conn.execute(
+                'INSERT OR REPLACE INTO analyses (analysis_id, source_file, created_at, rows, anomalies) VALUES (?, ?, ?, ?, ?)',
+                (analysis_id, source_file, datetime.now().isoformat(), len(df), anomalies),
+            )
+            expired = [row[0] for row in conn.execute(
+                'SELECT analysis_id FROM analyses ORDER BY created_at DESC LIMIT -1 OFFSET ?', (int(self.max_analyses),),
+            )]
+            for old_id in expired:
+                conn.execute('DELETE FROM scored_rows WHERE analysis_id = ?', (old_id,))
+                conn.execute('DELETE FROM analyses WHERE analysis_id = ?', (old_id,))
+        return len(df)
+
+    @staticmethod
+    def _rows(df, analysis_id, offset):
+        ts = epoch_seconds(df['timestamp']) if 'timestamp' in df else [None] * len(df)
+        columns = [
+            list(range(offset, offset + len(df))),
+            ts,
+            _values(df, 'timestamp', str),
+            _values(df, 'protocol', str),
+            _values(df, 'source_ip' if 'source_ip' in df else 'src_ip', str),
+            _values(df, 'destination_ip' if 'destination_ip' in df else 'dst_ip', str),
+            _values(df, 'source_port', int),
+            _values(df, 'destination_port', int),
+            *(_values(df, name, float) for name in FEATURE_COLUMNS),
+            _values(df, 'anomaly_score', float),
+            (df['anomaly'] == 'Anomaly').astype(int).tolist(),
+        ]
+        return [(analysis_id, *row) for row in zip(*columns)]
+
+    def analyses(self):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            return [dict(row) for row in conn.execute('SELECT * FROM analyses ORDER BY created_at DESC')]
+
+    def get(self, analysis_id):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            row = conn.execute('SELECT * FROM analyses WHERE analysis_id = ?', (analysis_id,)).fetchone()
+        if row is None:
+            raise KeyError(f"Unknown analysis: {analysis_id}")
+        return dict(row)
+
+    def series(self, analysis_id, names, start=None, end=None):
+        """Per-timestamp aggregates of `names` (see SERIES) in [start, end) epoch seconds.
+
+        Returns (timestamps, {name: values}) as float64 arrays ordered by time.
+        """
+        unknown = [name for name in names if name not in SERIES]
+        if unknown:
+            raise ValueError(f"Unsupported series {unknown}. Use any of: {sorted(SERIES)}")
+        clauses, params = ['analysis_id = ?', 'ts IS NOT NULL'], [analysis_id]
+        if start is not None:
+            clauses.append('ts >= ?')
+            params.append(int(start))
+        if end is not None:
+            clauses.append('ts < ?')
+            params.append(int(end))
+        with closing(self._connect()) as conn:
+            rows = conn.execute(
+                f"SELECT ts, {', '.join(SERIES[name] for name in names)} FROM scored_rows "
+                f"WHERE {' AND '.join(clauses)} GROUP BY ts ORDER BY ts",
+                params,
+            ).fetchall()
+        values = np.array(rows, dtype=np.float64).reshape(len(rows), len(names) + 1)
+        return values[:, 0], {name: values[:, j + 1] for j, name in enumerate(names)}
+
+    def _select(self, columns, analysis_id, filters, order, cursor):
+        if order not in ORDERS:
+            raise ValueError(f"Unsupported order '{order}'. Use one of: {sorted(ORDERS)}")
+        order_sql, key_columns = ORDERS[order]
+        clauses, params = ['analysis_id = ?'], [analysis_id]
+        for key, value in (filters or {}).items():
+            if value is None or value == '' or key not in FILTERS:
+                continue
+            clauses.append(FILTERS[key])
+            params.append(value)
+        if cursor:
+            # Row-value comparison continues strictly after the cursor row
+            clauses.append(f"({', '.join(key_columns)}) > ({', '.join(['?'] * len(key_columns))})")
+            params.extend(decode_cursor(order, cursor))
+        return f"SELECT {columns} FROM scored_rows WHERE {' AND '.join(clauses)} ORDER BY {order_sql}", params
+
+    def next_cursor(self, analysis_id, filters=None, order='time', cursor=None, limit=1000):
+        """Cursor for the page after this one, or None when this page is the last."""
+        sql, params = self._select(', '.join(ORDERS.get(order, ('', []))[1]), analysis_id, filters, order, cursor)
+        with closing(self._connect()) as conn:
+            rows = conn.execute(f'{sql} LIMIT 2 OFFSET ?', params + [int(limit) - 1]).fetchall()
+        return encode_cursor(order, rows[0]) if len(rows) == 2 else None
+
+    def iter_batches(self, analysis_id, filters=None, order='time', cursor=None, limit=0, batch_size=1000):
+        """Iterator over matching rows as lists of dicts, reading `batch_size` rows at a time.
+
+        Arguments are validated here, before the first batch is read.
+        """
+        sql, params = self._select(', '.join(COLUMNS), analysis_id, filters, order, cursor)
+        if limit:
+            sql, params = f'{sql} LIMIT ?', params + [int(limit)]
+        return self._fetch(sql, params, batch_size)
+
+    def _fetch(self, sql, params, batch_size):
+        with closing(self._connect()) as conn:
+            conn.row_factory = sqlite3.Row
+            rows = conn.execute(sql, params)
+            while True:
+                batch = rows.fetchmany(batch_size)
+                if not batch:
+                    return
+                yield [dict(row) for row in batch]
+
+
+def _values(df, name, kind):
+    """Column `name` as a list of Python values for SQLite; missing or unparseable values become None."""
+    if name not in df:
+        return [None] * len(df)
+    series = df[name]
+    if kind is str:
+        return series.astype(str).astype(object).where(series.notna(), None).tolist()
+    numeric = pd.to_numeric(series, errors='coerce')
+    if kind is float:
+        return numeric.astype(object).where(numeric.notna(), None).tolist()
+    return [None if value != value else int(value) for value in np.trunc(numeric.to_numpy(dtype=np.float64)).tolist()]
+
+
+def ndjson_chunks(batches):
+    """One NDJSON text chunk per batch of rows."""
+    for batch in batches:
+        yield ''.join(json.dumps(row) + '\n' for row in batch)
+
+
+def csv_chunks(batches, columns=COLUMNS):
+    """A CSV header, then one CSV text chunk per batch of rows."""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=columns)
+    writer.writeheader()
+    yield buffer.getvalue()
+    for batch in batches:
+        buffer.seek(0)
+        buffer.truncate()
+        writer.writerows(batch)
+        yield buffer.getvalue()
@@ -0,0 +1,265 @@
+import json
+import logging
+import os
+import threading
+import time
+
+import numpy as np
+import pandas as pd
+
+# Source ids remembered for de-duplication (oldest are forgotten first)
+MAX_SOURCES = 1000
+
+# (name, bucket width in seconds, buckets kept)
+DEFAULT_LEVELS = [
+    ('30s', 30, 2 * 24 * 120),   # 2 days
+    ('5m', 300, 14 * 24 * 12),   # 2 weeks
+    ('1h', 3600, 90 * 24),       # ~3 months
+    ('1d', 86400, 3 * 365),      # ~3 years
+]
+
+
+class ScoreSketch:
+    """Fixed-bin histogram of anomaly scores.
+
+    IsolationForest scores live in [-1, 0], so equal-width bins give
+    quantiles within one bin width and two sketches merge by adding counts.
+    """
+
+    LOW = -1.0
+    HIGH = 0.0
+
+    def __init__(self, bins=100, counts=None):
+        self.bins = bins
+        self.counts = np.zeros(bins, dtype=np.int64) if counts is None else np.asarray(counts, dtype=np.int64)
+
+    @classmethod
+    def bin_index(cls, scores, bins):
+        scaled = (np.asarray(scores, dtype=np.float64) - cls.LOW) / (cls.HIGH - cls.LOW) * bins
+        return np.clip(scaled.astype(np.int64), 0, bins - 1)
+
+    def merge(self, other):
+        self.counts += other.counts
+        return self
+
+    def quantile(self, q):
+        total = self.counts.sum()
+        if total == 0:
+            return None
+        cumulative = np.cumsum(self.counts)
+        index = int(np.searchsorted(cumulative, q * total, side='left'))
+        width = (self.HIGH - self.LOW) / self.bins
+        # Report the bin midpoint
+        return round(self.LOW + (index + 0.5) * width, 6)
+
+    def to_dict(self):
+        nonzero = np.nonzero(self.counts)[0]
+        return {str(i): int(self.counts[i]) for i in nonzero}
+
+    @classmethod
+    def from_dict(cls, data, bins):
+        sketch = cls(bins)
+        for index, count in data.items():
+            sketch.counts[int(index)] = count
+        return sketch
+
+
+class RollupStore:
+    """Incremental multi-resolution rollups of scored flow windows.
+
+    Each level keeps per-bucket totals (bytes, packets, flow windows,
+    anomalies) and a score sketch. New windows update every level at once,
+    so range queries never need to re-read capture CSVs.
+
+    Each level also records `evicted_before`: data older than this has
+    been dropped from the level, so queries reaching further back use a
+    coarser level.
+    """
+
+    def __init__(self, levels=None, bins=100, path=None):
+        self.levels = levels or DEFAULT_LEVELS
+        self.bins = bins
+        self.path = path
+        self._lock = threading.Lock()
+        self._buckets = {name: {} for name, _, _ in self.levels}
+        self._evicted_before = {name: None for name, _, _ in self.levels}
+        # source id -> epoch seconds it was added; insertion ordered
+        self._sources = {}
+        self._dirty = False
+        self._last_saved = time.monotonic()
+
+    def add_windows(self, timestamps, bytes_transferred, packet_counts, scores=None, is_anomaly=None, source_id=None):
+        """Fold a batch of flow windows into every rollup level.
+
+        timestamps may be ISO strings, datetimes or integer epoch seconds;
+        naive times are taken as UTC. A batch whose `source_id` (e.g. a
+        digest of the analyzed file) was already added is skipped, so
+        analyzing the same file again does not count its traffic twice.
+        Returns the number of windows added.
+        """
+        if source_id is not None:
+            with self._lock:
+                if source_id in self._sources:
+                    logging.info(f"Rollups already include source {source_id}; skipping")
+                    return 0
+        epochs = _to_epoch_seconds(timestamps)
+        if len(epochs) == 0:
+            return 0
+        bytes_transferred = np.asarray(bytes_transferred, dtype=np.float64)
+        packet_counts = np.asarray(packet_counts, dtype=np.float64)
+        anomalies = np.zeros(len(epochs), dtype=np.int64) if is_anomaly is None else np.asarray(is_anomaly, dtype=np.int64)
+        score_bins = None if scores is None else ScoreSketch.bin_index(scores, self.bins)
+
+        with self._lock:
+            for name, width, retention in self.levels:
+                starts = (epochs // width) * width
+                unique_starts, inverse = np.unique(starts, return_inverse=True)
+                n = len(unique_starts)
+                sums = {
+                    'bytes': np.bincount(inverse, weights=bytes_transferred, minlength=n),
+                    'packets': np.bincount(inverse, weights=packet_counts, minlength=n),
+                    'flows': np.bincount(inverse, minlength=n),
+                    'anomalies': np.bincount(inverse, weights=anomalies, minlength=n),
+                }
+                hist = None
+                if score_bins is not None:
+                    hist = np.zeros((n, self.bins), dtype=np.int64)
+                    np.add.at(hist, (inverse, score_bins), 1)
+
+                buckets = self._buckets[name]
+                for i, start in enumerate(unique_starts.tolist()):
+                    bucket = buckets.get(start)
+                    if bucket is None:
+                        bucket = buckets[start] = {
+                            'bytes': 0.0, 'packets': 0.0, 'flows': 0, 'anomalies': 0,
+                            'scores': ScoreSketch(self.bins),
+                        }
+                    bucket['bytes'] += float(sums['bytes'][i])
+                    bucket['packets'] += float(sums['packets'][i])
+                    bucket['flows'] += int(sums['flows'][i])
+                    bucket['anomalies'] += int(sums['anomalies'][i])
+                    if hist is not None:
+                        bucket['scores'].counts += hist[i]
+                self._evict(name, width, retention)
+            if source_id is not None:
+                self._sources[source_id] = int(time.time())
+                for old in list(self._sources)[:max(len(self._sources) - MAX_SOURCES, 0)]:
+                    del self._sources[old]
+            self._dirty = True
+        return len(epochs)
+
+    def _evict(self, name, width, retention):
+        buckets = self._buckets[name]
+        if len(buckets) > retention:
+            dropped = sorted(buckets)[:len(buckets) - retention]
+            for start in dropped:
+                del buckets[start]
+            self._evicted_before[name] = max(self._evicted_before[name] or 0, dropped[-1] + width)
+
+    def choose_level(self, start, end, max_points=500):
+        """Pick the finest level that answers [start, end) within max_points buckets and still holds `start`.
+
+        Falls back to the coarsest level when none covers the whole range.
+        """
+        span = max(end - start, 1)
+        for name, width, _ in self.levels:
+            evicted_before = self._evicted_before[name]
+            if span / width <= max_points and (evicted_before is None or start >= evicted_before):
+                return name, width
+        name, width, _ = self.levels[-1]
+        return name, width
+
+    def query(self, start, end, max_points=500, level=None):
+        """Return bucket series for [start, end) epoch seconds from one rollup level."""
+        if level is None:
+            level, width = self.choose_level(start, end, max_points)
+        else:
+            width = dict((name, w) for name, w, _ in self.levels)[level]
+        aligned_start = (start // width) * width
+        with self._lock:
+            points = []
+            for bucket_start in sorted(self._buckets[level]):
+                if aligned_start <= bucket_start < end:
+                    bucket = self._buckets[level][bucket_start]
+                    sketch = bucket['scores']
+                    points.append({
+                        'start': bucket_start,
+                        'bytes': bucket['bytes'],
+                        'packets': bucket['packets'],
+                        'flows': bucket['flows'],
+                        'anomalies': bucket['anomalies'],
+                        'score_p50': sketch.quantile(0.5),
+                        'score_p95': sketch.quantile(0.95),
+                        'score_p99': sketch.quantile(0.99),
+                    })
+        return {'level': level, 'resolution_seconds': width, 'points': points}
+
+    def maybe_save(self, interval_seconds=30):
+        """Save if there are unsaved changes and the last save is at least `interval_seconds` old."""
+        if self._dirty and time.monotonic() - self._last_saved >= interval_seconds:
+            return self.save()
+        return None
+
+    def save(self, path=None):
+        """Write all levels to a JSON file."""
+        path = path or self.path
+        if not path:
+            return None
+        with self._lock:
+            self._dirty = False
+            self._last_saved = time.monotonic()
+            data = {
+                'bins': self.bins,
+                'evicted_before': self._evicted_before,
+                'sources': self._sources,
+                'levels': {
+                    name: {
+                        str(start): {**{k: v for k, v in b.items() if k != 'scores'}, 'scores': b['scores'].to_dict()}
+                        for start, b in buckets.items()
+                    }
+                    for name, buckets in self._buckets.items()
+                },
+            }
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(data, f)
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path, levels=None):
+        """Load a store saved with save(); returns an empty store if the file is missing."""
+        store = cls(levels=levels, path=path)
+        if not path or not os.path.exists(path):
+            return store
+        try:
+            with open(path, 'r', encoding='utf-8') as f:
+                data = json.load(f)
+            store.bins = data.get('bins', store.bins)
+            for name, evicted_before in data.get('evicted_before', {}).items():
+                if name in store._evicted_before:
+                    store._evicted_before[name] = evicted_before
+            store._sources = dict(data.get('sources', {}))
+            for name, buckets in data.get('levels', {}).items():
+                if name not in store._buckets:
+                    continue
+                for start, b in buckets.items():
+                    store._buckets[name][int(start)] = {
+                        'bytes': b['bytes'], 'packets': b['packets'],
+                        'flows': b['flows'], 'anomalies': b['anomalies'],
+                        'scores': ScoreSketch.from_dict(b['scores'], store.bins),
+                    }
+        except Exception as e:
+            logging.error(f"Error loading rollups from {path}: {str(e)}")
+        return store
+
+
+def _to_epoch_seconds(timestamps):
+    values = np.asarray(timestamps)
+    if values.dtype.kind in 'iu':
+        return values.astype(np.int64)
+    parsed = pd.to_datetime(pd.Series(values), utc=True, format='mixed')
+    return ((parsed - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
@@ -0,0 +1,272 @@
+import argparse
+import csv
+import gzip
+import json
+import logging
+import os
+import queue
+import shutil
+import threading
+import time
+
+from utils.timestamps import NS_PER_SECOND, iso_utc, to_epoch_ns
+
+MANIFEST_VERSION = 1
+
+
+def manifest_path_for(output_file):
+    """`uploads/x.csv` -> `uploads/x.manifest.json`."""
+    return f'{os.path.splitext(output_file)[0]}.manifest.json'
+
+
+def _write_json_atomic(path, data):
+    tmp_path = f'{path}.tmp'
+    with open(tmp_path, 'w', encoding='utf-8') as f:
+        json.dump(data, f, indent=2)
+    os.replace(tmp_path, path)
+
+
+class RotatingCsvWriter:
+    """CSV output split into segments by size and/or data time.
+
+    A new segment is started when the current one reaches `max_bytes` or
+    when a batch's window start is `max_seconds` past the segment's first
+    window. Closed segments are gzip-compressed by a background thread.
+    A JSON manifest next to the output lists every segment with its row
+    count and window time range, so readers can open only the segments
+    that cover the range they need (see segments_for_range()). It is saved
+    when a segment opens, closes or is compressed, and at most every
+    `manifest_interval` seconds while rows are written to the open segment.
+    """
+
+    def __init__(self, output_file, header, max_bytes=0, max_seconds=0, compress=True, manifest_interval=5.0):
+        self.base, _ = os.path.splitext(output_file)
+        self.header = list(header)
+        self.max_bytes = int(max_bytes or 0)
+        self.max_ns = int((max_seconds or 0) * NS_PER_SECOND)
+        self.compress = compress
+        self.manifest_interval = manifest_interval
+        self.manifest_path = manifest_path_for(output_file)
+        self._saved_at = 0.0
+        self.bytes_written = 0
+        self.rows_written = 0
+        self._lock = threading.Lock()
+        self._segments = []
+        if os.path.exists(self.manifest_path):
+            with open(self.manifest_path, 'r', encoding='utf-8') as f:
+                manifest = json.load(f)
+            if manifest.get('header') != self.header:
+                raise ValueError(f"Existing manifest {self.manifest_path} has a different header")
+            self._segments = manifest['segments']
+        self._sequence = max((s['sequence'] for s in self._segments), default=0)
+        self._file = None
+        self._writer = None
+        self._current = None
+        self._compress_queue = queue.Queue()
+        self._compressor = None
+        if compress:
+            self._compressor = threading.Thread(target=self._compress_loop, name='segment-compressor', daemon=True)
+            self._compressor.start()
+
+    def _open_segment(self):
+        self._sequence += 1
+        path = f'{self.base}.{self._sequence:05d}.csv'
+        self._file = open(path, 'w', newline='', encoding='utf-8')
+        self._writer = csv.writer(self._file)
+        self._writer.writerow(self.header)
+        self._current = {
+            'sequence': self._sequence,
+            'path': os.path.basename(path),
+            'rows': 0,
+            'bytes': 0,
+            'start_ns': None,
+            'end_ns': None,
+            'start': None,
+            'end': None,
+            'closed': False,
+            'compressed': False,
+        }
+        with self._lock:
+            self._segments.append(self._current)
+            self._save_manifest()
+
+    def write_rows(self, rows):
+        """Write flushed window rows (dicts) and rotate if a limit is reached.
+
+        `rows_written` counts every row handed to the segment, also when a
+        later row fails, so callers can retry only the rows after them.
+        """
+        if not rows:
+            return
+        first_ns = self._row_ns(rows[0])
+        if self._current is not None and self._should_rotate(first_ns):
+            self._close_segment()
+        if self._current is None:
+            self._open_segment()
+        size_before = self._file.tell()
+        starts = []
+        try:
+            for item in rows:
+                start = self._row_ns(item)
+                self._writer.writerow([item.get(column, '') for column in self.header])
+                starts.append(start)
+            self._file.flush()
+        finally:
+            self.rows_written += len(starts)
+            segment = self._current
+            if starts:
+                with self._lock:
+                    segment['rows'] += len(starts)
+                    lo, hi = min(starts), max(starts)
+                    if segment['start_ns'] is None or lo < segment['start_ns']:
+                        segment['start_ns'] = lo
+                    if segment['end_ns'] is None or hi > segment['end_ns']:
+                        segment['end_ns'] = hi
+        written = self._file.tell() - size_before
+        self.bytes_written += written
+        with self._lock:
+            segment['bytes'] = self._file.tell()
+            rotate = bool(self.max_bytes) and segment['bytes'] >= self.max_bytes
+            if not rotate and time.monotonic() - self._saved_at >= self.manifest_interval:
+                # Closing the segment saves the manifest anyway
+                self._save_manifest()
+        if rotate:
+            self._close_segment()
+
+    @staticmethod
+    def _row_ns(row):
+        start = row.get('window_start_ns')
+        return start if start is not None else to_epoch_ns(row['timestamp'])
+
+    def _should_rotate(self, window_ns):
+        start = self._current['start_ns']
+        return bool(self.max_ns) and start is not None and window_ns - start >= self.max_ns
+
+    def _close_segment(self):
+        segment = self._current
+        self._file.close()
+        self._file = self._writer = self._current = None
+        with self._lock:
+            segment['closed'] = True
+            if segment['start_ns'] is not None:
+                segment['start'], segment['end'] = iso_utc([segment['start_ns'], segment['end_ns']])
+            self._save_manifest()
+        if self.compress:
+            self._compress_queue.put(segment)
+
+    def _compress_loop(self):
+        while True:
+            segment = self._compress_queue.get()
+            try:
+                if segment is None:
+                    return
+                self._compress(segment)
+            finally:
+                self._compress_queue.task_done()
+
+    def _compress(self, segment):
+        directory = os.path.dirname(self.base)
+        source = os.path.join(directory, segment['path'])
+        target = f'{source}.gz'
+        try:
+            with open(source, 'rb') as src, gzip.open(f'{target}.tmp', 'wb', compresslevel=6) as dst:
+                shutil.copyfileobj(src, dst, 1024 * 1024)
+            os.replace(f'{target}.tmp', target)
+            with self._lock:
+                segment['path'] = os.path.basename(target)
+                segment['compressed'] = True
+                segment['compressed_bytes'] = os.path.getsize(target)
+                self._save_manifest()
+            os.remove(source)
+        except Exception as e:
+            logging.error(f"Error compressing capture segment {source}: {str(e)}")
+
+    def _save_manifest(self):
+        self._saved_at = time.monotonic()
+        _write_json_atomic(self.manifest_path, {
+            'version': MANIFEST_VERSION,
+            'header': self.header,
+            'updated_at': time.time(),
+            'segments': self._segments,
+        })
+
+    def segments(self):
+        with self._lock:
+            return [dict(segment) for segment in self._segments]
+
+    def close(self, wait=True):
+        """Close the open segment; with wait=True also finish pending compression."""
+        if self._current is not None:
+            self._close_segment()
+        if self._compressor is not None:
+            self._compress_queue.put(None)
+            if wait:
+                self._compressor.join()
+        return self.manifest_path
+
+
+def load_manifest(manifest_path):
+    with open(manifest_path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def segments_for_range(manifest_path, start=None, end=None):
+    """Paths of segments whose window range overlaps [start, end); bounds accept any to_epoch_ns input.
+
+    A segment that is still open is always included: its range in the
+    manifest can lag behind the rows already written to it.
+    """
+    manifest = load_manifest(manifest_path)
+    directory = os.path.dirname(manifest_path)
+    start_ns = None if start is None else to_epoch_ns(start)
+    end_ns = None if end is None else to_epoch_ns(end)
+    paths = []
+    for segment in manifest['segments']:
+        if not segment['closed']:
+            paths.append(os.path.join(directory, segment['path']))
+            continue
+        if segment['start_ns'] is None:
+            continue
+        if start_ns is not None and segment['end_ns'] < start_ns:
+            continue
+        if end_ns is not None and segment['start_ns'] >= end_ns:
+            continue
+        paths.append(os.path.join(directory, segment['path']))
+    return paths
+
+
+def read_range(manifest_path, start=None, end=None):
+    """Load the flow windows in [start, end) from only the segments that cover it."""
+    import pandas as pd
+
+    paths = segments_for_range(manifest_path, start, end)
+    header = load_manifest(manifest_path)['header']
+    if not paths:
+        return pd.DataFrame(columns=header)
+    df = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+    if start is None and end is None:
+        return df
+    times = pd.to_datetime(df['timestamp'], utc=True, format='mixed')
+    mask = pd.Series(True, index=df.index)
+    if start is not None:
+        mask &= times >= pd.Timestamp(to_epoch_ns(start), unit='ns', tz='UTC')
+    if end is not None:
+        mask &= times < pd.Timestamp(to_epoch_ns(end), unit='ns', tz='UTC')
+    return df[mask].reset_index(drop=True)
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="List or extract the capture segments covering a time range.")
+    parser.add_argument('manifest', help='Manifest written next to a rotated capture (<output>.manifest.json)')
+    parser.add_argument('--start', default=None, help='Range start (ISO-8601 or epoch seconds, UTC)')
+    parser.add_argument('--end', default=None, help='Range end, exclusive')
+    parser.add_argument('--output', default=None, help='Write the flow windows in the range to this CSV instead of listing segments')
+    args = parser.parse_args()
+
+    if args.output:
+        frame = read_range(args.manifest, args.start, args.end)
+        frame.to_csv(args.output, index=False)
+        print(f"Wrote {len(frame)} rows to {args.output}")
+    else:
+        for path in segments_for_range(args.manifest, args.start, args.end):
+            print(path)
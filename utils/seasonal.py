@@ -0,0 +1,133 @@
+import logging
+import os
+
+import numpy as np
+import pandas as pd
+
+HOURS_PER_WEEK = 7 * 24
+
+
+class SeasonalBaseline:
+    """Per-time-bucket feature statistics used in place of one global scaler.
+
+    Statistics (count, mean, sum of squared deviations) are kept for each
+    hour of the week, each hour of the day and globally, and merged batch by
+    batch, so refreshing them never needs the old data. At transform time a
+    row is standardized with its hour-of-week bucket, falling back to its
+    hour of day and then to the global statistics when a bucket has seen
+    fewer than `min_samples` rows.
+    """
+
+    def __init__(self, features, min_samples=30, timezone='UTC'):
+        self.features = list(features)
+        self.min_samples = min_samples
+        self.timezone = timezone
+        n = len(self.features)
+        # Rows 0..167 are hours of the week, 168..191 hours of the day, 192 is global
+        self.count = np.zeros(HOURS_PER_WEEK + 24 + 1, dtype=np.int64)
+        self.mean = np.zeros((HOURS_PER_WEEK + 24 + 1, n), dtype=np.float64)
+        self.m2 = np.zeros((HOURS_PER_WEEK + 24 + 1, n), dtype=np.float64)
+
+    def bucket_index(self, timestamps):
+        """Hour-of-week index (Monday 00h = 0) per timestamp; -1 where unparseable."""
+        parsed = pd.to_datetime(pd.Series(timestamps).astype(str), utc=True, format='mixed', errors='coerce')
+        if self.timezone and self.timezone != 'UTC':
+            parsed = parsed.dt.tz_convert(self.timezone)
+        index = parsed.dt.dayofweek * 24 + parsed.dt.hour
+        return index.fillna(-1).to_numpy(dtype=np.int64)
+
+    def update(self, X, buckets):
+        """Merge a batch of raw feature rows into every level's statistics."""
+        X = np.asarray(X, dtype=np.float64)
+        if len(X) == 0:
+            return self
+        valid = buckets >= 0
+        groups = [
+            (buckets[valid], X[valid], 0, HOURS_PER_WEEK),
+            (buckets[valid] % 24, X[valid], HOURS_PER_WEEK, 24),
+            (np.zeros(len(X), dtype=np.int64), X, HOURS_PER_WEEK + 24, 1),
+        ]
+        for keys, values, offset, size in groups:
+            if len(values) == 0:
+                continue
+            n_b = np.bincount(keys, minlength=size)
+            sums = np.stack([np.bincount(keys, weights=values[:, j], minlength=size) for j in range(values.shape[1])], axis=1)
+            with np.errstate(invalid='ignore', divide='ignore'):
+                mean_b = np.where(n_b[:, None] > 0, sums / n_b[:, None], 0.0)
+            deviations = values - mean_b[keys]
+            m2_b = np.stack([np.bincount(keys, weights=deviations[:, j] ** 2, minlength=size) for j in range(values.shape[1])], axis=1)
+            self._merge(slice(offset, offset + size), n_b, mean_b, m2_b)
+        return self
+
+    def _merge(self, rows, n_b, mean_b, m2_b):
+        # Chan et al. parallel update of count/mean/M2
+        n_a = self.count[rows]
+        total = n_a + n_b
+        safe_total = np.maximum(total, 1)[:, None]
+        delta = mean_b - self.mean[rows]
+        self.mean[rows] += delta * (n_b[:, None] / safe_total)
+        self.m2[rows] += m2_b + delta ** 2 * (n_a[:, None] * n_b[:, None] / safe_total)
+        self.count[rows] = total
+
+    def _effective(self):
+        """(169, n_features) mean and scale tables: 168 hour-of-week rows plus a global row."""
+        global_row = HOURS_PER_WEEK + 24
+        hours = np.arange(HOURS_PER_WEEK)
+        source = np.where(
+            self.count[:HOURS_PER_WEEK] >= self.min_samples,
+            hours,
+            np.where(self.count[HOURS_PER_WEEK + hours % 24] >= self.min_samples, HOURS_PER_WEEK + hours % 24, global_row),
+        )
+        source = np.append(source, global_row)
+        count = np.maximum(self.count[source], 1)[:, None]
+        scale = np.sqrt(self.m2[source] / count)
+        # Constant features keep unit scale, as StandardScaler does
+        scale[scale == 0] = 1.0
+        return self.mean[source], scale
+
+    def transform(self, X, buckets):
+        """Standardize X with each row's bucket statistics; in place unless X is not floating point."""
+        if not np.issubdtype(X.dtype, np.floating):
+            X = X.astype(np.float64)
+        mean, scale = self._effective()
+        index = np.where(buckets >= 0, buckets, HOURS_PER_WEEK)
+        X -= mean[index].astype(X.dtype, copy=False)
+        X /= scale[index].astype(X.dtype, copy=False)
+        return X
+
+    def inverse_column(self, values, buckets, j):
+        """Return column j of standardized rows in original units."""
+        mean, scale = self._effective()
+        index = np.where(buckets >= 0, buckets, HOURS_PER_WEEK)
+        return np.asarray(values, dtype=np.float64) * scale[index, j] + mean[index, j]
+
+    def save(self, path):
+        """Write the statistics to an .npz file (atomically)."""
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f'{path}.tmp.npz'
+        np.savez(
+            tmp_path, count=self.count, mean=self.mean, m2=self.m2,
+            features=np.array(self.features), timezone=self.timezone,
+        )
+        os.replace(tmp_path, path)
+        return path
+
+    @classmethod
+    def load(cls, path, features, min_samples=30, timezone='UTC'):
+        """Load statistics saved with save(); returns an empty baseline if missing or incompatible."""
+        baseline = cls(features, min_samples=min_samples, timezone=timezone)
+        if not path or not os.path.exists(path):
+            return baseline
+        try:
+            with np.load(path) as data:
+                if list(data['features']) != baseline.features or str(data['timezone']) != baseline.timezone:
+                    logging.warning(f"Seasonal baseline {path} was built for other features or timezone; starting fresh")
+                    return baseline
+                baseline.count = data['count']
+                baseline.mean = data['mean']
+                baseline.m2 = data['m2']
+        except Exception as e:
+            logging.error(f"Error loading seasonal baseline from {path}: {str(e)}")
+        return baseline
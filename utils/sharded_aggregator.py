@@ -0,0 +1,498 @@
+import logging
+import multiprocessing as mp
+import pickle
+import queue
+import time
+import weakref
+from itertools import chain
+from multiprocessing import shared_memory
+
+import numpy as np
+
+from utils.timestamps import NS_PER_SECOND, to_epoch_ns
+
+# Control block slots (int64)
+HEAD, TAIL, WATERMARK_NS, CLOSED = range(4)
+
+# CLOSED values: FINISH flushes the remaining windows, ABORT exits without them
+FINISH, ABORT = 1, 2
+
+# Every message in a ring starts with its length; WRAP marks unused space at the end of the buffer
+LENGTH_BYTES = 8
+WRAP = -1
+
+# Separator for text columns; a column with a value containing it is pickled instead
+SEPARATOR = '\x00'
+
+
+class ShardWorkerError(RuntimeError):
+    """A shard worker exited or stopped draining its ring."""
+
+
+class SharedRing:
+    """Single-producer/single-consumer ring of byte messages in shared memory.
+
+    The producer only advances TAIL and the consumer only advances HEAD, so
+    no lock is needed; a semaphore wakes the consumer when data arrives.
+    Both are byte offsets that only grow, and a message never wraps around
+    the end of the buffer.
+    """
+
+    def __init__(self, capacity, name=None, ctrl_name=None, create=True):
+        self.capacity = capacity
+        self.create = create
+        if create:
+            self.shm = shared_memory.SharedMemory(create=True, size=capacity)
+            self.ctrl_shm = shared_memory.SharedMemory(create=True, size=4 * 8)
+        else:
+            self.shm = shared_memory.SharedMemory(name=name)
+            self.ctrl_shm = shared_memory.SharedMemory(name=ctrl_name)
+        self.data = np.ndarray((capacity,), dtype=np.uint8, buffer=self.shm.buf)
+        self.ctrl = np.ndarray((4,), dtype=np.int64, buffer=self.ctrl_shm.buf)
+        if create:
+            self.ctrl[:] = 0
+
+    @property
+    def names(self):
+        return self.shm.name, self.ctrl_shm.name
+
+    def push(self, message, consumer=None, timeout=30.0):
+        """Copy one message into the ring, waiting while the consumer catches up.
+
+        Raises ShardWorkerError if the `consumer` process exits, or if no
+        room frees up within `timeout` seconds, instead of waiting forever.
+        """
+        size = LENGTH_BYTES + len(message)
+        if size > self.capacity:
+            raise ValueError(f"Message of {len(message)} bytes does not fit a ring of {self.capacity} bytes")
+        tail = int(self.ctrl[TAIL])
+        pos = tail % self.capacity
+        skip = self.capacity - pos if pos + size > self.capacity else 0
+        deadline = time.monotonic() + timeout
+        while self.capacity - (tail - int(self.ctrl[HEAD])) < skip + size:
+            if consumer is not None and not consumer.is_alive():
+                raise ShardWorkerError(f"Shard worker exited with code {consumer.exitcode}")
+            if time.monotonic() > deadline:
+                raise ShardWorkerError(f"Shard worker did not drain its ring within {timeout}s")
+            time.sleep(0.0005)
+        if skip:
+            if skip >= LENGTH_BYTES:
+                self.data[pos:pos + LENGTH_BYTES] = np.array([WRAP], dtype=np.int64).view(np.uint8)
+            pos = 0
+        self.data[pos:pos + LENGTH_BYTES] = np.array([len(message)], dtype=np.int64).view(np.uint8)
+        self.data[pos + LENGTH_BYTES:pos + size] = np.frombuffer(message, dtype=np.uint8)
+        self.ctrl[TAIL] = tail + skip + size
+
+    def pop_all(self):
+        """Return (copies of) every message the producer has published, oldest first."""
+        head, tail = int(self.ctrl[HEAD]), int(self.ctrl[TAIL])
+        messages = []
+        while head < tail:
+            pos = head % self.capacity
+            if self.capacity - pos < LENGTH_BYTES:
+                head += self.capacity - pos
+                continue
+            length = int(self.data[pos:pos + LENGTH_BYTES].view(np.int64)[0])
+            if length == WRAP:
+                head += self.capacity - pos
+                continue
+            messages.append(self.data[pos + LENGTH_BYTES:pos + LENGTH_BYTES + length].tobytes())
+            head += LENGTH_BYTES + length
+        self.ctrl[HEAD] = head
+        return messages
+
+    def close(self):
+        if self.ctrl is None:
+            return
+        # Drop numpy views before closing the mappings
+        self.data = None
+        self.ctrl = None
+        self.shm.close()
+        self.ctrl_shm.close()
+        if self.create:
+            self.shm.unlink()
+            self.ctrl_shm.unlink()
+
+
+def _shard_worker(shard_id, names, capacity, window_seconds, tcp_idle_seconds, wakeup, results):
+    """Worker process: run a RollingAggregator over one shard of the flows."""
+    from capture_to_csv import RollingAggregator
+
+    ring = SharedRing(capacity, name=names[0], ctrl_name=names[1], create=False)
+    aggregator = RollingAggregator(window_seconds=window_seconds, tcp_idle_seconds=tcp_idle_seconds)
+    window_ns = int(window_seconds * NS_PER_SECOND)
+    reported_before = None
+    try:
+        while True:
+            wakeup.acquire(timeout=0.1)
+            # Read the control flags before draining: the producer publishes
+            # batches before raising the watermark or setting CLOSED.
+            closed = int(ring.ctrl[CLOSED])
+            if closed == ABORT:
+                break
+            watermark_ns = int(ring.ctrl[WATERMARK_NS])
+            for message in ring.pop_all():
+                _add_batch(aggregator, message)
+            if closed and ring.ctrl[HEAD] == ring.ctrl[TAIL]:
+                rows = aggregator.flush_all()
+                results.put((shard_id, _tag_rows(rows), float('inf'), 0))
+                break
+            if watermark_ns:
+                flushed_before = watermark_ns - window_ns
+                if reported_before is None or flushed_before > reported_before:
+                    rows = aggregator.flush_older_than(flushed_before)
+                    results.put((shard_id, _tag_rows(rows), flushed_before, aggregator.active_flows()))
+                    reported_before = flushed_before
+    finally:
+        ring.close()
+
+
+def _tag_rows(rows):
+    return [(row['window_start_ns'], row) for row in rows]
+
+
+def _encode_batch(batch):
+    """Pack a list of add_packet() argument tuples column by column into one message.
+
+    Timestamps and TCP header fields become int64 buffers; text columns are
+    joined into one string. A column that cannot be packed that way (a value
+    that is not a string, or contains SEPARATOR) is pickled as a list, so
+    workers always see the values add_packet() was given.
+    """
+    ts, src_ip, src_port, dst_ip, dst_port, proto, length, tcp = zip(*batch)
+    columns = [_pack_text(values) for values in (src_ip, src_port, dst_ip, dst_port, proto, length)]
+    return pickle.dumps((np.array(ts, dtype=np.int64).tobytes(), columns, _pack_tcp(tcp)), protocol=pickle.HIGHEST_PROTOCOL)
+
+
+def _pack_text(values):
+    try:
+        text = SEPARATOR.join(values)
+    except TypeError:
+        return list(values)
+    if text.count(SEPARATOR) != len(values) - 1:
+        return list(values)
+    return text.encode('utf-8', 'surrogatepass')
+
+
+def _pack_tcp(tcp):
+    has_tcp = np.fromiter(map(bool, tcp), dtype=bool, count=len(tcp))
+    try:
+        fields = np.fromiter(chain.from_iterable(filter(None, tcp)), dtype=np.int64)
+    except (TypeError, ValueError, OverflowError):
+        return list(tcp)
+    if len(fields) != 3 * int(has_tcp.sum()):
+        return list(tcp)
+    return has_tcp.tobytes(), fields.tobytes()
+
+
+def _add_batch(aggregator, message):
+    """Decode one message from _encode_batch() and feed its packets to the aggregator."""
+    ts, columns, tcp = pickle.loads(message)
+    ts = np.frombuffer(ts, dtype=np.int64).tolist()
+    columns = [
+        values.decode('utf-8', 'surrogatepass').split(SEPARATOR) if isinstance(values, bytes) else values
+        for values in columns
+    ]
+    if isinstance(tcp, tuple):
+        has_tcp, fields = tcp
+        fields = iter(map(tuple, np.frombuffer(fields, dtype=np.int64).reshape(-1, 3).tolist()))
+        tcp = [next(fields) if flag else None for flag in np.frombuffer(has_tcp, dtype=bool).tolist()]
+    add_packet = aggregator.add_packet
+    for ts_ns, src_ip, src_port, dst_ip, dst_port, proto, length, tcp_fields in zip(ts, *columns, tcp):
+        add_packet(ts_ns, src_ip, src_port, dst_ip, dst_port, proto, length, tcp=tcp_fields)
+
+
+def _shutdown(procs, rings, results):
+    """Stop workers and unlink their rings; safe to call more than once."""
+    for ring in rings:
+        if ring.ctrl is not None:
+            ring.ctrl[CLOSED] = ABORT
+    for proc in procs:
+        proc.join(timeout=5)
+        if proc.is_alive():
+            proc.terminate()
+            proc.join(timeout=1)
+    for ring in rings:
+        ring.close()
+    results.close()
+
+
+class ShardedAggregator:
+    """Drop-in replacement for RollingAggregator that spreads flows over worker processes.
+
+    Packets are routed by a hash of addresses and ports, so every flow,
+    and the TCP sequence state of its connection, lives in exactly one
+    worker. add_packet() only queues the arguments on the shard's batch;
+    full batches are packed column-wise (see _encode_batch) and copied
+    into per-worker shared-memory rings. Finished windows come back on a
+    queue and are released in window order once every worker has moved
+    past them.
+
+    If a worker dies or stalls for `stall_timeout` seconds, `error` is set
+    and every later add_packet() raises ShardWorkerError, so the capture
+    can stop instead of hanging.
+
+    flush_all() stops the workers and frees the rings. close(), or leaving
+    a `with` block, does the same and drops unflushed windows; it also
+    runs when the aggregator is garbage collected or at interpreter exit.
+    """
+
+    def __init__(self, window_seconds=30, workers=2, batch_size=1024, ring_bytes=16 * 1024 * 1024, sync_interval=0.05, stall_timeout=30.0, tcp_idle_seconds=300):
+        self.window_seconds = window_seconds
+        self.workers = workers
+        self.batch_size = batch_size
+        self.sync_interval = sync_interval
+        self.stall_timeout = stall_timeout
+        self.error = None
+        ctx = mp.get_context()
+        self._results = ctx.Queue()
+        self._rings = []
+        self._wakeups = []
+        self._procs = []
+        self._batches = [[] for _ in range(workers)]
+        self._flushed_before = [float('-inf')] * workers
+        self._active = [0] * workers
+        self._pending = []
+        self._watermark = None
+        self._last_sync = time.monotonic()
+        # Registered before any worker starts, so a failure below still cleans up
+        self._finalizer = weakref.finalize(self, _shutdown, self._procs, self._rings, self._results)
+        for shard_id in range(workers):
+            ring = SharedRing(ring_bytes)
+            self._rings.append(ring)
+            wakeup = ctx.Semaphore(0)
+            proc = ctx.Process(
+                target=_shard_worker,
+                args=(shard_id, ring.names, ring_bytes, window_seconds, tcp_idle_seconds, wakeup, self._results),
+                daemon=True,
+            )
+            proc.start()
+            self._wakeups.append(wakeup)
+            self._procs.append(proc)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        self.close()
+
+    def add_packet(self, ts, src_ip, src_port, dst_ip, dst_port, proto, length, tcp=None):
+        if self.error is not None:
+            raise ShardWorkerError(self.error)
+        # Not the protocol: TCP and TLS packets of one connection share its sequence state.
+        # Only this process hashes, so Python's per-process string hash is stable enough.
+        shard = hash((src_ip, src_port, dst_ip, dst_port)) % self.workers
+        batch = self._batches[shard]
+        batch.append((ts if type(ts) is int else to_epoch_ns(ts), src_ip, src_port, dst_ip, dst_port, proto, length, tcp))
+        if len(batch) >= self.batch_size:
+            self._send(shard)
+
+    def _send(self, shard):
+        batch = self._batches[shard]
+        if not batch:
+            return
+        self._batches[shard] = []
+        latest = max(packet[0] for packet in batch)
+        if self._watermark is None or latest > self._watermark:
+            self._watermark = latest
+        try:
+            self._rings[shard].push(_encode_batch(batch), consumer=self._procs[shard], timeout=self.stall_timeout)
+        except ShardWorkerError as e:
+            self.error = f"shard {shard}: {e}"
+            logging.error(f"Sharded aggregation failed: {self.error}")
+            raise ShardWorkerError(self.error) from e
+        self._wakeups[shard].release()
+
+    def _sync(self):
+        """Push partial batches and the current watermark to every worker."""
+        for shard in range(self.workers):
+            self._send(shard)
+        for shard in range(self.workers):
+            if self._watermark is not None:
+                self._rings[shard].ctrl[WATERMARK_NS] = self._watermark
+            self._wakeups[shard].release()
+        self._last_sync = time.monotonic()
+
+    def _collect(self, block=False, timeout=0.1):
+        while True:
+            try:
+                shard_id, rows, flushed_before, active = self._results.get(block=block, timeout=timeout)
+            except queue.Empty:
+                return
+            self._pending.extend(rows)
+            self._flushed_before[shard_id] = max(self._flushed_before[shard_id], flushed_before)
+            self._active[shard_id] = active
+            if block:
+                return
+
+    def _release_ready(self):
+        ready_before = min(self._flushed_before)
+        ready = [item for item in self._pending if item[0] < ready_before]
+        if not ready:
+            return []
+        self._pending = [item for item in self._pending if item[0] >= ready_before]
+        ready.sort(key=lambda item: item[0])
+        return [row for _, row in ready]
+
+    def flush_older_than(self, cutoff):
+        # Workers flush against the watermark pushed in _sync (latest packet
+        # time), which matches the per-packet cutoff used by capture_to_csv.
+        if time.monotonic() - self._last_sync < self.sync_interval:
+            return []
+        self._sync()
+        self._collect()
+        return self._release_ready()
+
+    def flush_all(self):
+        if not self._finalizer.alive:
+            return self._release_ready()
+        for shard in range(self.workers):
+            if self.error is None:
+                try:
+                    self._send(shard)
+                except ShardWorkerError:
+                    pass
+            self._rings[shard].ctrl[CLOSED] = FINISH
+            self._wakeups[shard].release()
+        deadline = time.monotonic() + self.stall_timeout
+        while min(self._flushed_before) != float('inf'):
+            waiting = [proc for shard, proc in enumerate(self._procs) if self._flushed_before[shard] != float('inf')]
+            if not any(proc.is_alive() for proc in waiting) and self._results.empty():
+                logging.error("Sharded aggregation workers exited before finishing")
+                break
+            if time.monotonic() > deadline:
+                logging.error(f"Sharded aggregation workers sent nothing for {self.stall_timeout}s; giving up on them")
+                break
+            progress = list(self._flushed_before)
+            self._collect(block=True, timeout=0.5)
+            if self._flushed_before != progress:
+                deadline = time.monotonic() + self.stall_timeout
+        self.close()
+        self._flushed_before = [float('inf')] * self.workers
+        self._active = [0] * self.workers
+        return self._release_ready()
+
+    def close(self):
+        """Stop the workers and free the shared memory; unflushed windows are dropped."""
+        self._finalizer()
+
+    def active_flows(self):
+        return sum(self._active)
+
+
+def _synthetic_packets(packets, flows, seed):
+    """Time-ordered packets from a fixed pool of connections, with TCP sequence numbers and some retransmissions."""
+    rng = np.random.default_rng(seed)
+    start_ns = 1_700_000_000 * NS_PER_SECOND
+    ts = (start_ns + np.cumsum(rng.integers(1, 3_000_000, packets))).tolist()
+    src_ip = [f'10.{i // 65536}.{i // 256 % 256}.{i % 256}' for i in range(flows)]
+    dst_ip = [f'192.168.{i}.1' for i in rng.integers(0, 256, flows).tolist()]
+    src_port = [str(p) for p in rng.integers(1024, 65536, flows).tolist()]
+    dst_port = [str(p) for p in rng.choice([22, 53, 80, 443], flows).tolist()]
+    proto = rng.choice(['TCP', 'TLS', 'UDP', 'DNS'], flows).tolist()
+    next_seq = rng.integers(0, 2**32, flows).tolist()
+    flow_ids = rng.integers(0, flows, packets).tolist()
+    lengths = [str(n) for n in rng.integers(60, 1500, packets).tolist()]
+    payloads = rng.choice([0, 100, 1400], packets).tolist()
+    retransmit = (rng.random(packets) < 0.02).tolist()
+    out = []
+    for i, flow in enumerate(flow_ids):
+        tcp = None
+        if proto[flow] in ('TCP', 'TLS'):
+            seq = (next_seq[flow] - 1400) & 0xFFFFFFFF if retransmit[i] else next_seq[flow]
+            tcp = (0x18, seq, payloads[i])
+            next_seq[flow] = (seq + payloads[i]) & 0xFFFFFFFF
+        out.append((ts[i], src_ip[flow], src_port[flow], dst_ip[flow], dst_port[flow], proto[flow], lengths[i], tcp))
+    return out
+
+
+def _run(aggregator, packets, window_ns):
+    rows = []
+    for packet in packets:
+        aggregator.add_packet(*packet[:7], tcp=packet[7])
+        rows.extend(aggregator.flush_older_than(packet[0] - window_ns))
+    rows.extend(aggregator.flush_all())
+    return rows
+
+
+def benchmark(packets=200_000, workers=4, window_seconds=30, flows=5000, batch_size=1024, seed=0):
+    """Compare ShardedAggregator with an in-process RollingAggregator on synthetic packets.
+
+    Besides end-to-end times (which on a machine with fewer cores than
+    workers + 1 mostly measure time slicing), the capture-side work (hash,
+    encode, unpickle results) and each worker's work (decode, aggregate) are
+    timed separately in this process; the slower of the two bounds the
+    sharded throughput when every process has its own core.
+    """
+    from capture_to_csv import RollingAggregator
+
+    data = _synthetic_packets(packets, flows, seed)
+    window_ns = int(window_seconds * NS_PER_SECOND)
+
+    started = time.perf_counter()
+    expected = _run(RollingAggregator(window_seconds=window_seconds), data, window_ns)
+    single_seconds = time.perf_counter() - started
+
+    started = time.perf_counter()
+    with ShardedAggregator(window_seconds=window_seconds, workers=workers, batch_size=batch_size) as aggregator:
+        actual = _run(aggregator, data, window_ns)
+    sharded_seconds = time.perf_counter() - started
+
+    # Capture side: route and encode every batch, then unpickle the result rows
+    started = time.perf_counter()
+    batches = [[] for _ in range(workers)]
+    messages = [[] for _ in range(workers)]
+    for packet in data:
+        shard = hash(packet[1:5]) % workers
+        batches[shard].append(packet)
+        if len(batches[shard]) >= batch_size:
+            messages[shard].append(_encode_batch(batches[shard]))
+            batches[shard] = []
+    for shard in range(workers):
+        if batches[shard]:
+            messages[shard].append(_encode_batch(batches[shard]))
+    encode_seconds = time.perf_counter() - started
+
+    # Worker side: decode and aggregate each shard
+    worker_seconds = []
+    results = []
+    for shard in range(workers):
+        started = time.perf_counter()
+        shard_aggregator = RollingAggregator(window_seconds=window_seconds)
+        for message in messages[shard]:
+            _add_batch(shard_aggregator, message)
+        results.append(pickle.dumps(_tag_rows(shard_aggregator.flush_all())))
+        worker_seconds.append(time.perf_counter() - started)
+    started = time.perf_counter()
+    for result in results:
+        pickle.loads(result)
+    producer_seconds = encode_seconds + time.perf_counter() - started
+
+    def key(row):
+        return tuple(sorted(row.items()))
+
+    return {
+        'packets': packets,
+        'workers': workers,
+        'cpus': mp.cpu_count(),
+        'rows': len(expected),
+        'parity': sorted(map(key, actual)) == sorted(map(key, expected)),
+        'single_seconds': round(single_seconds, 3),
+        'sharded_seconds': round(sharded_seconds, 3),
+        'producer_seconds': round(producer_seconds, 3),
+        'max_worker_seconds': round(max(worker_seconds), 3),
+        'projected_speedup': round(single_seconds / max(producer_seconds, max(worker_seconds)), 2),
+    }
+
+
+if __name__ == "__main__":
+    import argparse
+
+    parser = argparse.ArgumentParser(description="Benchmark sharded packet aggregation against the in-process aggregator.")
+    parser.add_argument('--benchmark', type=int, default=200_000, metavar='N', help='Synthetic packets (default 200000)')
+    parser.add_argument('--workers', type=int, default=4, help='Worker processes (default 4)')
+    parser.add_argument('--flows', type=int, default=5000, help='Distinct connections (default 5000)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    print(benchmark(args.benchmark, args.workers, flows=args.flows))
@@ -0,0 +1,112 @@
+import hashlib
+import math
+
+
+def _hash64(value):
+    """Stable 64-bit hash (unlike hash(), identical across processes)."""
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'little')
+
+
+class HyperLogLog:
+    """Fixed-memory distinct-count estimator (2**precision one-byte registers)."""
+
+    def __init__(self, precision=10):
+        self.precision = precision
+        self.m = 1 << precision
+        self.registers = bytearray(self.m)
+        if self.m >= 128:
+            self._alpha = 0.7213 / (1 + 1.079 / self.m)
+        else:
+            self._alpha = {16: 0.673, 32: 0.697, 64: 0.709}[self.m]
+
+    def add(self, value):
+        x = _hash64(value)
+        index = x & (self.m - 1)
+        w = x >> self.precision
+        rank = (64 - self.precision) - w.bit_length() + 1
+        if rank > self.registers[index]:
+            self.registers[index] = rank
+
+    def merge(self, other):
+        if other.precision != self.precision:
+            raise ValueError("Cannot merge HyperLogLogs with different precision")
+        self.registers = bytearray(max(a, b) for a, b in zip(self.registers, other.registers))
+        return self
+
+    def count(self):
+        estimate = self._alpha * self.m * self.m / sum(2.0 ** -r for r in self.registers)
+        zeros = self.registers.count(0)
+        if estimate <= 2.5 * self.m and zeros:
+            # Linear counting for small cardinalities
+            estimate = self.m * math.log(self.m / zeros)
+        return int(round(estimate))
+
+
+class SpaceSaving:
+    """Top-k heavy hitters by weight in O(k) memory (Metwally et al.)."""
+
+    def __init__(self, k=16):
+        self.k = k
+        self.counts = {}
+        self.errors = {}
+
+    def add(self, item, weight=1):
+        counts = self.counts
+        if item in counts:
+            counts[item] += weight
+        elif len(counts) < self.k:
+            counts[item] = weight
+            self.errors[item] = 0
+        else:
+            victim = min(counts, key=counts.get)
+            floor = counts.pop(victim)
+            self.errors.pop(victim, None)
+            counts[item] = floor + weight
+            self.errors[item] = floor
+
+    def top(self, n=None):
+        """Return [(item, estimated weight, max overestimate)] sorted by weight."""
+        ranked = sorted(self.counts.items(), key=lambda kv: kv[1], reverse=True)
+        return [(item, count, self.errors.get(item, 0)) for item, count in ranked[:n or self.k]]
+
+
+class WindowSketch:
+    """Per-window scan/flood signals kept in fixed memory.
+
+    Tracks distinct source IPs, distinct destination ports, distinct
+    (source, destination port) pairs and the heaviest sources by bytes.
+    Features are window-wide: the same values go on every flow of the
+    window, and window_avg_dst_ports_per_src is the average over all
+    sources, not the fan-out of the flow's own source.
+    """
+
+    FEATURES = [
+        'window_distinct_src_ips',
+        'window_distinct_dst_ports',
+        'window_avg_dst_ports_per_src',
+        'window_top_src_bytes_share',
+    ]
+
+    def __init__(self, precision=10, top_k=16):
+        self.src_ips = HyperLogLog(precision)
+        self.dst_ports = HyperLogLog(precision)
+        self.src_dst_ports = HyperLogLog(precision)
+        self.talkers = SpaceSaving(top_k)
+        self.total_bytes = 0
+
+    def add(self, src_ip, dst_port, length):
+        self.src_ips.add(src_ip)
+        self.dst_ports.add(dst_port)
+        self.src_dst_ports.add(f'{src_ip}|{dst_port}')
+        self.talkers.add(src_ip, length)
+        self.total_bytes += length
+
+    def features(self):
+        distinct_src = self.src_ips.count()
+        top = self.talkers.top(1)
+        return {
+            'window_distinct_src_ips': distinct_src,
+            'window_distinct_dst_ports': self.dst_ports.count(),
+            'window_avg_dst_ports_per_src': round(self.src_dst_ports.count() / distinct_src, 4) if distinct_src else 0.0,
+            'window_top_src_bytes_share': round(top[0][1] / self.total_bytes, 4) if top and self.total_bytes else 0.0,
+        }
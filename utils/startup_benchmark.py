@@ -0,0 +1,57 @@
+import argparse
+import json
+import os
+import subprocess
+import sys
+import time
+
+PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules whose import cost startup should not pay unless they are used
+HEAVY_MODULES = ['numpy', 'pandas', 'scipy', 'sklearn', 'matplotlib', 'seaborn', 'joblib', 'pyshark']
+
+TARGETS = ['app', 'main', 'capture_to_csv']
+
+_PROBE = (
+    "import json, sys, time\n"
+    "started = time.perf_counter()\n"
+    "import {module}\n"
+    "elapsed = time.perf_counter() - started\n"
+    "print(json.dumps({{'seconds': elapsed, 'heavy': sorted(m for m in {heavy!r} if m in sys.modules)}}))\n"
+)
+
+
+def measure(module, runs=5):
+    """Import `module` in fresh interpreters; return median/min import time and heavy modules loaded."""
+    import_times = []
+    process_times = []
+    heavy = []
+    for _ in range(runs):
+        started = time.perf_counter()
+        result = subprocess.run(
+            [sys.executable, '-c', _PROBE.format(module=module, heavy=HEAVY_MODULES)],
+            capture_output=True, text=True, check=True, cwd=PROJECT_DIR,
+        )
+        process_times.append(time.perf_counter() - started)
+        probe = json.loads(result.stdout.strip().splitlines()[-1])
+        import_times.append(probe['seconds'])
+        heavy = probe['heavy']
+    import_times.sort()
+    process_times.sort()
+    return {
+        'module': module,
+        'import_median_seconds': round(import_times[len(import_times) // 2], 3),
+        'import_min_seconds': round(import_times[0], 3),
+        'process_median_seconds': round(process_times[len(process_times) // 2], 3),
+        'heavy_modules_loaded': heavy,
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Measure cold import time of the application entry points.")
+    parser.add_argument('modules', nargs='*', default=TARGETS, help=f'Modules to import (default: {" ".join(TARGETS)})')
+    parser.add_argument('--runs', type=int, default=5, help='Fresh interpreters per module (default 5)')
+    args = parser.parse_args()
+
+    for module in args.modules:
+        print(json.dumps(measure(module, args.runs)))
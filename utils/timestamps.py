@@ -0,0 +1,97 @@
+import numbers
+from datetime import datetime, timezone
+
+NS_PER_SECOND = 1_000_000_000
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+
+
+def to_epoch_ns(value):
+    """Convert a timestamp to integer nanoseconds since the Unix epoch (UTC).
+
+    Accepts integer nanoseconds, epoch seconds as a number or numeric string
+    (e.g. pyshark's sniff_timestamp), ISO 8601 strings and datetimes.
+    Naive ISO strings and datetimes are taken as UTC. Raises ValueError for
+    anything else.
+    """
+    if isinstance(value, numbers.Integral) and not isinstance(value, bool):
+        return int(value)
+    if isinstance(value, numbers.Real):
+        whole = int(value // 1)
+        return whole * NS_PER_SECOND + int(round((value - whole) * NS_PER_SECOND))
+    if isinstance(value, datetime):
+        if value.tzinfo is None:
+            value = value.replace(tzinfo=timezone.utc)
+        delta = value - _EPOCH
+        return (delta.days * 86400 + delta.seconds) * NS_PER_SECOND + delta.microseconds * 1000
+    text = str(value).strip()
+    # Split numeric strings on the dot so sub-microsecond digits survive
+    whole, _, frac = text.partition('.')
+    if whole.isdigit() and (not frac or frac.isdigit()):
+        return int(whole) * NS_PER_SECOND + int(frac[:9].ljust(9, '0'))
+    return to_epoch_ns(datetime.fromisoformat(text))
+
+
+def iso_utc(epoch_ns):
+    """Format nanosecond epochs as second-resolution UTC ISO strings, vectorized."""
+    # Imported here so per-packet callers (capture CLI) do not load numpy at startup
+    import numpy as np
+
+    values = np.asarray(epoch_ns, dtype=np.int64).astype('datetime64[ns]').astype('datetime64[s]')
+    return [f'{text}+00:00' for text in np.datetime_as_string(values, unit='s').tolist()]
+
+
+def epoch_ns_column(values):
+    """Vectorized to_epoch_ns: returns (int64 ns, valid mask); naive times are UTC.
+
+    Zero or missing values are invalid, as aggregate_rows skips falsy timestamps.
+    """
+    # Imported here for the same reason as in iso_utc()
+    import numpy as np
+    import pandas as pd
+
+    series = pd.Series(values).reset_index(drop=True)
+    n = len(series)
+    if pd.api.types.is_integer_dtype(series):
+        out = series.to_numpy(dtype=np.int64)
+        return out, out != 0
+    if pd.api.types.is_float_dtype(series):
+        values = series.to_numpy(dtype=np.float64)
+        valid = ~np.isnan(values) & (values != 0)
+        values = np.where(valid, values, 0.0)
+        whole = np.floor(values)
+        out = whole.astype(np.int64) * NS_PER_SECOND + np.round((values - whole) * NS_PER_SECOND).astype(np.int64, copy=False)
+        return np.where(valid, out, 0), valid
+
+    text = series.astype(str).str.strip()
+    out = np.zeros(n, dtype=np.int64)
+    valid = np.zeros(n, dtype=bool)
+
+    # Epoch seconds strings such as pyshark's sniff_timestamp
+    numeric = text.str.fullmatch(r'\d+(\.\d*)?').to_numpy(dtype=bool)
+    if numeric.any():
+        parts = text[numeric].str.split('.', n=1)
+        whole = parts.str[0].astype(np.int64).to_numpy()
+        frac = parts.str[1].fillna('').str.slice(0, 9).str.ljust(9, '0').astype(np.int64).to_numpy()
+        out[numeric] = whole * NS_PER_SECOND + frac
+        valid[numeric] = True
+
+    rest = ~numeric & (text != '').to_numpy(dtype=bool)
+    if rest.any():
+        parsed = pd.to_datetime(text[rest], utc=True, format='ISO8601', errors='coerce')
+        ok = parsed.notna().to_numpy()
+        ns = parsed.dt.tz_convert(None).dt.as_unit('ns').to_numpy()
+        index = np.flatnonzero(rest)[ok]
+        out[index] = ns[ok].view(np.int64)
+        valid[index] = True
+    return out, valid
+
+
+def epoch_seconds(timestamps):
+    """Whole epoch seconds of each timestamp (naive times are UTC), None where it does not parse."""
+    # Imported here for the same reason as in iso_utc()
+    import pandas as pd
+
+    parsed = pd.to_datetime(pd.Series(timestamps).astype(str), utc=True, format='mixed', errors='coerce')
+    seconds = (parsed - pd.Timestamp(0, tz='UTC')) // pd.Timedelta(seconds=1)
+    return [None if pd.isna(v) else int(v) for v in seconds]
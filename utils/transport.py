@@ -0,0 +1,612 @@
+import argparse
+import json
+import logging
+import os
+import re
+import socket
+import socketserver
+import struct
+import sys
+import threading
+import time
+import zlib
+from array import array
+from collections import deque
+from itertools import accumulate
+from datetime import datetime
+
+from utils.metrics import registry as metrics
+
+# Sensor side imports only the standard library (plus utils.metrics), so a
+# capture host does not need numpy, pandas or scikit-learn to ship windows.
+
+MAGIC = b'NADF'
+ACK_MAGIC = b'NADA'
+VERSION = 2
+FLAG_ZLIB = 0x01
+# magic, version, flags, padding, row count, payload length
+FRAME_HEADER = struct.Struct('!4sBBxxII')
+# magic, acknowledged sequence number
+ACK = struct.Struct('!4sQ')
+MAX_FRAME_BYTES = 64 * 1024 * 1024
+# Limit on the decompressed payload, so a small compressed frame cannot expand without bound
+MAX_PAYLOAD_BYTES = 64 * 1024 * 1024
+# Boots per sensor whose last sequence number is kept in the collector's state file
+MAX_BOOTS = 16
+
+
+def _column_kind(values):
+    if all(type(v) is int for v in values):
+        return 'i'
+    if all(type(v) in (int, float) for v in values):
+        return 'f'
+    return 's'
+
+
+def _pack_numbers(values, typecode):
+    packed = array(typecode, values)
+    if sys.byteorder != 'little':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def _unpack_numbers(data, typecode):
+    values = array(typecode)
+    values.frombytes(data)
+    if sys.byteorder != 'little':
+        values.byteswap()
+    return values.tolist()
+
+
+def encode_frame(rows, sensor_id, boot, seq, compress=True):
+    """Encode flow-window dicts as one length-prefixed, column-oriented binary frame.
+
+    Integer and float columns are packed as little-endian int64/float64
+    arrays, other columns as the length of each value (uint32, in
+    characters) followed by the concatenated UTF-8 text, so values may
+    contain any character. The payload is zlib-compressed when `compress`
+    is set.
+    """
+    columns = []
+    for row in rows:
+        for name in row:
+            if name not in columns:
+                columns.append(name)
+    kinds = []
+    blocks = []
+    for name in columns:
+        values = [row.get(name, '') for row in rows]
+        kind = _column_kind(values)
+        kinds.append(kind)
+        if kind == 'i':
+            blocks.append(_pack_numbers(values, 'q'))
+        elif kind == 'f':
+            blocks.append(_pack_numbers([float(v) for v in values], 'd'))
+        else:
+            strings = ['' if v is None else str(v) for v in values]
+            text = ''.join(strings).encode('utf-8')
+            blocks.append(_pack_numbers(map(len, strings), 'I') + struct.pack('!I', len(text)) + text)
+    meta = json.dumps({
+        'sensor': sensor_id,
+        'boot': boot,
+        'seq': seq,
+        'columns': [[name, kind] for name, kind in zip(columns, kinds)],
+    }, separators=(',', ':')).encode('utf-8')
+    payload = struct.pack('!I', len(meta)) + meta + b''.join(blocks)
+    if len(payload) > MAX_PAYLOAD_BYTES:
+        raise ValueError(f"Frame payload of {len(payload)} bytes exceeds the {MAX_PAYLOAD_BYTES} byte limit; send smaller batches")
+    flags = 0
+    if compress:
+        payload = zlib.compress(payload, 6)
+        flags |= FLAG_ZLIB
+    return FRAME_HEADER.pack(MAGIC, VERSION, flags, len(rows), len(payload)) + payload
+
+
+def decode_payload(flags, n_rows, payload):
+    """Inverse of encode_frame() for the bytes after the header; returns (meta, rows).
+
+    Raises ValueError when the payload decompresses to more than MAX_PAYLOAD_BYTES.
+    """
+    if flags & FLAG_ZLIB:
+        decompressor = zlib.decompressobj()
+        payload = decompressor.decompress(payload, MAX_PAYLOAD_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ValueError(f"Frame payload decompresses to more than {MAX_PAYLOAD_BYTES} bytes")
+    (meta_len,) = struct.unpack_from('!I', payload, 0)
+    offset = 4 + meta_len
+    meta = json.loads(payload[4:offset].decode('utf-8'))
+    columns = {}
+    for name, kind in meta['columns']:
+        if kind in ('i', 'f'):
+            size = 8 * n_rows
+            columns[name] = _unpack_numbers(payload[offset:offset + size], 'q' if kind == 'i' else 'd')
+            offset += size
+        else:
+            lengths = _unpack_numbers(payload[offset:offset + 4 * n_rows], 'I')
+            offset += 4 * n_rows
+            (size,) = struct.unpack_from('!I', payload, offset)
+            offset += 4
+            text = payload[offset:offset + size].decode('utf-8')
+            offset += size
+            if len(lengths) != n_rows or sum(lengths) != len(text):
+                raise ValueError(f"Column {name} does not match its value lengths")
+            ends = list(accumulate(lengths))
+            columns[name] = [text[end - length:end] for end, length in zip(ends, lengths)]
+    names = list(columns)
+    rows = [dict(zip(names, values)) for values in zip(*columns.values())]
+    return meta, rows
+
+
+def _read_exact(sock, n):
+    chunks = []
+    remaining = n
+    while remaining:
+        chunk = sock.recv(min(remaining, 1024 * 1024))
+        if not chunk:
+            raise ConnectionError("Connection closed")
+        chunks.append(chunk)
+        remaining -= len(chunk)
+    return b''.join(chunks)
+
+
+def recv_frame(sock):
+    """Read one frame; returns (meta, rows, wire bytes) or None on a clean close."""
+    header = sock.recv(FRAME_HEADER.size)
+    if not header:
+        return None
+    if len(header) < FRAME_HEADER.size:
+        header += _read_exact(sock, FRAME_HEADER.size - len(header))
+    magic, version, flags, n_rows, length = FRAME_HEADER.unpack(header)
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"Bad frame header (magic={magic!r}, version={version})")
+    if length > MAX_FRAME_BYTES:
+        raise ValueError(f"Frame of {length} bytes exceeds the {MAX_FRAME_BYTES} byte limit")
+    meta, rows = decode_payload(flags, n_rows, _read_exact(sock, length))
+    return meta, rows, FRAME_HEADER.size + length
+
+
+class FrameSpool:
+    """Bounded FIFO of encoded frames waiting for an acknowledgement.
+
+    With a directory every frame is also a file, so frames survive a sensor
+    restart; otherwise frames are kept in memory. When the spool would grow
+    past `max_bytes` the oldest frames are dropped.
+    """
+
+    def __init__(self, directory=None, max_bytes=64 * 1024 * 1024):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.bytes = 0
+        self.dropped = 0
+        self._frames = deque()  # (key, data or None when only on disk, size)
+        self._lock = threading.Lock()
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+            for name in sorted(os.listdir(directory)):
+                if name.endswith('.frame'):
+                    size = os.path.getsize(os.path.join(directory, name))
+                    self._frames.append((name[:-len('.frame')], None, size))
+                    self.bytes += size
+
+    def __len__(self):
+        return len(self._frames)
+
+    def push(self, key, data):
+        with self._lock:
+            if self.directory:
+                path = os.path.join(self.directory, f'{key}.frame')
+                with open(f'{path}.tmp', 'wb') as f:
+                    f.write(data)
+                os.replace(f'{path}.tmp', path)
+            self._frames.append((key, data, len(data)))
+            self.bytes += len(data)
+            while self.bytes > self.max_bytes and len(self._frames) > 1:
+                self._remove_oldest()
+                self.dropped += 1
+
+    def peek(self):
+        """Oldest (key, data), or None when empty."""
+        with self._lock:
+            if not self._frames:
+                return None
+            key, data, _ = self._frames[0]
+        if data is None:
+            with open(os.path.join(self.directory, f'{key}.frame'), 'rb') as f:
+                data = f.read()
+        return key, data
+
+    def pop(self, key):
+        """Remove the oldest frame if it is still `key` (it may have been dropped meanwhile)."""
+        with self._lock:
+            if self._frames and self._frames[0][0] == key:
+                self._remove_oldest()
+
+    def _remove_oldest(self):
+        key, _, size = self._frames.popleft()
+        self.bytes -= size
+        if self.directory:
+            try:
+                os.remove(os.path.join(self.directory, f'{key}.frame'))
+            except FileNotFoundError:
+                pass
+
+
+class SensorClient:
+    """Ships flushed flow windows to a collector over TCP.
+
+    send() encodes a batch into a frame and spools it; a background thread
+    delivers spooled frames in order, one at a time, and removes each only
+    when the collector acknowledges it. Lost connections are retried with
+    exponential backoff while new frames keep accumulating in the bounded
+    spool. Pass send as `on_rows` to capture_to_csv().
+    """
+
+    def __init__(self, host, port, sensor_id=None, spool_dir=None, max_spool_bytes=64 * 1024 * 1024,
+                 compress=True, connect_timeout=5.0, ack_timeout=30.0, max_backoff=30.0):
+        self.address = (host, int(port))
+        self.sensor_id = sensor_id or socket.gethostname()
+        self.compress = compress
+        self.connect_timeout = connect_timeout
+        self.ack_timeout = ack_timeout
+        self.max_backoff = max_backoff
+        self.spool = FrameSpool(spool_dir, max_spool_bytes)
+        # Frames are deduplicated per (sensor, boot); spooled frames keep their original boot
+        self.boot = time.time_ns()
+        self.seq = 0
+        self.stats = {
+            'frames_sent': 0,
+            'rows_sent': 0,
+            'rows_queued': 0,
+            'wire_bytes': 0,
+            'connection_errors': 0,
+            'last_error': None,
+        }
+        self.started_at = time.time()
+        self._sock = None
+        self._wake = threading.Event()
+        # Set by close(); also interrupts a reconnect backoff
+        self._close_event = threading.Event()
+        self._closing = False
+        self._thread = threading.Thread(target=self._run, name='sensor-sender', daemon=True)
+        self._thread.start()
+
+    def send(self, rows):
+        """Encode and spool a batch of flow-window dicts (non-blocking)."""
+        if not rows:
+            return
+        self.seq += 1
+        frame = encode_frame(rows, self.sensor_id, self.boot, self.seq, compress=self.compress)
+        self.spool.push(f'{self.boot:020d}_{self.seq:012d}', frame)
+        self.stats['rows_queued'] += len(rows)
+        self._wake.set()
+
+    def _connect(self):
+        sock = socket.create_connection(self.address, timeout=self.connect_timeout)
+        sock.settimeout(self.ack_timeout)
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        return sock
+
+    def _disconnect(self):
+        if self._sock is not None:
+            try:
+                self._sock.close()
+            except OSError:
+                pass
+            self._sock = None
+
+    def _run(self):
+        backoff = 0.5
+        while True:
+            item = self.spool.peek()
+            if item is None:
+                if self._closing:
+                    break
+                self._wake.wait(0.5)
+                self._wake.clear()
+                continue
+            key, frame = item
+            try:
+                if self._sock is None:
+                    self._sock = self._connect()
+                    logging.info(f"Sensor {self.sensor_id} connected to collector {self.address[0]}:{self.address[1]}")
+                self._sock.sendall(frame)
+                magic, seq = ACK.unpack(_read_exact(self._sock, ACK.size))
+                if magic != ACK_MAGIC or seq != int(key.split('_')[1]):
+                    raise ConnectionError(f"Unexpected acknowledgement {magic!r} {seq}")
+                self.spool.pop(key)
+                _, _, _, n_rows, _ = FRAME_HEADER.unpack_from(frame)
+                self.stats['frames_sent'] += 1
+                self.stats['rows_sent'] += n_rows
+                self.stats['wire_bytes'] += len(frame)
+                backoff = 0.5
+            except (OSError, ConnectionError, struct.error) as e:
+                self._disconnect()
+                self.stats['connection_errors'] += 1
+                self.stats['last_error'] = str(e)
+                logging.warning(f"Sensor {self.sensor_id}: collector unreachable ({str(e)}); retrying in {backoff:.1f}s, {len(self.spool)} frames spooled")
+                if self._closing or self._close_event.wait(backoff):
+                    break
+                backoff = min(backoff * 2, self.max_backoff)
+        self._disconnect()
+
+    def close(self, timeout=10.0):
+        """Try to deliver spooled frames for up to `timeout` seconds, then stop.
+
+        Undelivered frames stay in the spool directory (when one is set) and
+        are sent by the next SensorClient using it.
+        """
+        deadline = time.monotonic() + timeout
+        while len(self.spool) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        self._closing = True
+        self._close_event.set()
+        self._wake.set()
+        self._thread.join(max(deadline - time.monotonic(), 0.1))
+        return self.snapshot()
+
+    def snapshot(self):
+        elapsed = max(time.time() - self.started_at, 1e-9)
+        return {
+            'sensor_id': self.sensor_id,
+            'collector': f'{self.address[0]}:{self.address[1]}',
+            'connected': self._sock is not None,
+            **self.stats,
+            'spool_frames': len(self.spool),
+            'spool_bytes': self.spool.bytes,
+            'frames_dropped': self.spool.dropped,
+            'rows_per_second': round(self.stats['rows_sent'] / elapsed, 2),
+        }
+
+
+class RemoteSensor:
+    """Collector-side state of one sensor: output segments, dedup position and throughput.
+
+    Provides the session interface ScoringService expects (id, output_file,
+    manifest, record_scores, record_dropped).
+    """
+
+    def __init__(self, sensor_id, output_dir, rotation=None):
+        self.id = sensor_id
+        safe_name = re.sub(r'[^A-Za-z0-9_.-]', '_', sensor_id)
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.output_file = os.path.join(output_dir, f'sensor_{safe_name}_{timestamp}.csv')
+        self.rotation = rotation or {}
+        self.manifest = None
+        self.writer = None
+        # Dedup positions outlive the collector process: stored next to the sensor's manifests
+        self.state_path = os.path.join(output_dir, f'sensor_{safe_name}.seq.json')
+        self.last_seq = self._load_state()  # boot -> highest stored sequence number
+        self.metric_name = safe_name
+        self.lock = threading.Lock()
+        self.stats = {
+            'frames': 0,
+            'rows': 0,
+            'wire_bytes': 0,
+            'duplicates': 0,
+            'connections': 0,
+            'address': None,
+            'first_seen': None,
+            'last_seen': None,
+        }
+        self.scoring = {'windows_scored': 0, 'anomalies': 0, 'min_score': None, 'batches_dropped': 0, 'last_error': None}
+
+    def store(self, columns, rows):
+        """Append rows to this sensor's rotating CSV output."""
+        if self.writer is None:
+            from utils.rotation import RotatingCsvWriter
+            header = [name for name in columns if name != 'window_start_ns']
+            self.writer = RotatingCsvWriter(
+                self.output_file, header,
+                max_bytes=int(self.rotation.get('max_mb', 0) * 1024 * 1024),
+                max_seconds=self.rotation.get('interval_seconds', 0),
+                compress=self.rotation.get('compress', True),
+            )
+            self.manifest = self.writer.manifest_path
+        self.writer.write_rows(rows)
+
+    def _load_state(self):
+        try:
+            with open(self.state_path, 'r', encoding='utf-8') as f:
+                return {int(boot): int(seq) for boot, seq in json.load(f).items()}
+        except FileNotFoundError:
+            return {}
+        except (ValueError, OSError) as e:
+            logging.error(f"Error loading sensor state {self.state_path}: {str(e)}")
+            return {}
+
+    def mark_stored(self, boot, seq):
+        """Record that frame (boot, seq) is stored, on disk before it is acknowledged.
+
+        The state file is fsynced and then swapped in with os.replace(), so a
+        crash leaves either the old or the new positions, never a partial file.
+        """
+        self.last_seq[boot] = seq
+        for old in sorted(self.last_seq)[:max(len(self.last_seq) - MAX_BOOTS, 0)]:
+            del self.last_seq[old]
+        tmp_path = f'{self.state_path}.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump({str(boot): seq for boot, seq in self.last_seq.items()}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.state_path)
+
+    def record_scores(self, windows, anomalies, min_score, latency=None):
+        with self.lock:
+            self.scoring['windows_scored'] += windows
+            self.scoring['anomalies'] += anomalies
+            if self.scoring['min_score'] is None or min_score < self.scoring['min_score']:
+                self.scoring['min_score'] = round(min_score, 6)
+
+    def record_dropped(self, error=None):
+        with self.lock:
+            self.scoring['batches_dropped'] += 1
+            if error:
+                self.scoring['last_error'] = error
+
+    def snapshot(self):
+        with self.lock:
+            stats = dict(self.stats)
+            scoring = dict(self.scoring)
+        span = (stats['last_seen'] or 0) - (stats['first_seen'] or 0)
+        stats['rows_per_second'] = round(stats['rows'] / span, 2) if span > 0 else None
+        return {'id': self.id, 'manifest': self.manifest, **stats, 'scoring': scoring}
+
+
+class _FrameHandler(socketserver.BaseRequestHandler):
+    def handle(self):
+        self.server.collector._serve_connection(self.request, self.client_address)
+
+
+class _Server(socketserver.ThreadingTCPServer):
+    allow_reuse_address = True
+    daemon_threads = True
+
+
+class Collector:
+    """TCP server that receives sensor frames, stores them per sensor and queues them for scoring.
+
+    Each frame is written to the sensor's rotating output and handed to
+    `scoring` (a capture_manager.ScoringService) before it is acknowledged,
+    so delivery is at-least-once; frames replayed after a reconnect are
+    recognised by (boot, sequence number) and only acknowledged again. The
+    last stored sequence number per (sensor, boot) is kept in a state file
+    in `output_dir`, so this also holds across collector restarts.
+    """
+
+    def __init__(self, host='0.0.0.0', port=9900, output_dir=os.path.join('uploads', 'sensors'), rotation=None, scoring=None):
+        self.output_dir = output_dir
+        self.rotation = rotation
+        self.scoring = scoring
+        self.sensors = {}
+        self._connections = set()
+        self._lock = threading.Lock()
+        self._server = _Server((host, port), _FrameHandler)
+        self._server.collector = self
+        self._thread = None
+
+    @property
+    def address(self):
+        return self._server.server_address
+
+    def start(self):
+        os.makedirs(self.output_dir, exist_ok=True)
+        self._thread = threading.Thread(target=self._server.serve_forever, name='collector', daemon=True)
+        self._thread.start()
+        logging.info(f"Collector listening on {self.address[0]}:{self.address[1]}")
+        return self
+
+    def _sensor(self, sensor_id):
+        with self._lock:
+            sensor = self.sensors.get(sensor_id)
+            if sensor is None:
+                sensor = self.sensors[sensor_id] = RemoteSensor(sensor_id, self.output_dir, self.rotation)
+            return sensor
+
+    def _serve_connection(self, sock, client_address):
+        sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        sensor = None
+        with self._lock:
+            self._connections.add(sock)
+        try:
+            while True:
+                received = recv_frame(sock)
+                if received is None:
+                    return
+                meta, rows, wire_bytes = received
+                if sensor is None or sensor.id != meta['sensor']:
+                    sensor = self._sensor(meta['sensor'])
+                    with sensor.lock:
+                        sensor.stats['connections'] += 1
+                        sensor.stats['address'] = f'{client_address[0]}:{client_address[1]}'
+                self._accept(sensor, meta, rows, wire_bytes)
+                sock.sendall(ACK.pack(ACK_MAGIC, meta['seq']))
+        except (OSError, ConnectionError) as e:
+            logging.info(f"Sensor connection from {client_address[0]} closed: {str(e)}")
+        except Exception as e:
+            logging.error(f"Error handling sensor frames from {client_address[0]}: {str(e)}")
+        finally:
+            with self._lock:
+                self._connections.discard(sock)
+
+    def _accept(self, sensor, meta, rows, wire_bytes):
+        now = time.time()
+        with sensor.lock:
+            boot, seq = meta['boot'], meta['seq']
+            duplicate = seq <= sensor.last_seq.get(boot, 0)
+            if not duplicate:
+                sensor.store([name for name, _ in meta['columns']], rows)
+                sensor.mark_stored(boot, seq)
+            stats = sensor.stats
+            stats['frames'] += 1
+            stats['wire_bytes'] += wire_bytes
+            stats['first_seen'] = stats['first_seen'] or now
+            stats['last_seen'] = now
+            if duplicate:
+                stats['duplicates'] += 1
+                return
+            stats['rows'] += len(rows)
+        metrics.incr(f'collector_rows_{sensor.metric_name}', len(rows))
+        metrics.incr(f'collector_bytes_{sensor.metric_name}', wire_bytes)
+        if self.scoring is not None:
+            self.scoring.submit(sensor, rows)
+
+    def snapshot(self):
+        return {
+            'address': f'{self.address[0]}:{self.address[1]}',
+            'sensors': [sensor.snapshot() for sensor in self.sensors.values()],
+            'scoring': self.scoring.snapshot() if self.scoring is not None else None,
+        }
+
+    def stop(self):
+        """Stop listening, drop sensor connections and close every sensor's output."""
+        self._server.shutdown()
+        self._server.server_close()
+        with self._lock:
+            connections = list(self._connections)
+        for sock in connections:
+            try:
+                sock.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+        for sensor in self.sensors.values():
+            with sensor.lock:
+                if sensor.writer is not None:
+                    sensor.writer.close()
+                    sensor.writer = None
+        if self.scoring is not None:
+            self.scoring.close()
+        return self.snapshot()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Central collector for flow windows shipped by remote sensors.")
+    parser.add_argument('command', choices=['collector'], help='Run the collector')
+    parser.add_argument('--host', default=None, help='Listen address (default: collector.host in config)')
+    parser.add_argument('--port', type=int, default=None, help='Listen port (default: collector.port in config)')
+    parser.add_argument('--config', default='config.json', help='Config file (default config.json)')
+    parser.add_argument('--no-score', action='store_true', help='Only store windows, do not score them')
+    parser.add_argument('--status-interval', type=float, default=60.0, help='Seconds between status lines (default 60)')
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(message)s')
+    with open(args.config, 'r', encoding='utf-8') as f:
+        config = json.load(f)
+    options = config.get('collector', {})
+    scoring = None
+    if not args.no_score:
+        from utils.capture_manager import ScoringService
+        scoring = ScoringService(args.config, queue_size=options.get('scoring_queue_size', 64))
+    collector = Collector(
+        args.host or options.get('host', '0.0.0.0'),
+        args.port or options.get('port', 9900),
+        output_dir=options.get('output_dir', os.path.join('uploads', 'sensors')),
+        rotation=config.get('capture_manager', {}).get('rotation'),
+        scoring=scoring,
+    ).start()
+    try:
+        while True:
+            time.sleep(args.status_interval)
+            print(json.dumps(collector.snapshot()))
+    except KeyboardInterrupt:
+        pass
+    print(json.dumps(collector.stop(), indent=2))